@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'expense_tracker.settings')
+# Each ASGI request runs its database work in a thread of its own, so
+# persistent connections would leak; see DATABASES in settings. Set
+# ASYNC_READS=True as well to serve the hot reads with async views.
+os.environ.setdefault('CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
@@ -14,6 +14,7 @@ import os
 import dj_database_url
 from pathlib import Path
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 from urllib.parse import urlparse
 from django.core.exceptions import ImproperlyConfigured
 
@@ -53,13 +54,66 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'expenses.authentication.CachedTokenAuthentication',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'expenses.pagination.KeysetPagination',
 }
 
+# Token -> user lookups are cached in-process for LOCAL_TTL seconds, which
+# bounds how long a revoked token keeps working on other workers. Set
+# CACHE_ALIAS to a shared backend (not local memory) to also keep them there
+# for TTL seconds.
+TOKEN_AUTH_CACHE = {
+    'MAX_ENTRIES': int(os.getenv('TOKEN_AUTH_CACHE_MAX_ENTRIES', '10000')),
+    'TTL': int(os.getenv('TOKEN_AUTH_CACHE_TTL', '300')),
+    'LOCAL_TTL': int(os.getenv('TOKEN_AUTH_CACHE_LOCAL_TTL', '5')),
+    'CACHE_ALIAS': os.getenv('TOKEN_AUTH_CACHE_ALIAS') or None,
+}
+
+# Per-user response cache for balance and expense list reads, invalidated by
+# bumping each affected user's data version on writes. CACHE_ALIAS must name
+# a cache shared by all workers; with a local-memory one the cache is off
+# unless ALLOW_LOCAL says there is only a single process.
+RESPONSE_CACHE = {
+    'CACHE_ALIAS': os.getenv('RESPONSE_CACHE_ALIAS', 'default'),
+    'TIMEOUT': int(os.getenv('RESPONSE_CACHE_TIMEOUT', '86400')),
+    'ALLOW_LOCAL': os.getenv('RESPONSE_CACHE_ALLOW_LOCAL', 'False') == 'True',
+}
+
+# Per-route request metrics, served in Prometheus format at /api/metrics.
+# When METRICS_TOKEN is set, scrapes must send "Authorization: Bearer <token>";
+# without it only logged in staff can read them.
+METRICS = {
+    'TOKEN': os.getenv('METRICS_TOKEN') or None,
+}
+
+# Responses to POSTs sent with an Idempotency-Key header are replayed to
+# retries for TTL seconds. Queue a purge_idempotency_keys job to delete
+# expired ones.
+IDEMPOTENCY = {
+    'TTL': int(os.getenv('IDEMPOTENCY_TTL', '86400')),
+}
+
+# Queries slower than THRESHOLD_MS are logged and grouped by fingerprint; the
+# worst offenders are listed at /admin/slow-queries/. The grouped log is kept
+# in memory per process, so that page only shows the worker that served it.
+SLOW_QUERIES = {
+    'THRESHOLD_MS': int(os.getenv('SLOW_QUERY_THRESHOLD_MS', '200')),
+    'MAX_FINGERPRINTS': int(os.getenv('SLOW_QUERY_MAX_FINGERPRINTS', '500')),
+    'STACK_DEPTH': int(os.getenv('SLOW_QUERY_STACK_DEPTH', '8')),
+}
+
+# Serve the hot read endpoints with the async views in expenses/async_views.py.
+# Off by default and only worth turning on when serving expense_tracker.asgi;
+# under WSGI the sync viewsets are faster. ASGI has not yet been measured
+# against Postgres, and it runs with CONN_MAX_AGE=0 (see DATABASES), so put a
+# connection pooler such as PgBouncer in front of the database first.
+ASYNC_READS = os.getenv('ASYNC_READS', 'False') == 'True'
+
 MIDDLEWARE = [
+    'expenses.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    'expenses.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,15 +147,21 @@ WSGI_APPLICATION = 'expense_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# asgi.py sets CONN_MAX_AGE=0: under ASGI each request gets its own database
+# thread, so persistent connections would pile up instead of being reused.
+# That means a new connection per request, so ASGI deployments should connect
+# through a pooler such as PgBouncer; in transaction pooling mode also set
+# DISABLE_SERVER_SIDE_CURSORS=True, as the exports' iterator() uses them.
 DATABASES = {
     'default': dj_database_url.config(
-        conn_max_age=600,
+        conn_max_age=int(os.getenv('CONN_MAX_AGE', '600')),
         ssl_require=True
     )
 }
 
 if DATABASES['default'] == {}:
     raise ImproperlyConfigured('DATABASE_URL environment variable is not set')
+DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = os.getenv('DISABLE_SERVER_SIDE_CURSORS', 'False') == 'True'
 
 
 # Password validation
@@ -123,11 +183,31 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 PASSWORD_HASHERS = [
-    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'expenses.hashers.BCryptSHA256PasswordHasher',
     'django.contrib.auth.hashers.PBKDF2PasswordHasher',
     'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
     'django.contrib.auth.hashers.Argon2PasswordHasher',
 ]
+
+# bcrypt work factor; logins re-hash passwords stored with a different one
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+
+# Login/register hash passwords on a bounded thread pool. Requests beyond
+# QUEUE_LIMIT in flight are rejected with 503 instead of queueing.
+PASSWORD_HASHING_POOL = {
+    'WORKERS': int(os.getenv('PASSWORD_HASHING_WORKERS', '4')),
+    'QUEUE_LIMIT': int(os.getenv('PASSWORD_HASHING_QUEUE_LIMIT', '64')),
+}
+
+# Background jobs run by `manage.py run_worker`. Failed jobs are retried
+# after BACKOFF_SECONDS, doubling per attempt up to MAX_BACKOFF_SECONDS.
+JOB_QUEUE = {
+    'MAX_ATTEMPTS': int(os.getenv('JOB_MAX_ATTEMPTS', '3')),
+    'BACKOFF_SECONDS': int(os.getenv('JOB_BACKOFF_SECONDS', '10')),
+    'MAX_BACKOFF_SECONDS': int(os.getenv('JOB_MAX_BACKOFF_SECONDS', '3600')),
+    'STALE_AFTER_SECONDS': int(os.getenv('JOB_STALE_AFTER_SECONDS', '900')),
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -147,8 +227,13 @@ STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')  
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'  
 
+# Files written by background jobs, such as exports
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
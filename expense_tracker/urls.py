@@ -16,8 +16,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from expenses.admin import slow_queries_view
 
 urlpatterns = [
+    path('admin/slow-queries/', admin.site.admin_view(slow_queries_view), name='slow-queries'),
     path('admin/', admin.site.urls),
     path('api/', include('expenses.urls')),
 ]
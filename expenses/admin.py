@@ -1,5 +1,11 @@
 from django.contrib import admin
-from .models import Friend, Expense, ExpenseItem, ExpenseShare, Payment
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from . import slow_queries
+from .models import (
+    Friend, Expense, ExpenseItem, ExpenseShare, Payment, BalanceLedger,
+    Friendship, MonthlyRollup, Job
+)
 
 # Inline for ExpenseItem related to Expense
 class ExpenseItemInline(admin.TabularInline):
@@ -31,12 +37,55 @@ class ExpenseItemAdmin(admin.ModelAdmin):
 
 @admin.register(ExpenseShare)
 class ExpenseShareAdmin(admin.ModelAdmin):
-    list_display = ('expense', 'participant', 'amount', 'paid_by', 'settled')
+    list_display = ('expense', 'participant', 'amount', 'settled_amount', 'settled')
     search_fields = ('expense__title', 'participant__username')
-    list_filter = ('paid_by', 'settled', 'participant')  
+    list_filter = ('settled', 'participant')  
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ('from_user', 'to_user', 'amount', 'created_at')
     search_fields = ('from_user__username', 'to_user__username', 'notes')
-    list_filter = ('created_at', 'from_user', 'to_user')  
\ No newline at end of file
+    list_filter = ('created_at', 'from_user', 'to_user')
+
+@admin.register(BalanceLedger)
+class BalanceLedgerAdmin(admin.ModelAdmin):
+    list_display = ('debtor', 'creditor', 'amount')
+    search_fields = ('debtor__username', 'creditor__username')
+
+@admin.register(Friendship)
+class FriendshipAdmin(admin.ModelAdmin):
+    list_display = ('user', 'friend', 'created_at')
+    search_fields = ('user__username', 'friend__username')
+
+@admin.register(MonthlyRollup)
+class MonthlyRollupAdmin(admin.ModelAdmin):
+    list_display = ('user', 'counterparty', 'month', 'paid', 'owed', 'settled', 'received')
+    search_fields = ('user__username', 'counterparty__username')
+    list_filter = ('month',)
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'max_attempts', 'run_after', 'created_by', 'created_at')
+    search_fields = ('kind', 'created_by__username', 'locked_by')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('created_at', 'updated_at', 'locked_at', 'locked_by')
+
+# Top slow query fingerprints of this web process (the log is per process,
+# see expenses.slow_queries); wrapped with
+# admin.site.admin_view in the project urls so only staff can see it
+def slow_queries_view(request):
+    if request.method == 'POST':
+        slow_queries.log.reset()
+        return redirect(request.path)
+    order = request.GET.get('o', 'total')
+    if order not in ('total', 'count', 'max', 'mean'):
+        order = 'total'
+    context = dict(
+        admin.site.each_context(request),
+        title='Slow queries',
+        entries=slow_queries.log.top(limit=100, order=order),
+        order=order,
+        dropped=slow_queries.log.dropped,
+        threshold_ms=slow_queries.threshold() * 1000,
+    )
+    return TemplateResponse(request, 'admin/expenses/slow_queries.html', context)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ExpensesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'expenses'
+
+    def ready(self):
+        # Connect the token cache invalidation signals and register the
+        # background job handlers
+        from . import authentication, tasks  # noqa: F401
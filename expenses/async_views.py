@@ -0,0 +1,226 @@
+"""Native async versions of the hot read endpoints, used under ASGI.
+
+DRF viewsets are sync only, so under ASGI every request to them is pushed
+through a thread. These views serve GET and HEAD on the same URLs with the
+async ORM and hand any other method to the viewset, so the API is
+unchanged. They reuse the viewsets' querysets, serializers, pagination,
+token cache and response cache. URLs are switched over when
+settings.ASYNC_READS is on, which is opt in; see its note in settings.
+
+Django 4.2's async ORM still runs each query on the request's own
+database thread; what changes is that the worker no longer ties up a
+thread per request around those queries.
+"""
+import copy
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+from . import ledger, search
+from .authentication import token_cache
+from .pagination import KeysetPagination
+from .response_cache import response_cache
+from .serializers import ExpenseSerializer, UserSerializer
+from .views import ExpenseViewSet, FriendViewSet
+
+
+class DataResponse(JsonResponse):
+    """JSON rendered like DRF's JSONRenderer; keeps `.data` like a DRF Response"""
+
+    def __init__(self, data, status=200):
+        super().__init__(
+            data, encoder=JSONEncoder, safe=False, status=status,
+            json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')}
+        )
+        self.data = data
+
+
+async def _cached_token_user(key):
+    # The local tier is in memory; only a shared cache tier does I/O
+    if token_cache.shared:
+        return await sync_to_async(token_cache.get)(key)
+    return token_cache.get(key)
+
+
+async def authenticate(request):
+    """(user, None) for a valid `Authorization: Token <key>`, else (None, error)"""
+    auth = request.headers.get('Authorization', '').split()
+    if not auth or auth[0].lower() != 'token':
+        return None, 'Authentication credentials were not provided.'
+    if len(auth) == 1:
+        return None, 'Invalid token header. No credentials provided.'
+    if len(auth) > 2:
+        return None, 'Invalid token header. Token string should not contain spaces.'
+    key = auth[1]
+    user = await _cached_token_user(key)
+    if user is None:
+        try:
+            token = await Token.objects.select_related('user').aget(key=key)
+        except Token.DoesNotExist:
+            return None, 'Invalid token.'
+        user = token.user
+        if token_cache.shared:
+            await sync_to_async(token_cache.set)(key, copy.copy(user))
+        else:
+            token_cache.set(key, copy.copy(user))
+    if not user.is_active:
+        return None, 'User inactive or deleted.'
+    # Same as CachedTokenAuthentication: never hand out the shared entry
+    return copy.copy(user), None
+
+
+def api_read(view):
+    """Authenticate like the viewsets do and render DRF exceptions like DRF"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user, error = await authenticate(request)
+        if user is None:
+            response = DataResponse({'detail': error}, status=401)
+            response['WWW-Authenticate'] = 'Token'
+            return response
+        request.user = user
+        try:
+            return await view(request, *args, **kwargs)
+        except exceptions.APIException as e:
+            return DataResponse({'detail': e.detail}, status=e.status_code)
+    return wrapper
+
+
+def _cache_lookup(name, request):
+    key = response_cache.response_key(name, request)
+    return key, response_cache.get(key)
+
+
+def cached_per_user(name):
+    """response_cache.cached_per_user for async views; shares its entries"""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not response_cache.enabled:
+                return await view(request, *args, **kwargs)
+            key, data = await sync_to_async(_cache_lookup)(name, request)
+            if data is not None:
+                return DataResponse(data)
+            response = await view(request, *args, **kwargs)
+            if response.status_code == 200:
+                await sync_to_async(response_cache.set)(key, response.data)
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_per_user(name):
+    """response_cache.conditional_per_user for async views"""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not response_cache.enabled:
+                return await view(request, *args, **kwargs)
+            etag, last_modified = await sync_to_async(response_cache.validators)(name, request)
+            not_modified = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if not_modified is not None:
+                return not_modified
+            response = await view(request, *args, **kwargs)
+            if response.status_code == 200:
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+                response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+async def _expense_page(request, queryset, ordering=None):
+    request = Request(request)
+    paginator = KeysetPagination()
+    page = await paginator.apaginate_queryset(
+        ExpenseViewSet.with_related(queryset), request, ordering
+    )
+    data = ExpenseSerializer(page, many=True, context={'request': request}).data
+    return DataResponse(paginator.get_paginated_data(data))
+
+
+@api_read
+async def me(request):
+    return DataResponse(UserSerializer(request.user).data)
+
+
+@api_read
+@cached_per_user('overall-balance')
+async def overall_balance(request):
+    # One ledger query covers both directions and the usernames, so there
+    # are no separate aggregates left to run side by side
+    rows = [row async for row in FriendViewSet.overall_balance_rows(request.user)]
+    return DataResponse(FriendViewSet.overall_balance_data(request.user, rows))
+
+
+@api_read
+async def balance(request, pk):
+    # The friend and both ledger directions in one query
+    friend = await ledger.annotate_balances(User.objects.filter(pk=pk), request.user).afirst()
+    if friend is None:
+        return DataResponse({"error": "Friend not found"}, status=404)
+    return DataResponse({
+        'total_balance': friend.total_balance,
+        'total_due_to_user': friend.total_due_to_user,
+        'total_user_owes': friend.total_user_owes,
+    })
+
+
+@api_read
+@conditional_per_user('expense-list')
+@cached_per_user('expense-list')
+async def expense_list(request):
+    search_text = request.GET.get('q', '').strip()
+    expenses = ExpenseViewSet.visible_to(request.user)
+    if search_text:
+        expenses = search.search(expenses, search_text)
+    return await _expense_page(request, expenses, ExpenseViewSet.list_ordering(search_text))
+
+
+@api_read
+async def expense_detail(request, pk):
+    expense = await ExpenseViewSet.with_related(
+        ExpenseViewSet.visible_to(request.user).filter(pk=pk)
+    ).afirst()
+    if expense is None:
+        raise exceptions.NotFound()
+    return DataResponse(ExpenseSerializer(expense, context={'request': request}).data)
+
+
+@api_read
+async def friend_expenses(request):
+    friend_id = request.GET.get('friend_id')
+    if not friend_id:
+        return DataResponse({"error": "friend_id is required"}, status=400)
+    try:
+        friend_id = int(friend_id)
+    except ValueError:
+        return DataResponse({"error": "Friend not found"}, status=404)
+    response = await _expense_page(request, ExpenseViewSet.between(request.user, friend_id))
+    # Shared expenses prove the friend exists; only an empty page needs the check
+    if not response.data['results'] and not await User.objects.filter(pk=friend_id).aexists():
+        return DataResponse({"error": "Friend not found"}, status=404)
+    return response
+
+
+def reads(async_view, sync_view):
+    """Serve GET and HEAD with `async_view` and other methods with `sync_view`"""
+    sync_view = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return await async_view(request, *args, **kwargs)
+        return await sync_view(request, *args, **kwargs)
+    # Like the DRF views it stands in for; csrf_exempt() cannot wrap
+    # coroutine functions in Django 4.2
+    view.csrf_exempt = True
+    return view
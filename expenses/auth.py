@@ -1,77 +1,164 @@
-from django.contrib.auth import authenticate, login, logout
+import json
+from functools import wraps
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.http import HttpResponseNotAllowed, JsonResponse
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from .models import Friend
 from .serializers import UserSerializer
+from .authentication import invalidate_token
+from .hashers import HashingBusy, make_password_async, verify_password_async
 
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def register_user(request):
-    if 'username' not in request.data or 'password' not in request.data:
-        return Response(
+def async_post_view(view):
+    """csrf_exempt + require_POST for async views.
+
+    Django 4.2's own decorators wrap views in sync functions, which would
+    turn these back into sync views.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        return await view(request, *args, **kwargs)
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+def _request_data(request):
+    """Parse a JSON or form-encoded body into a dict"""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
+
+
+def _busy_response():
+    response = JsonResponse(
+        {'error': 'Server busy, please retry'},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    response['Retry-After'] = '1'
+    return response
+
+
+def _clean_username(username):
+    """The normalized username, checked like the User form field would.
+
+    Raises ValidationError for empty, over-long or badly formed names.
+    """
+    if not isinstance(username, str):
+        raise ValidationError('Enter a valid username.')
+    return User._meta.get_field('username').clean(User.normalize_username(username), None)
+
+
+def _create_user_records(username, password_hash, email, first_name, last_name):
+    """Insert the user, profile and token together; the unique username
+    constraint is the only existence check. `username` must already have
+    been through _clean_username."""
+    with transaction.atomic():
+        user = User(
+            username=username,
+            email=User.objects.normalize_email(email),
+            first_name=first_name,
+            last_name=last_name,
+            password=password_hash,
+        )
+        user.save()
+        
+        # Create a Friend profile for the user
+        Friend.objects.create(user=user)
+        
+        # Create token for the new user
+        token = Token.objects.create(user=user)
+    return user, token
+
+
+@async_post_view
+async def register_user(request):
+    data = _request_data(request)
+    if data is None or 'username' not in data or 'password' not in data:
+        return JsonResponse(
             {'error': 'Please provide username and password'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    username = request.data['username']
-    password = request.data['password']
-    email = request.data.get('email', '')
-    first_name = request.data.get('first_name', '')
-    last_name = request.data.get('last_name', '')
+    password = data['password']
+    email = data.get('email', '')
+    first_name = data.get('first_name', '')
+    last_name = data.get('last_name', '')
     
-    if User.objects.filter(username=username).exists():
-        return Response(
-            {'error': 'Username already exists'},
+    # Checked before hashing, so bad names cost no hashing time
+    try:
+        username = _clean_username(data['username'])
+    except ValidationError as e:
+        return JsonResponse(
+            {'error': ' '.join(e.messages)},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    user = User.objects.create_user(
-        username=username,
-        password=password,
-        email=email,
-        first_name=first_name,
-        last_name=last_name
-    )
-    
-    # Create a Friend profile for the user
-    Friend.objects.create(user=user)
+    # Hash on the pool so the worker stays free for other requests
+    try:
+        password_hash = await make_password_async(password)
+    except HashingBusy:
+        return _busy_response()
     
-    # Create token for the new user
-    token, _ = Token.objects.get_or_create(user=user)
+    try:
+        user, token = await sync_to_async(_create_user_records)(
+            username, password_hash, email, first_name, last_name
+        )
+    except IntegrityError:
+        return JsonResponse(
+            {'error': 'Username already exists'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
     serializer = UserSerializer(user)
-    return Response({
+    return JsonResponse({
         'user': serializer.data,
         'token': token.key
     }, status=status.HTTP_201_CREATED)
 
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def login_user(request):
-    username = request.data.get('username', '')
-    password = request.data.get('password', '')
+@async_post_view
+async def login_user(request):
+    data = _request_data(request) or {}
+    username = data.get('username', '')
+    password = data.get('password', '')
     
     try:
-        user = User.objects.get(username=username)
+        user = await User.objects.aget(username=username)
     except User.DoesNotExist:
-        return Response(
+        return JsonResponse(
             {'error': 'Invalid credentials'},
             status=status.HTTP_401_UNAUTHORIZED
         )
 
-    if not user.check_password(password):
-        return Response(
+    try:
+        is_correct, new_hash = await verify_password_async(password, user.password)
+    except HashingBusy:
+        return _busy_response()
+    
+    if not is_correct:
+        return JsonResponse(
             {'error': 'Invalid credentials'},
             status=status.HTTP_401_UNAUTHORIZED
         )
+    
+    if new_hash is not None:
+        # Upgrade hashes made with an older hasher or work factor
+        await User.objects.filter(pk=user.pk).aupdate(password=new_hash)
 
-    token, _ = Token.objects.get_or_create(user=user)
+    token, _ = await Token.objects.aget_or_create(user=user)
     serializer = UserSerializer(user)
-    return Response({
+    return JsonResponse({
         'user': serializer.data,
         'token': token.key
     })
@@ -79,6 +166,9 @@ def login_user(request):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def logout_user(request):
-    # Delete the user's token
-    request.user.auth_token.delete()
+    # Delete the user's token and drop it from the auth cache
+    token = Token.objects.filter(user=request.user).first()
+    if token is not None:
+        invalidate_token(token.key)
+        token.delete()
     return Response({'message': 'Successfully logged out'})
\ No newline at end of file
@@ -0,0 +1,173 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from .cache_backends import is_shared
+
+
+class TokenCache:
+    """Bounded, thread-safe LRU of token key -> user with a per-entry TTL.
+
+    When a cache alias is configured, misses fall through to that Django
+    cache before hitting the database, and invalidations are applied to both
+    tiers. Entries live for `ttl` seconds in the shared tier and only
+    `local_ttl` seconds in the local one, since a revoked token stays valid
+    in other processes' local tiers until it expires there. An alias that
+    points at a per-process backend is ignored.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300, cache_alias=None, local_ttl=5):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.cache_alias = cache_alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        if not self.cache_alias:
+            return None
+        cache = caches[self.cache_alias]
+        return cache if is_shared(cache) else None
+
+    def _shared_key(self, key):
+        return f'auth-token:{key}'
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+
+        shared = self.shared
+        user = shared.get(self._shared_key(key)) if shared else None
+        with self._lock:
+            if user is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._store_local(key, user)
+        return user
+
+    def set(self, key, user):
+        self._store_local(key, user)
+        shared = self.shared
+        if shared:
+            shared.set(self._shared_key(key), user, self.ttl)
+
+    def _store_local(self, key, user):
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + self.local_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        shared = self.shared
+        if shared:
+            shared.delete(self._shared_key(key))
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            keys = [key for key, (user, _) in self._entries.items() if user.pk == user_id]
+            for key in keys:
+                del self._entries[key]
+        return keys
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'local_ttl': self.local_ttl,
+            }
+
+
+def _build_cache():
+    options = getattr(settings, 'TOKEN_AUTH_CACHE', {})
+    return TokenCache(
+        max_entries=options.get('MAX_ENTRIES', 10000),
+        ttl=options.get('TTL', 300),
+        cache_alias=options.get('CACHE_ALIAS'),
+        local_ttl=options.get('LOCAL_TTL', 5),
+    )
+
+
+token_cache = _build_cache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Drop-in TokenAuthentication that skips the Token/User join on cache hits"""
+
+    cache = token_cache
+
+    def authenticate_credentials(self, key):
+        user = self.cache.get(key)
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            # Cache a copy, so changes this request makes to its user stay
+            # out of the entry later requests get
+            self.cache.set(key, copy.copy(user))
+            return (user, token)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        # Hand each request its own copy so per-request attribute changes
+        # never leak into the shared entry
+        user = copy.copy(user)
+        return (user, Token(key=key, user=user))
+
+    @classmethod
+    def stats(cls):
+        return cls.cache.stats()
+
+
+def invalidate_token(key):
+    token_cache.invalidate(key)
+
+
+def invalidate_user_tokens(user):
+    """Drop every cached token belonging to `user`"""
+    keys = set(token_cache.invalidate_user(user.pk))
+    keys.update(Token.objects.filter(user=user).values_list('key', flat=True))
+    for key in keys:
+        token_cache.invalidate(key)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    # Covers deactivation as well as any other change to the cached user
+    if not created:
+        invalidate_user_tokens(instance)
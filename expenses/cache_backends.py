@@ -0,0 +1,12 @@
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_shared(cache):
+    """Whether what one process writes to `cache` is seen by the others.
+
+    The local-memory backend keeps a separate store per process and the
+    dummy backend keeps nothing, so neither can carry an invalidation from
+    the worker that handled a write to the rest.
+    """
+    return not isinstance(cache, (LocMemCache, DummyCache))
@@ -0,0 +1,130 @@
+import csv
+import json
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from .models import Expense, ExpenseParticipant, ExpenseShare, Payment
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPENSE_FIELDS = [
+    'id', 'title', 'description', 'total_amount', 'tax_amount',
+    'created_by_id', 'created_by__username', 'created_at', 'updated_at',
+]
+SHARE_FIELDS = [
+    'id', 'expense_id', 'expense__title', 'expense__created_by_id',
+    'participant_id', 'participant__username', 'amount', 'settled_amount', 'settled',
+]
+PAYMENT_FIELDS = [
+    'id', 'from_user_id', 'from_user__username', 'to_user_id',
+    'to_user__username', 'amount', 'notes', 'created_at',
+]
+
+
+class CSVRenderer(BaseRenderer):
+    """Lets `?format=csv` through content negotiation; exports stream their own body"""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only reached for error responses; export bodies are streamed directly
+        return json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+
+
+class NDJSONRenderer(CSVRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+EXPORT_RENDERERS = [CSVRenderer, NDJSONRenderer]
+
+
+class Echo:
+    """File-like object that hands back what csv.writer writes to it"""
+
+    def write(self, value):
+        return value
+
+
+def expense_rows(user):
+    return Expense.objects.filter(
+        id__in=ExpenseParticipant.objects.filter(user=user).values('expense')
+    ).order_by('created_at', 'id').values_list(*EXPENSE_FIELDS)
+
+
+def share_rows(user):
+    return ExpenseShare.objects.filter(
+        Q(participant=user) | Q(expense__created_by=user)
+    ).order_by('id').values_list(*SHARE_FIELDS)
+
+
+def payment_rows(user):
+    return Payment.objects.filter(
+        Q(from_user=user) | Q(to_user=user)
+    ).order_by('created_at', 'id').values_list(*PAYMENT_FIELDS)
+
+
+def _column_names(fields):
+    return [field.replace('__', '_') for field in fields]
+
+
+def stream_csv(rows, fields):
+    writer = csv.writer(Echo())
+    # Send the header before the first query result arrives
+    yield writer.writerow(_column_names(fields))
+    for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield writer.writerow(row)
+
+
+def stream_ndjson(rows, fields):
+    columns = _column_names(fields)
+    for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def _take(lines, size):
+    return ''.join(islice(lines, size))
+
+
+async def as_async(lines):
+    """Serve the sync generator `lines` as an async iterator.
+
+    Django's ASGI handler reads a sync streaming body into memory before
+    sending any of it. Here each step runs the generator, and so its
+    queries, in the request's database thread and hands back up to
+    EXPORT_CHUNK_SIZE lines at a time; the header goes out on its own.
+    """
+    size = 1
+    while True:
+        chunk = await sync_to_async(_take)(lines, size)
+        if not chunk:
+            return
+        yield chunk
+        size = EXPORT_CHUNK_SIZE
+
+
+def export_response(rows, fields, export_format, name, request=None):
+    """Stream `rows` (a values_list queryset) as CSV or NDJSON.
+
+    Rows are pulled from a server-side cursor in chunks, so memory use does
+    not depend on how many rows the user has. Pass `request` so that under
+    ASGI the body is streamed as an async iterator instead of buffered.
+    """
+    if export_format == 'ndjson':
+        lines = stream_ndjson(rows, fields)
+        content_type = 'application/x-ndjson'
+        extension = 'ndjson'
+    else:
+        lines = stream_csv(rows, fields)
+        content_type = 'text/csv'
+        extension = 'csv'
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        lines = as_async(lines)
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{name}.{extension}"'
+    return response
@@ -0,0 +1,93 @@
+from itertools import chain
+from django.db import transaction
+from django.db.models import Q
+from .models import Expense, ExpenseShare, ExpenseParticipant, Friendship
+
+
+def _write(pairs):
+    """Insert participant and friendship rows for (expense_id, creator_id, user_id).
+
+    The creator always gets a participant row. Rows that already exist are
+    skipped.
+    """
+    participants = {}
+    friendships = set()
+    for expense_id, creator_id, user_id in pairs:
+        participants[(expense_id, creator_id)] = creator_id
+        participants[(expense_id, user_id)] = creator_id
+        if user_id != creator_id:
+            friendships.add((creator_id, user_id))
+            friendships.add((user_id, creator_id))
+    ExpenseParticipant.objects.bulk_create([
+        ExpenseParticipant(expense_id=expense_id, user_id=user_id, creator_id=creator_id)
+        for (expense_id, user_id), creator_id in participants.items()
+    ], ignore_conflicts=True)
+    Friendship.objects.bulk_create([
+        Friendship(user_id=user_id, friend_id=friend_id)
+        for user_id, friend_id in friendships
+    ], ignore_conflicts=True)
+
+
+def index_expenses(expenses, shares):
+    """Record who takes part in newly created expenses and who is friends.
+
+    `shares` must have their `expense` loaded.
+    """
+    _write(chain(
+        ((expense.id, expense.created_by_id, expense.created_by_id) for expense in expenses),
+        ((share.expense_id, share.expense.created_by_id, share.participant_id) for share in shares),
+    ))
+
+
+def remove_participants(expense_id, creator_id, user_ids):
+    """Take users off an expense, and drop friendships left without one.
+
+    Call once their shares are gone. Users who still hold a share on the
+    expense keep their row, and so does the creator while the expense
+    exists. A friendship between the creator and a removed user goes when
+    no other expense either of them created includes the other.
+    """
+    user_ids = set(user_ids)
+    kept = set(ExpenseShare.objects.filter(
+        expense_id=expense_id, participant_id__in=user_ids
+    ).values_list('participant_id', flat=True))
+    if Expense.objects.filter(pk=expense_id).exists():
+        kept.add(creator_id)
+    removed = user_ids - kept
+    if not removed:
+        return
+    ExpenseParticipant.objects.filter(expense_id=expense_id, user_id__in=removed).delete()
+
+    others = removed - {creator_id}
+    still_shared = ExpenseParticipant.objects.filter(
+        Q(user_id__in=others, creator_id=creator_id) | Q(user_id=creator_id, creator_id__in=others)
+    ).values_list('user_id', 'creator_id')
+    others -= {creator if user_id == creator_id else user_id for user_id, creator in still_shared}
+    if others:
+        Friendship.objects.filter(
+            Q(user_id=creator_id, friend_id__in=others) | Q(user_id__in=others, friend_id=creator_id)
+        ).delete()
+
+
+@transaction.atomic
+def backfill(batch_size=5000):
+    """Rebuild both tables from existing expenses and shares"""
+    ExpenseParticipant.objects.all().delete()
+    Friendship.objects.all().delete()
+    creators = (
+        (expense_id, creator_id, creator_id)
+        for expense_id, creator_id in Expense.objects.values_list(
+            'id', 'created_by_id'
+        ).iterator(chunk_size=batch_size)
+    )
+    participants = ExpenseShare.objects.values_list(
+        'expense_id', 'expense__created_by_id', 'participant_id'
+    ).distinct().iterator(chunk_size=batch_size)
+    batch = []
+    for row in chain(creators, participants):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _write(batch)
+            batch = []
+    if batch:
+        _write(batch)
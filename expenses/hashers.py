@@ -0,0 +1,105 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    BCryptSHA256PasswordHasher as BaseBCryptSHA256PasswordHasher,
+    check_password, get_hasher, identify_hasher, make_password,
+)
+
+
+class BCryptSHA256PasswordHasher(BaseBCryptSHA256PasswordHasher):
+    """bcrypt_sha256 with its cost taken from settings.BCRYPT_ROUNDS.
+
+    Uses the same algorithm name as Django's hasher, so existing hashes keep
+    verifying; hashes made with a different cost are reported as needing an
+    update and are re-hashed on the next successful login.
+    """
+
+    @property
+    def rounds(self):
+        return getattr(settings, 'BCRYPT_ROUNDS', BaseBCryptSHA256PasswordHasher.rounds)
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full and the request should be shed"""
+
+
+class HashingPool:
+    """Runs password hashing on a bounded thread pool.
+
+    bcrypt releases the GIL, so a few threads hash in parallel while request
+    workers stay free. At most `queue_limit` jobs may be running or waiting;
+    beyond that callers get HashingBusy straight away instead of queueing.
+    """
+
+    def __init__(self, workers=4, queue_limit=64):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix='password-hashing'
+                )
+            return self._executor
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                raise HashingBusy()
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+
+def _build_pool():
+    options = getattr(settings, 'PASSWORD_HASHING_POOL', {})
+    return HashingPool(
+        workers=options.get('WORKERS', 4),
+        queue_limit=options.get('QUEUE_LIMIT', 64),
+    )
+
+
+hashing_pool = _build_pool()
+
+
+def needs_rehash(encoded):
+    """True if `encoded` was not made with the preferred hasher and cost"""
+    preferred = get_hasher('default')
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def verify_password(password, encoded):
+    """Check `password`; returns (is_correct, new_encoded_or_None).
+
+    Pure CPU work with no database access, so it is safe to run on the
+    hashing pool. A new hash is only produced when the old one is outdated.
+    """
+    if not check_password(password, encoded):
+        return False, None
+    if needs_rehash(encoded):
+        return True, make_password(password)
+    return True, None
+
+
+async def verify_password_async(password, encoded):
+    return await hashing_pool.run(verify_password, password, encoded)
+
+
+async def make_password_async(password):
+    return await hashing_pool.run(make_password, password)
@@ -0,0 +1,100 @@
+"""Idempotency-Key support for create endpoints.
+
+A client that may retry a POST sends the same `Idempotency-Key` header on
+every attempt. The first attempt runs normally and its response is stored
+under (user, key), in the transaction that made its writes. Retries get
+that response back, with `Idempotent-Replayed: true`, without touching
+the serializer.
+
+A duplicate that arrives while the first attempt is still running blocks
+on the unique (user, key) index entry until the first commits, then
+replays its response; if the first fails, the duplicate runs instead.
+Only 2xx responses are stored, so a retry after an error runs again.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY', {}).get('TTL', 86400))
+
+
+def request_hash(request):
+    body = json.dumps(request.data, cls=JSONEncoder, sort_keys=True)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode('utf-8')).hexdigest()
+
+
+def _replay(record, fingerprint):
+    if record.request_hash != fingerprint:
+        return Response(
+            {"error": f"{HEADER} was already used for a different request"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = Response(record.response, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(user, key, fingerprint):
+    """Returns (record to complete, None) or (None, response to replay)"""
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if record is not None and record.expires_at <= now:
+        record.delete()
+        record = None
+    if record is None:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user=user, key=key, request_hash=fingerprint, expires_at=now + ttl()
+                ), None
+        except IntegrityError:
+            # Another attempt with this key committed while we waited on it
+            record = IdempotencyKey.objects.get(user=user, key=key)
+    return None, _replay(record, fingerprint)
+
+
+def idempotent(view_method):
+    """Honour the Idempotency-Key header on a view method that creates things"""
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view_method(self, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        fingerprint = request_hash(request)
+        with transaction.atomic():
+            record, replay = _claim(request.user, key, fingerprint)
+            if replay is not None:
+                return replay
+            response = view_method(self, request, *args, **kwargs)
+            if status.is_success(response.status_code):
+                record.status_code = response.status_code
+                record.response = json.loads(json.dumps(response.data, cls=JSONEncoder))
+                record.save(update_fields=['status_code', 'response'])
+            else:
+                record.delete()
+        return response
+    return wrapper
+
+
+def purge_expired():
+    """Delete stored responses past their expiry; returns how many"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,146 @@
+"""A small job queue kept in the database, so no broker is needed.
+
+Handlers are registered by kind with `@handler('kind')` and receive the
+Job. Whatever they return (JSON-serializable) is stored as the result.
+Workers (`manage.py run_worker`) claim due jobs with
+SELECT ... FOR UPDATE SKIP LOCKED where the database supports it. The
+claim is also a conditional UPDATE, so two workers can never run the same
+job, including on SQLite.
+"""
+import logging
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+class PermanentError(Exception):
+    """Raised by a handler when retrying cannot help; the job fails at once"""
+
+
+def _options():
+    options = getattr(settings, 'JOB_QUEUE', {})
+    return {
+        'MAX_ATTEMPTS': options.get('MAX_ATTEMPTS', 3),
+        'BACKOFF_SECONDS': options.get('BACKOFF_SECONDS', 10),
+        'MAX_BACKOFF_SECONDS': options.get('MAX_BACKOFF_SECONDS', 3600),
+        'STALE_AFTER_SECONDS': options.get('STALE_AFTER_SECONDS', 900),
+    }
+
+
+def handler(kind):
+    """Register the decorated function as the handler for `kind` jobs"""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, user=None, max_attempts=None, delay=None):
+    """Queue a job and return it. Workers see it once the transaction commits."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        created_by=user,
+        max_attempts=max_attempts or _options()['MAX_ATTEMPTS'],
+        run_after=timezone.now() + (delay or timedelta()),
+    )
+
+
+def backoff(attempts):
+    """Delay before retry number `attempts`: doubles each time, capped"""
+    options = _options()
+    seconds = options['BACKOFF_SECONDS'] * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(seconds, options['MAX_BACKOFF_SECONDS']))
+
+
+def claim(worker_id, limit=1):
+    """Mark up to `limit` due jobs as running for `worker_id` and return them"""
+    now = timezone.now()
+    with transaction.atomic():
+        candidates = list(
+            Job.objects.select_for_update(skip_locked=True).filter(
+                status=Job.QUEUED,
+                run_after__lte=now
+            ).order_by('run_after', 'id').values_list('id', flat=True)[:limit]
+        )
+        claimed = [
+            job_id for job_id in candidates
+            if Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+                status=Job.RUNNING,
+                locked_at=now,
+                locked_by=worker_id,
+                updated_at=now
+            )
+        ]
+    if not claimed:
+        return []
+    # attempts is bumped by the worker that ran it, in run()
+    return list(Job.objects.filter(id__in=claimed).order_by('run_after', 'id'))
+
+
+def run(job):
+    """Run a claimed job and record the outcome. Returns the job."""
+    job.attempts += 1
+    func = HANDLERS.get(job.kind)
+    try:
+        if func is None:
+            raise LookupError(f"No handler registered for {job.kind}")
+        result = func(job)
+    except PermanentError as e:
+        job.error = str(e)
+        job.status = Job.FAILED
+        logger.error("Job %s (%s) failed: %s", job.pk, job.kind, e)
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_after = timezone.now() + backoff(job.attempts)
+            logger.warning("Job %s (%s) failed, retrying at %s", job.pk, job.kind, job.run_after)
+        else:
+            job.status = Job.FAILED
+            logger.error("Job %s (%s) failed after %s attempts", job.pk, job.kind, job.attempts)
+    else:
+        job.status = Job.SUCCEEDED
+        job.result = result
+        job.error = ''
+    job.locked_at = None
+    job.locked_by = ''
+    job.save(update_fields=[
+        'attempts', 'status', 'result', 'error', 'run_after',
+        'locked_at', 'locked_by', 'updated_at'
+    ])
+    return job
+
+
+def requeue_stale(stale_after=None):
+    """Put back jobs whose worker stopped without finishing them.
+
+    A job running for longer than `stale_after` (a timedelta) is assumed
+    lost and counts as a failed attempt.
+    """
+    if stale_after is None:
+        stale_after = timedelta(seconds=_options()['STALE_AFTER_SECONDS'])
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - stale_after)
+    requeued = 0
+    for job in stale:
+        job.attempts += 1
+        job.error = f"Worker {job.locked_by} did not finish the job"
+        job.status = Job.QUEUED if job.attempts < job.max_attempts else Job.FAILED
+        job.run_after = now
+        job.locked_at = None
+        job.locked_by = ''
+        job.save(update_fields=[
+            'attempts', 'status', 'error', 'run_after', 'locked_at', 'locked_by', 'updated_at'
+        ])
+        requeued += 1
+    return requeued
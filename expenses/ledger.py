@@ -0,0 +1,182 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import BalanceLedger, ExpenseShare
+
+CENT = Decimal('0.01')
+
+
+def share_contribution(share, creditor_id=None):
+    """Return the ((debtor_id, creditor_id), amount) a share adds to the ledger.
+
+    Only the outstanding part of unsettled shares owed to someone else
+    counts towards a balance. Returns None for shares that do not affect
+    the ledger.
+    """
+    if creditor_id is None:
+        creditor_id = share.expense.created_by_id
+    if share.settled or share.participant_id == creditor_id:
+        return None
+    # Match the rounding the 2-decimal columns apply when the share is saved
+    outstanding = Decimal(share.amount).quantize(CENT) - Decimal(share.settled_amount).quantize(CENT)
+    return (share.participant_id, creditor_id), outstanding
+
+
+def collect_deltas(shares, sign=1, creditor_id=None):
+    """Sum the ledger contributions of `shares`, multiplied by `sign`."""
+    deltas = defaultdict(lambda: Decimal('0.00'))
+    for share in shares:
+        contribution = share_contribution(share, creditor_id)
+        if contribution is not None:
+            pair, amount = contribution
+            deltas[pair] += sign * amount
+    return deltas
+
+
+def _apply_one(pair, delta):
+    """Increment one ledger row, creating it if needed"""
+    debtor_id, creditor_id = pair
+    rows = BalanceLedger.objects.filter(debtor_id=debtor_id, creditor_id=creditor_id)
+    if rows.update(amount=F('amount') + delta):
+        return
+    try:
+        with transaction.atomic():
+            BalanceLedger.objects.create(debtor_id=debtor_id, creditor_id=creditor_id, amount=delta)
+    except IntegrityError:
+        # Another transaction created the row first
+        rows.update(amount=F('amount') + delta)
+
+
+def apply_deltas(deltas):
+    """Add each delta to its (debtor_id, creditor_id) ledger row.
+
+    Existing rows are locked and read in one query, in id order so
+    concurrent writers lock them in the same sequence, and written back
+    with one bulk update; missing rows are bulk inserted. If a concurrent
+    writer inserts one of those rows first, the new rows fall back to
+    per-row increments. Must run inside the transaction that wrote the
+    shares.
+    """
+    deltas = {pair: delta for pair, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    existing = {
+        (row.debtor_id, row.creditor_id): row
+        for row in BalanceLedger.objects.select_for_update().filter(
+            debtor_id__in={debtor_id for debtor_id, _ in deltas},
+            creditor_id__in={creditor_id for _, creditor_id in deltas}
+        ).order_by('id')
+    }
+    updated = []
+    created = []
+    for (debtor_id, creditor_id), delta in deltas.items():
+        row = existing.get((debtor_id, creditor_id))
+        if row is None:
+            created.append(BalanceLedger(debtor_id=debtor_id, creditor_id=creditor_id, amount=delta))
+            continue
+        row.amount += delta
+        updated.append(row)
+
+    if updated:
+        BalanceLedger.objects.bulk_update(updated, ['amount'], batch_size=500)
+    if created:
+        try:
+            with transaction.atomic():
+                BalanceLedger.objects.bulk_create(created, batch_size=500)
+        except IntegrityError:
+            for row in created:
+                _apply_one((row.debtor_id, row.creditor_id), row.amount)
+
+
+def record_shares(shares, creditor_id=None):
+    """Add newly created shares to the ledger"""
+    apply_deltas(collect_deltas(shares, 1, creditor_id))
+
+
+def remove_shares(shares, creditor_id=None):
+    """Remove shares that are about to be deleted from the ledger"""
+    apply_deltas(collect_deltas(shares, -1, creditor_id))
+
+
+def replace_share(old_share, new_share):
+    """Move the ledger from `old_share`'s state to `new_share`'s state"""
+    deltas = collect_deltas([old_share], -1)
+    for pair, amount in collect_deltas([new_share], 1).items():
+        deltas[pair] += amount
+    apply_deltas(deltas)
+
+
+def _pair_amount(debtor, creditor):
+    return Coalesce(
+        Subquery(
+            BalanceLedger.objects.filter(
+                debtor=debtor,
+                creditor=creditor
+            ).values('amount')[:1]
+        ),
+        Value(Decimal('0.00')),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+
+
+def annotate_balances(users, user):
+    """Annotate a User queryset with each row's balance against `user`.
+
+    Adds total_due_to_user (row owes user), total_user_owes (user owes row)
+    and total_balance (the difference). Everything is computed in the same
+    query, so the cost does not grow with the number of friends.
+    """
+    return users.annotate(
+        total_due_to_user=_pair_amount(OuterRef('pk'), user),
+        total_user_owes=_pair_amount(user, OuterRef('pk')),
+    ).annotate(
+        total_balance=F('total_due_to_user') - F('total_user_owes')
+    )
+
+
+def expected_balances():
+    """Aggregate unsettled shares into {(debtor_id, creditor_id): amount}"""
+    rows = ExpenseShare.objects.filter(
+        settled=False
+    ).exclude(
+        participant=F('expense__created_by')
+    ).values('participant', 'expense__created_by').annotate(
+        total=Sum(F('amount') - F('settled_amount'))
+    )
+    return {
+        (row['participant'], row['expense__created_by']): row['total']
+        for row in rows
+    }
+
+
+def find_drift():
+    """Compare the ledger against the share table.
+
+    Returns a list of (debtor_id, creditor_id, ledger_amount, expected_amount)
+    for every pair that disagrees.
+    """
+    expected = expected_balances()
+    actual = {
+        (row.debtor_id, row.creditor_id): row.amount
+        for row in BalanceLedger.objects.all()
+    }
+    drift = []
+    for pair in sorted(set(expected) | set(actual)):
+        ledger_amount = actual.get(pair, Decimal('0.00'))
+        expected_amount = expected.get(pair, Decimal('0.00'))
+        if ledger_amount != expected_amount:
+            drift.append((pair[0], pair[1], ledger_amount, expected_amount))
+    return drift
+
+
+@transaction.atomic
+def rebuild():
+    """Recreate every ledger row from the share table"""
+    BalanceLedger.objects.all().delete()
+    BalanceLedger.objects.bulk_create([
+        BalanceLedger(debtor_id=debtor_id, creditor_id=creditor_id, amount=amount)
+        for (debtor_id, creditor_id), amount in expected_balances().items()
+    ])
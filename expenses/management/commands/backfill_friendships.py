@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from expenses import graph
+from expenses.models import ExpenseParticipant, Friendship
+
+
+class Command(BaseCommand):
+    help = "Rebuild the friendship and expense participant tables from expense shares"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        graph.backfill(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {ExpenseParticipant.objects.count()} expense participants "
+            f"and {Friendship.objects.count()} friendship edges"
+        ))
@@ -0,0 +1,305 @@
+import asyncio
+import json
+import math
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.conf import settings
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from expenses.models import BalanceLedger, Friendship
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+class Actor:
+    """A seeded user the benchmark acts as, with who they can split and pay"""
+
+    def __init__(self, token):
+        self.user_id = token.user_id
+        self.auth = f'Token {token.key}'
+        self.friend_ids = []
+        self.creditor_ids = []
+
+
+def overall_balance(actor, rng):
+    return 'GET', '/api/friends/overall_balance/', None
+
+
+def expense_list(actor, rng):
+    return 'GET', '/api/expenses/', None
+
+
+def expense_create(actor, rng):
+    participants = rng.sample(actor.friend_ids, min(2, len(actor.friend_ids)))
+    return 'POST', '/api/expenses/', {
+        'title': 'Benchmark dinner',
+        'total_amount': '24.00',
+        'items': [{'name': 'dinner', 'amount': '24.00', 'is_shared': True}],
+        'participants': participants,
+    }
+
+
+def payment_create(actor, rng):
+    to_user = rng.choice(actor.creditor_ids or actor.friend_ids)
+    return 'POST', '/api/payments/', {
+        'from_user_id': actor.user_id,
+        'to_user_id': to_user,
+        'amount': '1.00',
+    }
+
+
+METRICS_MIDDLEWARE = 'expenses.middleware.MetricsMiddleware'
+
+SCENARIOS = {
+    'overall_balance': overall_balance,
+    'expense_list': expense_list,
+    'expense_create': expense_create,
+    'payment_create': payment_create,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the API with concurrent requests as seeded users and report "
+        "latency percentiles, throughput and queries per request"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenarios',
+            default=','.join(SCENARIOS),
+            help=f"Comma-separated subset of: {', '.join(SCENARIOS)}",
+        )
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--warmup', type=int, default=10, help="Unmeasured requests per scenario")
+        parser.add_argument(
+            '--url',
+            help="Base URL of a running server, e.g. http://localhost:8000. "
+                 "Requests run in-process through the test client when omitted.",
+        )
+        parser.add_argument('--prefix', default='load', help="Username prefix used by seed_load")
+        parser.add_argument('--users', type=int, default=50, help="How many seeded users to act as")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--asgi',
+            action='store_true',
+            help="Run in-process through the ASGI handler on one event loop, with "
+                 "--concurrency requests in flight. Compare with a sync run at "
+                 "--concurrency 1 for equal worker counts; set ASYNC_READS=True to "
+                 "use the async read views.",
+        )
+        parser.add_argument(
+            '--disable-metrics',
+            action='store_true',
+            help="Run in-process without MetricsMiddleware, to measure its overhead with --compare",
+        )
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--compare', help="Print the change against an earlier results file")
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        self.base_url = options['url'].rstrip('/') if options['url'] else None
+        self.asgi = options['asgi']
+        if self.asgi and self.base_url:
+            raise CommandError("--asgi runs in-process and cannot be combined with --url")
+        self.rng = random.Random(options['seed'])
+        self.local = threading.local()
+        actors = self.load_actors(options['prefix'], options['users'])
+
+        results = {
+            'started_at': timezone.now().isoformat(),
+            'mode': 'http' if self.base_url else 'asgi' if self.asgi else 'in-process',
+            'async_reads': settings.ASYNC_READS,
+            'target': self.base_url,
+            'database': connection.vendor,
+            'concurrency': options['concurrency'],
+            'requests_per_scenario': options['requests'],
+            'metrics_middleware': not options['disable_metrics'],
+            'scenarios': {},
+        }
+        middleware = settings.MIDDLEWARE
+        if options['disable_metrics']:
+            if self.base_url:
+                raise CommandError("--disable-metrics only applies to in-process runs")
+            middleware = [path for path in middleware if path != METRICS_MIDDLEWARE]
+        with override_settings(MIDDLEWARE=middleware):
+            for name in names:
+                self.run_scenario(name, actors, options['warmup'], 1)
+                summary = self.run_scenario(name, actors, options['requests'], options['concurrency'])
+                results['scenarios'][name] = summary
+                self.report(name, summary)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def load_actors(self, prefix, count):
+        tokens = list(Token.objects.filter(
+            user__username__startswith=f'{prefix}_'
+        ).order_by('user_id')[:count])
+        if not tokens:
+            raise CommandError(f"No users named {prefix}_*; run seed_load first")
+        actors = {token.user_id: Actor(token) for token in tokens}
+        for user_id, friend_id in Friendship.objects.filter(
+            user_id__in=actors
+        ).values_list('user_id', 'friend_id'):
+            actors[user_id].friend_ids.append(friend_id)
+        for debtor_id, creditor_id in BalanceLedger.objects.filter(
+            debtor_id__in=actors, amount__gt=0
+        ).values_list('debtor_id', 'creditor_id'):
+            actors[debtor_id].creditor_ids.append(creditor_id)
+        # Users without friends cannot create shared expenses or pay anyone
+        actors = [actor for actor in actors.values() if actor.friend_ids]
+        if not actors:
+            raise CommandError("None of the seeded users have friends to split with")
+        return actors
+
+    def run_scenario(self, name, actors, count, concurrency):
+        build = SCENARIOS[name]
+        # Requests are planned up front so runs with the same seed match
+        planned = []
+        for _ in range(count):
+            actor = self.rng.choice(actors)
+            planned.append((actor, build(actor, self.rng)))
+
+        started = time.perf_counter()
+        if self.asgi:
+            samples = asyncio.run(self.run_async(planned, concurrency))
+        else:
+            with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+                samples = list(pool.map(lambda plan: self.send(*plan), planned))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(sample[0] for sample in samples)
+        statuses = Counter(sample[1] for sample in samples)
+        queries = [sample[2] for sample in samples if sample[2] is not None]
+        return {
+            'requests': count,
+            'errors': sum(n for code, n in statuses.items() if code is None or code >= 400),
+            'status_codes': {str(code): n for code, n in sorted(statuses.items(), key=str)},
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(count / elapsed, 1) if elapsed else None,
+            'mean_ms': round(statistics.mean(latencies), 2) if latencies else None,
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': latencies[-1] if latencies else None,
+            'queries_per_request': round(statistics.mean(queries), 2) if queries else None,
+        }
+
+    def send(self, actor, request):
+        """Send one request; returns (latency_ms, status, queries)"""
+        method, path, body = request
+        if self.base_url:
+            return self.send_http(actor, method, path, body)
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            if method == 'GET':
+                response = client.get(path, HTTP_AUTHORIZATION=actor.auth)
+            else:
+                response = client.post(
+                    path, json.dumps(body), content_type='application/json',
+                    HTTP_AUTHORIZATION=actor.auth
+                )
+            latency = (time.perf_counter() - started) * 1000
+        return round(latency, 3), response.status_code, len(captured.captured_queries)
+
+    async def run_async(self, planned, concurrency):
+        """Send the planned requests from one event loop, `concurrency` at a time"""
+        client = AsyncClient()
+        slots = asyncio.Semaphore(max(concurrency, 1))
+
+        async def send(actor, request):
+            async with slots:
+                return await self.send_async(client, actor, request)
+        return await asyncio.gather(*(send(*plan) for plan in planned))
+
+    async def send_async(self, client, actor, request):
+        method, path, body = request
+        headers = {'Authorization': actor.auth}
+        # Like ASGIHandler, give each request its own database thread and
+        # close its connection when it is done
+        async with ThreadSensitiveContext():
+            started = time.perf_counter()
+            if method == 'GET':
+                response = await client.get(path, headers=headers)
+            else:
+                response = await client.post(
+                    path, json.dumps(body), content_type='application/json', headers=headers
+                )
+            latency = (time.perf_counter() - started) * 1000
+            await sync_to_async(connections.close_all)()
+        # Queries run on per-request threads, out of reach of CaptureQueriesContext
+        return round(latency, 3), response.status_code, None
+
+    def send_http(self, actor, method, path, body):
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(body).encode('utf-8') if body is not None else None,
+            method=method,
+            headers={'Authorization': actor.auth, 'Content-Type': 'application/json'},
+        )
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError:
+            status = None
+        latency = (time.perf_counter() - started) * 1000
+        # Query counts are only visible in-process
+        return round(latency, 3), status, None
+
+    def report(self, name, summary):
+        queries = summary['queries_per_request']
+        self.stdout.write(
+            f"{name:16} {summary['throughput_rps']:>8} req/s  "
+            f"p50 {summary['p50_ms']:>8.2f} ms  p95 {summary['p95_ms']:>8.2f} ms  "
+            f"p99 {summary['p99_ms']:>8.2f} ms  "
+            f"queries {queries if queries is not None else '-':>6}  errors {summary['errors']}"
+        )
+
+    def compare(self, path, results):
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)
+        self.stdout.write(f"Compared with {path} ({baseline.get('started_at')}):")
+        for name, summary in results['scenarios'].items():
+            before = baseline.get('scenarios', {}).get(name)
+            if not before:
+                self.stdout.write(f"{name:16} not in baseline")
+                continue
+            changes = []
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_per_request'):
+                old, new = before.get(metric), summary.get(metric)
+                if old and new is not None:
+                    changes.append(f"{metric} {(new - old) / old * 100:+.1f}%")
+            self.stdout.write(f"{name:16} " + '  '.join(changes))
@@ -0,0 +1,57 @@
+import random
+import statistics
+import time
+from collections import defaultdict
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from expenses import simplify
+
+
+def random_debts(users, debts_per_user, rng):
+    """{(debtor_id, creditor_id): amount} with each user owing a few random others"""
+    debts = {}
+    for debtor_id in range(1, users + 1):
+        for creditor_id in rng.sample(range(1, users + 1), debts_per_user):
+            if creditor_id != debtor_id:
+                debts[(debtor_id, creditor_id)] = Decimal(rng.randint(1, 50000)) / 100
+    return debts
+
+
+def check(debts, transfers):
+    """Raise CommandError unless the transfers clear every net position"""
+    positions = defaultdict(Decimal, simplify.net_positions(debts))
+    for debtor_id, creditor_id, amount in transfers:
+        if amount <= 0:
+            raise CommandError(f"Non-positive transfer {debtor_id} -> {creditor_id}: {amount}")
+        positions[debtor_id] += amount
+        positions[creditor_id] -= amount
+    left = {user_id: amount for user_id, amount in positions.items() if amount}
+    if left:
+        raise CommandError(f"{len(left)} net position(s) left open after the transfers")
+
+
+class Command(BaseCommand):
+    help = "Time debt simplification on a random in-memory debt graph"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--debts-per-user', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options['debts_per_user'] >= options['users']:
+            raise CommandError("--debts-per-user must be less than --users")
+        debts = random_debts(options['users'], options['debts_per_user'], random.Random(options['seed']))
+
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            transfers = simplify.minimum_transfers(debts)
+            timings.append(time.perf_counter() - started)
+        check(debts, transfers)
+
+        self.stdout.write(
+            f"{options['users']} users, {len(debts)} debts -> {len(transfers)} transfers; "
+            f"best {min(timings) * 1000:.0f} ms, median {statistics.median(timings) * 1000:.0f} ms"
+        )
@@ -0,0 +1,60 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from expenses import splits
+
+
+def random_expense(participants, items, rng):
+    """(items, participant_ids) with most items shared and the rest assigned"""
+    participant_ids = list(range(1, participants + 1))
+    expense_items = [
+        (
+            Decimal(rng.randint(1, 100000)) / 100,
+            rng.random() < 0.8,
+            rng.choice(participant_ids),
+        )
+        for _ in range(items)
+    ]
+    return expense_items, participant_ids
+
+
+class Command(BaseCommand):
+    help = "Time split_expense on a large random expense for each split type"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--participants', type=int, default=1000)
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options['participants'] < 1 or options['items'] < 1:
+            raise CommandError("--participants and --items must be at least 1")
+        rng = random.Random(options['seed'])
+        items, participant_ids = random_expense(options['participants'], options['items'], rng)
+        tax = Decimal('123.45')
+        expected = sum(splits.to_cents(amount) for amount, _, _ in items) + splits.to_cents(tax)
+
+        # Percentages in hundredths, adding up to exactly 100
+        hundredths = splits.allocate(10000, [rng.randint(1, 10) for _ in participant_ids])
+        cases = {
+            splits.EQUAL: None,
+            splits.WEIGHTS: {pid: rng.randint(1, 10) for pid in participant_ids},
+            splits.PERCENTAGE: {pid: splits.from_cents(cents) for pid, cents in zip(participant_ids, hundredths)},
+        }
+        for split_type, split_values in cases.items():
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                owed = splits.split_expense(
+                    items, participant_ids, tax, split_type, split_values, splits.TAX_PROPORTIONAL
+                )
+                timings.append(time.perf_counter() - started)
+            if sum(owed.values()) != expected:
+                raise CommandError(f"{split_type} split lost cents: {sum(owed.values())} != {expected}")
+            self.stdout.write(
+                f"{split_type:<10} {len(participant_ids)} participants x {len(items)} items; "
+                f"best {min(timings) * 1000:.1f} ms, median {statistics.median(timings) * 1000:.1f} ms"
+            )
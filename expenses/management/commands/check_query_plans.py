@@ -0,0 +1,83 @@
+import re
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from expenses.models import Expense, ExpenseShare, Payment
+
+# Plan lines that mean a whole table is read. SQLite reports "SCAN <table>"
+# without "USING ... INDEX" for full scans.
+SEQ_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (\w+)(?!.*USING (?:COVERING )?INDEX)'),
+}
+
+
+def hot_queries(user_id, friend_id):
+    """The filters behind balances, settlement and per-user listings"""
+    return {
+        'settlement shares': ExpenseShare.objects.filter(
+            participant_id=user_id,
+            expense__created_by_id=friend_id,
+            settled=False
+        ).order_by('expense__created_at'),
+        'open debts of user': ExpenseShare.objects.filter(
+            participant_id=user_id,
+            settled=False
+        ),
+        'open debts to user': ExpenseShare.objects.filter(
+            expense__created_by_id=user_id,
+            settled=False
+        ),
+        'expenses by creator': Expense.objects.filter(
+            created_by_id=user_id
+        ).order_by('-created_at', '-id'),
+        'payments between pair': Payment.objects.filter(
+            from_user_id=user_id,
+            to_user_id=friend_id
+        ).order_by('-created_at'),
+    }
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot expense/share/payment queries and fail on sequential scans"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help="Print every plan")
+
+    def handle(self, *args, **options):
+        pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f"Plan checks are not supported on {connection.vendor}")
+
+        user_ids = list(User.objects.values_list('id', flat=True)[:2])
+        user_id = user_ids[0] if user_ids else 1
+        friend_id = user_ids[-1] if user_ids else 2
+        watched = {
+            model._meta.db_table for model in (Expense, ExpenseShare, Payment)
+        }
+
+        failures = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Small tables are always cheaper to scan; ask whether an
+                # index *could* serve the query instead
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, queryset in hot_queries(user_id, friend_id).items():
+                plan = queryset.explain()
+                if options['verbose_plans']:
+                    self.stdout.write(f"-- {name}\n{plan}\n")
+                scanned = {
+                    table for table in pattern.findall(plan) if table in watched
+                }
+                if scanned:
+                    failures.append(name)
+                    self.stdout.write(self.style.ERROR(
+                        f"{name}: sequential scan on {', '.join(sorted(scanned))}"
+                    ))
+                else:
+                    self.stdout.write(f"{name}: ok")
+
+        if failures:
+            raise CommandError(f"{len(failures)} hot query plan(s) use sequential scans")
+        self.stdout.write(self.style.SUCCESS("All hot queries use indexes"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from expenses import ledger
+
+
+class Command(BaseCommand):
+    help = "Rebuild the pairwise balance ledger from expense shares, or verify it"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help="Only compare the ledger with the shares and report drift",
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            drift = ledger.find_drift()
+            for debtor_id, creditor_id, ledger_amount, expected_amount in drift:
+                self.stdout.write(
+                    f"{debtor_id} -> {creditor_id}: ledger {ledger_amount}, shares {expected_amount}"
+                )
+            if drift:
+                raise CommandError(f"{len(drift)} ledger pair(s) out of sync")
+            self.stdout.write(self.style.SUCCESS("Ledger matches expense shares"))
+            return
+
+        ledger.rebuild()
+        drift = ledger.find_drift()
+        if drift:
+            raise CommandError(f"{len(drift)} ledger pair(s) still out of sync after rebuild")
+        self.stdout.write(self.style.SUCCESS("Ledger rebuilt from expense shares"))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from expenses import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the monthly rollups from expense shares and payments, or verify them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help="Only compare the rollups with shares and payments and report drift",
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            drift = rollups.find_drift()
+            for user_id, counterparty_id, month, field, rollup_amount, expected_amount in drift:
+                self.stdout.write(
+                    f"{user_id} / {counterparty_id or '-'} / {month:%Y-%m} {field}: "
+                    f"rollup {rollup_amount}, expected {expected_amount}"
+                )
+            if drift:
+                raise CommandError(f"{len(drift)} rollup value(s) out of sync")
+            self.stdout.write(self.style.SUCCESS("Monthly rollups match shares and payments"))
+            return
+
+        rollups.rebuild()
+        drift = rollups.find_drift()
+        if drift:
+            raise CommandError(f"{len(drift)} rollup value(s) still out of sync after rebuild")
+        self.stdout.write(self.style.SUCCESS("Monthly rollups rebuilt from shares and payments"))
@@ -0,0 +1,80 @@
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+from expenses import jobs, slow_queries
+
+
+class Command(BaseCommand):
+    help = "Run background jobs from the database queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help="Number of jobs to run at the same time (worker threads)",
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help="Seconds to wait before polling again when the queue is empty",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Exit once no due jobs are left instead of polling forever",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(options['concurrency'], 1)
+        self.poll_interval = options['poll_interval']
+        self.once = options['once']
+        self.stopping = threading.Event()
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        def stop(signum, frame):
+            self.stdout.write("Finishing running jobs before exiting")
+            self.stopping.set()
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+        self.stdout.write(f"Worker {worker_id} running {concurrency} thread(s)")
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for index in range(concurrency):
+                pool.submit(self.work, f"{worker_id}/{index}")
+        self.stdout.write(self.style.SUCCESS("Worker stopped"))
+
+    def work(self, worker_id):
+        """Claim and run jobs one at a time until told to stop"""
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                try:
+                    claimed = jobs.claim(worker_id)
+                    for job in claimed:
+                        with slow_queries.watch(f"job {job.kind}"):
+                            job = jobs.run(job)
+                        self.stdout.write(f"{worker_id} {job}")
+                except DatabaseError as e:
+                    # Keep the thread alive through transient database errors;
+                    # a job left running is requeued once it goes stale
+                    self.stderr.write(f"{worker_id} database error: {e}")
+                    close_old_connections()
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                if not claimed:
+                    if self.once:
+                        return
+                    self.stopping.wait(self.poll_interval)
+        finally:
+            # Each thread has its own connection
+            connection.close()
@@ -0,0 +1,177 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from expenses import rollups, splits
+from expenses.models import BalanceLedger, Expense, Payment
+from expenses.serializers import write_expenses
+from expenses.settlement import settle_payment
+
+# How many other people join an expense, and how many items it has
+PARTICIPANT_COUNTS = ([1, 2, 3, 4, 5], [35, 30, 18, 10, 7])
+ITEM_COUNTS = ([1, 2, 3, 4, 6], [40, 25, 15, 12, 8])
+ITEM_NAMES = [
+    'groceries', 'dinner', 'lunch', 'coffee', 'taxi', 'train tickets', 'fuel',
+    'rent', 'electricity', 'internet', 'movie tickets', 'drinks', 'hotel',
+    'pizza', 'snacks', 'gift', 'concert', 'parking', 'cleaning supplies',
+]
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic users, friend groups, expenses and payments for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--expenses', type=int, default=10000)
+        parser.add_argument('--payments', type=int, default=2000)
+        parser.add_argument('--months', type=int, default=12, help="Spread activity over this many past months")
+        parser.add_argument('--group-size', type=int, default=12, help="Typical size of a friend group")
+        parser.add_argument('--prefix', default='load', help="Username prefix; users are <prefix>_<n>")
+        parser.add_argument('--password', default='load-test-password')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}_').exists():
+            raise CommandError(f"Users named {prefix}_* already exist; pick another --prefix")
+        started = time.perf_counter()
+
+        users = self.create_users(prefix, options['users'], options['password'])
+        circles = self.friend_circles(users, options['group_size'])
+        expenses = self.create_expenses(users, circles, options['expenses'])
+        self.backdate(Expense, expenses, options['months'])
+        payments = self.create_payments(users, options['payments'])
+        self.backdate(Payment, payments, options['months'])
+        # Months changed after the writes, so recompute the rollups once
+        rollups.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(expenses)} expenses and "
+            f"{len(payments)} payments in {time.perf_counter() - started:.1f}s"
+        ))
+
+    def create_users(self, prefix, count, password):
+        # Hashing once keeps seeding fast; every user gets the same password
+        password_hash = make_password(password)
+        User.objects.bulk_create([
+            User(username=f'{prefix}_{index}', password=password_hash)
+            for index in range(count)
+        ], batch_size=1000)
+        users = list(User.objects.filter(username__startswith=f'{prefix}_').order_by('id'))
+        Token.objects.bulk_create([
+            Token(key=Token.generate_key(), user=user) for user in users
+        ], batch_size=1000)
+        self.stdout.write(f"Created {len(users)} users with tokens")
+        return users
+
+    def friend_circles(self, users, group_size):
+        """Split users into friend groups, each with a few outside friends"""
+        shuffled = users[:]
+        self.rng.shuffle(shuffled)
+        group_size = max(group_size, 2)
+        circles = {}
+        for start in range(0, len(shuffled), group_size):
+            group = shuffled[start:start + group_size]
+            for user in group:
+                friends = {other.id: other for other in group}
+                for other in self.rng.sample(users, min(2, len(users))):
+                    friends[other.id] = other
+                friends.pop(user.id)
+                circles[user.id] = list(friends.values())
+        return circles
+
+    def expense_entry(self, creator, friends):
+        rng = self.rng
+        others = rng.sample(friends, min(rng.choices(*PARTICIPANT_COUNTS)[0], len(friends)))
+        participants = others + [creator]
+        items = []
+        for _ in range(rng.choices(*ITEM_COUNTS)[0]):
+            amount = Decimal(str(round(min(rng.lognormvariate(3, 0.8), 2000), 2))).quantize(Decimal('0.01'))
+            shared = rng.random() < 0.8
+            items.append({
+                'name': rng.choice(ITEM_NAMES),
+                'amount': max(amount, Decimal('0.50')),
+                'is_shared': shared,
+                'assigned_to_id': None if shared else rng.choice(participants).id,
+            })
+        total = sum((item['amount'] for item in items), Decimal('0.00'))
+        tax = (total * Decimal(rng.choice([5, 8, 10])) / 100).quantize(Decimal('0.01')) if rng.random() < 0.3 else Decimal('0.00')
+
+        split_type = rng.choices([splits.EQUAL, splits.WEIGHTS, splits.PERCENTAGE], [80, 10, 10])[0]
+        split_values = None
+        if split_type == splits.WEIGHTS:
+            split_values = {user.id: Decimal(rng.randint(1, 3)) for user in participants}
+        elif split_type == splits.PERCENTAGE:
+            cuts = sorted(rng.sample(range(1, 100), len(participants) - 1)) if len(participants) > 1 else []
+            bounds = [0] + cuts + [100]
+            split_values = {
+                user.id: Decimal(bounds[index + 1] - bounds[index])
+                for index, user in enumerate(participants)
+            }
+        return {
+            'title': f"{items[0]['name'].capitalize()} with {len(others)} friend(s)",
+            'description': '',
+            'total_amount': total,
+            'tax_amount': tax,
+            'created_by': creator,
+            'items': items,
+            'participants': others,
+            'split_type': split_type,
+            'split_values': split_values,
+            'tax_split': rng.choice(splits.TAX_SPLITS),
+        }
+
+    def create_expenses(self, users, circles, count):
+        by_creator = {}
+        for _ in range(count):
+            creator = self.rng.choice(users)
+            by_creator.setdefault(creator.id, (creator, []))[1].append(
+                self.expense_entry(creator, circles[creator.id])
+            )
+        expenses = []
+        # write_expenses keeps the ledger, graph, rollups and search index in
+        # step with set-based inserts per batch
+        for creator, entries in by_creator.values():
+            for start in range(0, len(entries), 500):
+                expenses.extend(write_expenses(entries[start:start + 500], creator))
+        self.stdout.write(f"Created {len(expenses)} expenses")
+        return expenses
+
+    def create_payments(self, users, count):
+        """Pay off part of randomly chosen open debts between seeded users"""
+        debts = list(BalanceLedger.objects.filter(
+            debtor__in=users, amount__gt=0
+        ).values_list('debtor_id', 'creditor_id', 'amount'))
+        payments = []
+        for debtor_id, creditor_id, amount in self.rng.sample(debts, min(count, len(debts))):
+            fraction = Decimal(self.rng.choice([25, 50, 75, 100])) / 100
+            with transaction.atomic():
+                payment = Payment.objects.create(
+                    from_user_id=debtor_id,
+                    to_user_id=creditor_id,
+                    amount=max((amount * fraction).quantize(Decimal('0.01')), Decimal('0.01')),
+                    notes='Seeded payment'
+                )
+                settle_payment(payment)
+            payments.append(payment)
+        self.stdout.write(f"Created {len(payments)} payments")
+        return payments
+
+    def backdate(self, model, rows, months):
+        """Spread created_at over the past `months` months"""
+        now = timezone.now()
+        span = timedelta(days=30 * max(months, 1)).total_seconds()
+        fields = ['created_at']
+        if any(field.name == 'updated_at' for field in model._meta.fields):
+            fields.append('updated_at')
+        for row in rows:
+            row.created_at = now - timedelta(seconds=self.rng.uniform(0, span))
+            row.updated_at = row.created_at
+        model.objects.bulk_update(rows, fields, batch_size=1000)
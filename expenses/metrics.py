@@ -0,0 +1,147 @@
+"""Per-route request metrics kept in process and rendered for Prometheus.
+
+Each thread records into its own shard, so the request path never takes a
+lock; a lock is only taken the first time a thread records anything and
+when a scrape copies the shards. Values are per process; with several
+workers, scrape each of them (or use a per-worker port) and aggregate in
+Prometheus.
+"""
+import bisect
+import threading
+from collections import defaultdict
+
+# Upper bounds of the histogram buckets, per metric
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Methods reported as themselves; anything else a client sends is counted
+# as "other", so made-up methods cannot create new series
+HTTP_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'))
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': ("Wall time spent handling the request", SECONDS_BUCKETS),
+    'http_request_db_duration_seconds': ("Time spent in database queries", SECONDS_BUCKETS),
+    'http_request_db_queries': ("Database queries run by the request", QUERY_BUCKETS),
+    'http_response_size_bytes': ("Response body size", BYTES_BUCKETS),
+}
+
+
+class _Histogram:
+    __slots__ = ('counts', 'total')
+
+    def __init__(self, buckets):
+        # One slot per bucket plus the +Inf overflow
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {'requests': defaultdict(int), 'histograms': {}}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe_request(self, route, method, status, duration, db_duration, queries, size):
+        shard = self._shard()
+        method = method if method in HTTP_METHODS else 'other'
+        shard['requests'][(route, method, str(status))] += 1
+        histograms = shard['histograms']
+        for name, value in (
+            ('http_request_duration_seconds', duration),
+            ('http_request_db_duration_seconds', db_duration),
+            ('http_request_db_queries', queries),
+            ('http_response_size_bytes', size),
+        ):
+            if value is None:
+                continue
+            buckets = HISTOGRAMS[name][1]
+            histogram = histograms.get((name, route))
+            if histogram is None:
+                histogram = histograms[(name, route)] = _Histogram(buckets)
+            histogram.counts[bisect.bisect_left(buckets, value)] += 1
+            histogram.total += value
+
+    def snapshot(self):
+        """Sum every thread's shard into (requests, histograms)"""
+        with self._lock:
+            shards = list(self._shards)
+        requests = defaultdict(int)
+        histograms = {}
+        for shard in shards:
+            # dict.copy() is atomic, so the owning thread can keep adding keys
+            for key, value in shard['requests'].copy().items():
+                requests[key] += value
+            for key, histogram in shard['histograms'].copy().items():
+                merged = histograms.get(key)
+                if merged is None:
+                    merged = histograms[key] = _Histogram(HISTOGRAMS[key[0]][1])
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.total += histogram.total
+        return requests, histograms
+
+    def reset(self):
+        with self._lock:
+            self._shards = []
+        self._local = threading.local()
+
+
+registry = MetricsRegistry()
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render():
+    """The registry, plus cache statistics, in Prometheus text format 0.0.4"""
+    from .authentication import token_cache
+    from .response_cache import response_cache
+
+    requests, histograms = registry.snapshot()
+    lines = [
+        '# HELP http_requests_total Requests handled, by route, method and status',
+        '# TYPE http_requests_total counter',
+    ]
+    for (route, method, status), value in sorted(requests.items()):
+        lines.append(
+            f'http_requests_total{{route="{_label(route)}",method="{_label(method)}",status="{status}"}} {value}'
+        )
+
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, route), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            route = _label(route)
+            cumulative = 0
+            for bound, count in zip(buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{route="{route}",le="{_number(bound)}"}} {cumulative}')
+            cumulative += histogram.counts[-1]
+            lines.append(f'{name}_bucket{{route="{route}",le="+Inf"}} {cumulative}')
+            lines.append(f'{name}_sum{{route="{route}"}} {_number(histogram.total)}')
+            lines.append(f'{name}_count{{route="{route}"}} {cumulative}')
+
+    for cache_name, stats in (('token', token_cache.stats()), ('response', response_cache.stats())):
+        for result in ('hits', 'misses'):
+            metric = f'{cache_name}_cache_{result}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {stats[result]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,129 @@
+import time
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from whitenoise.middleware import WhiteNoiseMiddleware
+from . import slow_queries
+from .metrics import registry
+
+
+def request_source(request):
+    """Method and resolved URL name, e.g. "GET expense-list", for slow query attribution"""
+    match = getattr(request, 'resolver_match', None)
+    return f"{request.method} {match.view_name if match else request.path}"
+
+
+class QueryTimer:
+    """execute_wrapper that counts queries, adds up their time and logs slow ones"""
+
+    def __init__(self, request):
+        self.request = request
+        self.queries = 0
+        self.seconds = 0.0
+        self.slow_threshold = slow_queries.threshold()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.seconds += duration
+            self.queries += 1
+            if duration >= self.slow_threshold:
+                slow_queries.log.record(sql, duration, request_source(self.request))
+
+
+class MetricsMiddleware:
+    """Record latency, DB time, query count and response size per route.
+
+    The route is the resolved URL name, for example `expense-list` or
+    `friend-overall-balance`. Requests that match no URL are grouped
+    under `unmatched`, and methods other than the standard HTTP ones under
+    `other`, so arbitrary paths and methods cannot create new series.
+    Queries over SLOW_QUERIES['THRESHOLD_MS'] also go to the slow query log.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timer = QueryTimer(request)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            self.time_queries(stack, timer)
+            response = self.get_response(request)
+        self.observe(request, response, timer, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer(request)
+        started = time.perf_counter()
+        # Connections are per thread, and async views query from the
+        # request's database thread, so the wrappers go on there
+        stack = ExitStack()
+        await sync_to_async(self.time_queries)(stack, timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.observe(request, response, timer, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def time_queries(stack, timer):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+
+    @staticmethod
+    def observe(request, response, timer, duration):
+        match = getattr(request, 'resolver_match', None)
+        route = (match.view_name or match.url_name or 'unnamed') if match else 'unmatched'
+        # Streamed bodies are not buffered, so their size is unknown here
+        size = None if response.streaming else len(response.content)
+        registry.observe_request(
+            route, request.method, response.status_code,
+            duration, timer.seconds, timer.queries, size
+        )
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise that also runs natively in the async middleware stack.
+
+    WhiteNoise's own middleware is sync only, so under ASGI Django would put
+    every request through a thread for it. Here only static file responses
+    are built in a thread; everything else goes straight on to the async
+    handler. Under WSGI it is plain WhiteNoise.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is None:
+            return await self.get_response(request)
+        return await sync_to_async(self.serve)(static_file, request)
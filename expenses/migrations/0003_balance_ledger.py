@@ -0,0 +1,52 @@
+# Generated by Django 4.2.10 on 2026-10-17 00:25
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_ledger(apps, schema_editor):
+    ExpenseShare = apps.get_model('expenses', 'ExpenseShare')
+    BalanceLedger = apps.get_model('expenses', 'BalanceLedger')
+    rows = ExpenseShare.objects.filter(
+        paid_by=False,
+        settled=False
+    ).exclude(
+        participant=models.F('expense__created_by')
+    ).values('participant', 'expense__created_by').annotate(
+        total=models.Sum('amount')
+    )
+    BalanceLedger.objects.bulk_create([
+        BalanceLedger(
+            debtor_id=row['participant'],
+            creditor_id=row['expense__created_by'],
+            amount=row['total']
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('expenses', '0002_expense_tax_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('creditor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credits', to=settings.AUTH_USER_MODEL)),
+                ('debtor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='debts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='balanceledger',
+            constraint=models.UniqueConstraint(fields=('debtor', 'creditor'), name='unique_ledger_pair'),
+        ),
+        migrations.RunPython(populate_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.10 on 2026-10-17 00:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0003_balance_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['created_by', 'created_at'], name='expense_creator_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expenseshare',
+            index=models.Index(condition=models.Q(('paid_by', False), ('settled', False)), fields=['participant', 'expense'], name='share_open_participant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expenseshare',
+            index=models.Index(condition=models.Q(('paid_by', False), ('settled', False)), fields=['expense', 'participant'], name='share_open_expense_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['from_user', 'to_user', 'created_at'], name='payment_pair_created_idx'),
+        ),
+    ]
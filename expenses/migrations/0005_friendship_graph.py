@@ -0,0 +1,75 @@
+# Generated by Django 4.2.10 on 2026-10-17 00:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_graph(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    ExpenseShare = apps.get_model('expenses', 'ExpenseShare')
+    ExpenseParticipant = apps.get_model('expenses', 'ExpenseParticipant')
+    Friendship = apps.get_model('expenses', 'Friendship')
+    participants = {
+        (expense_id, creator_id): creator_id
+        for expense_id, creator_id in Expense.objects.values_list('id', 'created_by_id')
+    }
+    friendships = set()
+    shares = ExpenseShare.objects.values_list(
+        'expense_id', 'expense__created_by_id', 'participant_id'
+    ).distinct()
+    for expense_id, creator_id, user_id in shares:
+        participants[(expense_id, user_id)] = creator_id
+        if user_id != creator_id:
+            friendships.add((creator_id, user_id))
+            friendships.add((user_id, creator_id))
+    ExpenseParticipant.objects.bulk_create([
+        ExpenseParticipant(expense_id=expense_id, user_id=user_id, creator_id=creator_id)
+        for (expense_id, user_id), creator_id in participants.items()
+    ], batch_size=5000)
+    Friendship.objects.bulk_create([
+        Friendship(user_id=user_id, friend_id=friend_id)
+        for user_id, friend_id in friendships
+    ], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('expenses', '0004_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Friendship',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('friend', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friendships', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExpenseParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('expense', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participant_rows', to='expenses.expense')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.UniqueConstraint(fields=('user', 'friend'), name='unique_friendship'),
+        ),
+        migrations.AddIndex(
+            model_name='expenseparticipant',
+            index=models.Index(fields=['user', 'creator'], name='participant_user_creator_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='expenseparticipant',
+            constraint=models.UniqueConstraint(fields=('expense', 'user'), name='unique_expense_participant'),
+        ),
+        migrations.RunPython(populate_graph, migrations.RunPython.noop),
+    ]
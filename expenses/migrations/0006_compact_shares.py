@@ -0,0 +1,89 @@
+# Generated by Django 4.2.10 on 2026-10-17 00:37
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def collapse_shares(apps, schema_editor):
+    """Drop mirrored payer rows and merge split rows into one share per debtor.
+
+    Partial payments used to split a share into a settled row and an open
+    remainder, and duplicate participant ids or admin inlines could add
+    several open rows for one debtor. The merged row keeps the lowest id,
+    the combined amount, and the settled part as `settled_amount`, so
+    outstanding balances are unchanged.
+    """
+    ExpenseShare = apps.get_model('expenses', 'ExpenseShare')
+    ExpenseShare.objects.filter(paid_by=True).delete()
+
+    rows = ExpenseShare.objects.order_by('expense_id', 'participant_id', 'id').values_list(
+        'id', 'expense_id', 'participant_id', 'amount', 'settled'
+    )
+    merged = {}
+    duplicates = []
+    for share_id, expense_id, participant_id, amount, settled in rows.iterator(chunk_size=5000):
+        key = (expense_id, participant_id)
+        if key in merged:
+            duplicates.append(share_id)
+            merged[key][3] = True
+        else:
+            merged[key] = [share_id, Decimal('0.00'), Decimal('0.00'), False]
+        merged[key][1] += amount
+        if settled:
+            merged[key][2] += amount
+
+    updates = []
+    for share_id, amount, settled_amount, has_duplicates in merged.values():
+        # Merged rows need the combined amount even when none of it is settled
+        if settled_amount or has_duplicates:
+            updates.append(ExpenseShare(
+                id=share_id,
+                amount=amount,
+                settled_amount=settled_amount,
+                settled=settled_amount >= amount
+            ))
+    ExpenseShare.objects.bulk_update(
+        updates, ['amount', 'settled_amount', 'settled'], batch_size=1000
+    )
+    for start in range(0, len(duplicates), 1000):
+        ExpenseShare.objects.filter(id__in=duplicates[start:start + 1000]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0005_friendship_graph'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='expenseshare',
+            name='share_open_participant_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='expenseshare',
+            name='share_open_expense_idx',
+        ),
+        migrations.AddField(
+            model_name='expenseshare',
+            name='settled_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10),
+        ),
+        migrations.RunPython(collapse_shares, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='expenseshare',
+            name='paid_by',
+        ),
+        migrations.AddIndex(
+            model_name='expenseshare',
+            index=models.Index(condition=models.Q(('settled', False)), fields=['participant', 'expense'], name='share_open_participant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expenseshare',
+            index=models.Index(condition=models.Q(('settled', False)), fields=['expense', 'participant'], name='share_open_expense_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='expenseshare',
+            constraint=models.UniqueConstraint(fields=('expense', 'participant'), name='unique_expense_debtor'),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 4.2.10 on 2026-10-17 00:39
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from collections import defaultdict
+from django.db.models.functions import TruncMonth
+
+
+def populate_rollups(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    ExpenseShare = apps.get_model('expenses', 'ExpenseShare')
+    Payment = apps.get_model('expenses', 'Payment')
+    MonthlyRollup = apps.get_model('expenses', 'MonthlyRollup')
+    totals = defaultdict(lambda: defaultdict(lambda: Decimal('0.00')))
+
+    def add(user_id, counterparty_id, month, field, amount):
+        totals[(user_id, counterparty_id, month)][field] += amount
+        totals[(user_id, None, month)][field] += amount
+
+    # Overall paid is the full expense total; pair rows get the shares
+    expenses = Expense.objects.annotate(
+        month=TruncMonth('created_at', output_field=models.DateField())
+    ).values('created_by', 'month').annotate(total=models.Sum('total_amount'))
+    for row in expenses:
+        totals[(row['created_by'], None, row['month'])]['paid'] += row['total']
+
+    shares = ExpenseShare.objects.exclude(
+        participant=models.F('expense__created_by')
+    ).annotate(
+        month=TruncMonth('expense__created_at', output_field=models.DateField())
+    ).values('participant', 'expense__created_by', 'month').annotate(total=models.Sum('amount'))
+    for row in shares:
+        totals[(row['expense__created_by'], row['participant'], row['month'])]['paid'] += row['total']
+        add(row['participant'], row['expense__created_by'], row['month'], 'owed', row['total'])
+    payments = Payment.objects.annotate(
+        month=TruncMonth('created_at', output_field=models.DateField())
+    ).values('from_user', 'to_user', 'month').annotate(total=models.Sum('amount'))
+    for row in payments:
+        add(row['from_user'], row['to_user'], row['month'], 'settled', row['total'])
+        add(row['to_user'], row['from_user'], row['month'], 'received', row['total'])
+
+    MonthlyRollup.objects.bulk_create([
+        MonthlyRollup(user_id=user_id, counterparty_id=counterparty_id, month=month, **fields)
+        for (user_id, counterparty_id, month), fields in totals.items()
+    ], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('expenses', '0006_compact_shares'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('owed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('settled', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('received', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('counterparty', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('counterparty__isnull', False)), fields=('user', 'counterparty', 'month'), name='unique_rollup_pair_month'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('counterparty__isnull', True)), fields=('user', 'month'), name='unique_rollup_user_month'),
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
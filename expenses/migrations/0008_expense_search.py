@@ -0,0 +1,58 @@
+# Generated by Django 4.2.10 on 2026-10-17 00:41
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+ITEM_NAMES = (
+    "COALESCE((SELECT string_agg(i.name, ' ') FROM expenses_expenseitem i "
+    "WHERE i.expense_id = e.id), '')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX expense_search_vector_idx ON expenses_expense "
+            "USING gin (search_vector)"
+        )
+        schema_editor.execute(
+            "UPDATE expenses_expense e SET search_vector = "
+            "setweight(to_tsvector('english', COALESCE(e.title, '')), 'A') || "
+            "setweight(to_tsvector('english', COALESCE(e.description, '')), 'B') || "
+            f"setweight(to_tsvector('english', {ITEM_NAMES}), 'C')"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE expenses_expense_fts USING fts5(title, description, items)"
+        )
+        schema_editor.execute(
+            "INSERT INTO expenses_expense_fts (rowid, title, description, items) "
+            "SELECT e.id, e.title, COALESCE(e.description, ''), "
+            + ITEM_NAMES.replace('string_agg', 'group_concat') +
+            " FROM expenses_expense e"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS expense_search_vector_idx")
+    elif vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS expenses_expense_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0007_monthly_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models import Sum, F, Q
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
+from django.db.models import Sum, Q
 from decimal import Decimal
 
 class Friend(models.Model):
@@ -19,49 +21,15 @@ class Friend(models.Model):
     
     def get_total_due_to_user(self):
         """Calculate the total amount due to the user"""
-        return ExpenseShare.objects.filter(
-            expense__created_by=self.user,
-            paid_by=False,
-            settled=False
-        ).exclude(
-            participant=self.user
+        return BalanceLedger.objects.filter(
+            creditor=self.user
         ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
     
     def get_total_user_owes(self):
         """Calculate the total amount the user owes to others"""
-        return ExpenseShare.objects.filter(
-            participant=self.user,
-            paid_by=False, 
-            settled=False
-        ).exclude(
-            expense__created_by=self.user
+        return BalanceLedger.objects.filter(
+            debtor=self.user
         ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-    
-    def get_friends_owing_user(self):
-        """Get a list of friends who owe money to the user"""
-        return ExpenseShare.objects.filter(
-            expense__created_by=self.user,
-            paid_by=False,
-            settled=False
-        ).exclude(
-            participant=self.user
-        ).values('participant').annotate(
-            total=Sum('amount'),
-            username=F('participant__username')
-        )
-    
-    def get_user_owing_friends(self):
-        """Get a list of friends to whom the user owes money"""
-        return ExpenseShare.objects.filter(
-            participant=self.user,
-            paid_by=False, 
-            settled=False
-        ).exclude(
-            expense__created_by=self.user
-        ).values('expense__created_by').annotate(
-            total=Sum('amount'),
-            username=F('expense__created_by__username')
-        )
 
 class Expense(models.Model):
     title = models.CharField(max_length=100)
@@ -71,6 +39,14 @@ class Expense(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expenses')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by expenses.search on PostgreSQL; its GIN index is created
+    # in a migration because SQLite cannot build one
+    search_vector = SearchVectorField(null=True, editable=False)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_by', 'created_at'], name='expense_creator_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.total_amount}"
@@ -86,15 +62,43 @@ class ExpenseItem(models.Model):
         return f"{self.name} - {self.amount}"
 
 class ExpenseShare(models.Model):
+    """What one participant owes the expense's creator for an expense.
+
+    There is one row per (expense, debtor); the payer is always
+    `expense.created_by` and has no row of their own. Payments raise
+    `settled_amount` until it reaches `amount`, which marks the share
+    settled.
+    """
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='shares')
     participant = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expense_shares')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    paid_by = models.BooleanField(default=False) 
+    settled_amount = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
     settled = models.BooleanField(default=False)
     
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['expense', 'participant'], name='unique_expense_debtor'),
+        ]
+        indexes = [
+            # Open debts, looked up from the debtor's side and the expense's side
+            models.Index(
+                fields=['participant', 'expense'],
+                condition=Q(settled=False),
+                name='share_open_participant_idx'
+            ),
+            models.Index(
+                fields=['expense', 'participant'],
+                condition=Q(settled=False),
+                name='share_open_expense_idx'
+            ),
+        ]
+    
+    @property
+    def outstanding(self):
+        return self.amount - self.settled_amount
+    
     def __str__(self):
-        action = "paid" if self.paid_by else "owes"
-        return f"{self.participant.username} {action} {self.amount} for {self.expense.title}"
+        return f"{self.participant.username} owes {self.outstanding} for {self.expense.title}"
 
 class Payment(models.Model):
     from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payments_made')
@@ -103,5 +107,179 @@ class Payment(models.Model):
     notes = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['from_user', 'to_user', 'created_at'], name='payment_pair_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.from_user.username} paid {self.amount} to {self.to_user.username}"
+
+class BalanceLedger(models.Model):
+    """Running total of unsettled shares owed by `debtor` to `creditor`.
+
+    Kept in step with ExpenseShare writes by `expenses.ledger`, so balance
+    reads never have to aggregate the share table.
+    """
+    debtor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='debts')
+    creditor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='credits')
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['debtor', 'creditor'], name='unique_ledger_pair'),
+        ]
+
+    def __str__(self):
+        return f"{self.debtor.username} owes {self.amount} to {self.creditor.username}"
+
+class Friendship(models.Model):
+    """Directed edge: `friend` shares at least one expense with `user`.
+
+    Stored in both directions so a user's friends are one indexed scan.
+    Maintained by `expenses.graph` as shares are created, moved and deleted.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friendships')
+    friend = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'friend'], name='unique_friendship'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.friend.username}"
+
+class ExpenseParticipant(models.Model):
+    """One row per user involved in an expense, including its creator.
+
+    `creator` is copied from the expense so pairwise lookups ("expenses
+    between A and B") stay on this table's (user, creator) index.
+    """
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='participant_rows')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['expense', 'user'], name='unique_expense_participant'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'creator'], name='participant_user_creator_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} in {self.expense.title}"
+
+class MonthlyRollup(models.Model):
+    """Monthly totals for `user`, against one `counterparty` or overall.
+
+    `paid` is what the user put up on expenses the counterparty owes them
+    for, `owed` what the user owes the counterparty for their expenses,
+    and `settled`/`received` the payments sent to and received from them.
+    Rows with no counterparty hold the user's totals across everyone, except
+    that their `paid` is the full total of the expenses the user created,
+    their own part included, so it tracks what the user spent.
+    Kept in step with expense, share and payment writes by `expenses.rollups`.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_rollups')
+    counterparty = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    month = models.DateField()
+    paid = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    owed = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    settled = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    received = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'counterparty', 'month'],
+                condition=Q(counterparty__isnull=False),
+                name='unique_rollup_pair_month'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'month'],
+                condition=Q(counterparty__isnull=True),
+                name='unique_rollup_user_month'
+            ),
+        ]
+
+    def __str__(self):
+        who = self.counterparty.username if self.counterparty_id else 'everyone'
+        return f"{self.user.username} / {who} / {self.month:%Y-%m}"
+
+class Job(models.Model):
+    """A unit of background work, run by `manage.py run_worker`.
+
+    Workers claim queued jobs whose `run_after` has passed. Failed jobs are
+    queued again with a later `run_after` until `max_attempts` is used up.
+    Handlers are registered by kind in `expenses.jobs`.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # What workers poll: due jobs in queue order
+            models.Index(
+                fields=['run_after', 'id'],
+                condition=Q(status='queued'),
+                name='job_queued_due_idx'
+            ),
+            models.Index(fields=['created_by', '-created_at'], name='job_creator_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """The first successful response to a POST sent with an Idempotency-Key.
+
+    Retries with the same key replay `response` instead of running the
+    create again. The row is written in the same transaction as whatever
+    the request created, so it exists exactly when those writes do.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    # Hash of the method, path and body, so a key reused for a different request is rejected
+    request_hash = models.CharField(max_length=64)
+    # Filled in before the transaction commits, so other requests never see them empty
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.from_user.username} paid {self.amount} to {self.to_user.username}"
\ No newline at end of file
+        return f"{self.user_id}:{self.key}"
@@ -0,0 +1,177 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework.response import Response
+from .cache_backends import is_shared
+
+
+class ResponseCache:
+    """Per-user response cache invalidated by a per-user data version.
+
+    Every write that changes what a user sees bumps that user's version, and
+    cached responses are keyed by the version, so a stale entry can never
+    be served. A version is the time of the user's last change in
+    milliseconds, kept strictly increasing. That lets it double as a
+    Last-Modified date, and a version that was evicted and re-created
+    cannot collide with old keys.
+
+    Versions live in the configured Django cache, which must be shared by
+    every worker, for example Redis or memcached. With a per-process backend
+    a write would only bump versions in the worker that handled it, and the
+    others would keep serving stale responses, so the cache is disabled
+    unless `allow_local` says the deployment runs a single process.
+    """
+
+    def __init__(self, alias='default', timeout=86400, allow_local=False):
+        self.alias = alias
+        self.timeout = timeout
+        self.allow_local = allow_local
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def enabled(self):
+        return self.allow_local or is_shared(self.cache)
+
+    def _version_key(self, user_id):
+        return f'data-version:{user_id}'
+
+    def version(self, user_id):
+        key = self._version_key(user_id)
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, int(time.time() * 1000), None)
+            version = self.cache.get(key)
+        return version
+
+    def bump(self, user_ids):
+        if not self.enabled:
+            return
+        now = int(time.time() * 1000)
+        for user_id in set(user_ids):
+            key = self._version_key(user_id)
+            current = self.cache.get(key) or 0
+            self.cache.set(key, max(current + 1, now), None)
+
+    def response_key(self, name, request):
+        path = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+        version = self.version(request.user.pk)
+        return f'response:{name}:{request.user.pk}:{version}:{path}'
+
+    def validators(self, name, request):
+        """(etag, last_modified) for a collection as seen by request.user"""
+        version = self.version(request.user.pk)
+        etag = hashlib.md5(
+            f'{name}:{request.user.pk}:{version}:{request.get_full_path()}'.encode('utf-8')
+        ).hexdigest()
+        return quote_etag(etag), version // 1000
+
+    def get(self, key):
+        data = self.cache.get(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def set(self, key, data):
+        self.cache.set(key, data, self.timeout)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _build_cache():
+    options = getattr(settings, 'RESPONSE_CACHE', {})
+    return ResponseCache(
+        alias=options.get('CACHE_ALIAS', 'default'),
+        timeout=options.get('TIMEOUT', 86400),
+        allow_local=options.get('ALLOW_LOCAL', False),
+    )
+
+
+response_cache = _build_cache()
+
+
+def cached_per_user(name):
+    """Cache a view method's successful responses per user and data version"""
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if not response_cache.enabled:
+                return view_method(self, request, *args, **kwargs)
+            key = response_cache.response_key(name, request)
+            data = response_cache.get(key)
+            if data is not None:
+                return Response(data)
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                response_cache.set(key, response.data)
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_per_user(name):
+    """Answer GETs with 304 Not Modified when the client's copy is current.
+
+    The ETag is derived from the user's data version, so it is exact and
+    costs one cache lookup; nothing is queried or serialized on a match.
+    Last-Modified has one-second resolution and is only a fallback for
+    clients that do not send If-None-Match.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if not response_cache.enabled:
+                return view_method(self, request, *args, **kwargs)
+            etag, last_modified = response_cache.validators(name, request)
+            not_modified = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if not_modified is not None:
+                return not_modified
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+                response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate_users(user_ids):
+    """Bump the data version of every user whose view of the data changed.
+
+    Bumps now and again on commit. The second bump catches responses that
+    were cached from the pre-commit state while the transaction was open.
+    """
+    user_ids = set(user_ids)
+    response_cache.bump(user_ids)
+    transaction.on_commit(lambda: response_cache.bump(user_ids))
+
+
+def expense_user_ids(expense):
+    """The creator and every participant of an expense"""
+    user_ids = set(expense.shares.values_list('participant_id', flat=True))
+    user_ids.add(expense.created_by_id)
+    return user_ids
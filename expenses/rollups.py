@@ -0,0 +1,266 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import DateField, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from .models import Expense, ExpenseShare, MonthlyRollup, Payment
+
+FIELDS = ('paid', 'owed', 'settled', 'received')
+ZERO = Decimal('0.00')
+
+
+def month_of(moment):
+    """First day of the month `moment` falls in, in the current time zone"""
+    return timezone.localtime(moment).date().replace(day=1)
+
+
+def _new_totals():
+    return dict.fromkeys(FIELDS, ZERO)
+
+
+def _add(deltas, user_id, counterparty_id, month, field, amount):
+    # Every change lands on the pair row and on the user's overall row
+    deltas[(user_id, counterparty_id, month)][field] += amount
+    deltas[(user_id, None, month)][field] += amount
+
+
+def share_deltas(shares, sign=1, expense=None):
+    """Rollup changes from adding (sign=1) or removing (sign=-1) shares.
+
+    Pass `expense` when all shares belong to it, to avoid loading it per
+    share. Shares the creator owes themselves are ignored. `paid` only goes
+    on the pair row; the overall row's comes from `expense_deltas`.
+    """
+    deltas = defaultdict(_new_totals)
+    for share in shares:
+        share_expense = expense or share.expense
+        creditor_id = share_expense.created_by_id
+        if share.participant_id == creditor_id:
+            continue
+        month = month_of(share_expense.created_at)
+        amount = sign * Decimal(share.amount)
+        deltas[(creditor_id, share.participant_id, month)]['paid'] += amount
+        _add(deltas, share.participant_id, creditor_id, month, 'owed', amount)
+    return deltas
+
+
+def expense_deltas(expenses, sign=1):
+    """Overall `paid` changes from adding (sign=1) or removing (sign=-1) expenses.
+
+    The creator paid the whole total, their own part included.
+    """
+    deltas = defaultdict(_new_totals)
+    for expense in expenses:
+        month = month_of(expense.created_at)
+        deltas[(expense.created_by_id, None, month)]['paid'] += sign * Decimal(expense.total_amount)
+    return deltas
+
+
+def payment_deltas(payments, sign=1):
+    """Rollup changes from adding (sign=1) or removing (sign=-1) payments"""
+    deltas = defaultdict(_new_totals)
+    for payment in payments:
+        month = month_of(payment.created_at)
+        amount = sign * Decimal(payment.amount)
+        _add(deltas, payment.from_user_id, payment.to_user_id, month, 'settled', amount)
+        _add(deltas, payment.to_user_id, payment.from_user_id, month, 'received', amount)
+    return deltas
+
+
+def merge(*all_deltas):
+    merged = defaultdict(_new_totals)
+    for deltas in all_deltas:
+        for key, totals in deltas.items():
+            for field, amount in totals.items():
+                merged[key][field] += amount
+    return merged
+
+
+def _row_filter(user_id, counterparty_id, month):
+    if counterparty_id is None:
+        return {'user_id': user_id, 'counterparty__isnull': True, 'month': month}
+    return {'user_id': user_id, 'counterparty_id': counterparty_id, 'month': month}
+
+
+def _apply_one(key, changes):
+    """Increment one row, creating it if needed"""
+    rows = MonthlyRollup.objects.filter(**_row_filter(*key))
+    update = {field: F(field) + amount for field, amount in changes.items()}
+    if rows.update(**update):
+        return
+    user_id, counterparty_id, month = key
+    try:
+        with transaction.atomic():
+            MonthlyRollup.objects.create(
+                user_id=user_id,
+                counterparty_id=counterparty_id,
+                month=month,
+                **changes
+            )
+    except IntegrityError:
+        # Another transaction created the row first
+        rows.update(**update)
+
+
+def apply_deltas(deltas):
+    """Add each delta to its (user_id, counterparty_id, month) rollup row.
+
+    Existing rows are locked and read in one query, then written back with
+    one bulk update, and missing rows are bulk inserted. If a concurrent
+    writer inserts one of those rows first, the new rows fall back to
+    per-row increments. Must run inside the transaction that made the
+    change.
+    """
+    changes = {}
+    for key, totals in deltas.items():
+        nonzero = {field: amount for field, amount in totals.items() if amount}
+        if nonzero:
+            changes[key] = nonzero
+    if not changes:
+        return
+
+    existing = {
+        (row.user_id, row.counterparty_id, row.month): row
+        for row in MonthlyRollup.objects.select_for_update().filter(
+            user_id__in={key[0] for key in changes},
+            month__in={key[2] for key in changes}
+        ).order_by('id')
+    }
+    updated = []
+    created = []
+    for key, fields in changes.items():
+        row = existing.get(key)
+        if row is None:
+            user_id, counterparty_id, month = key
+            created.append(MonthlyRollup(
+                user_id=user_id, counterparty_id=counterparty_id, month=month, **fields
+            ))
+            continue
+        for field, amount in fields.items():
+            setattr(row, field, getattr(row, field) + amount)
+        updated.append(row)
+
+    if updated:
+        MonthlyRollup.objects.bulk_update(updated, FIELDS, batch_size=500)
+    if created:
+        try:
+            with transaction.atomic():
+                MonthlyRollup.objects.bulk_create(created, batch_size=500)
+        except IntegrityError:
+            for row in created:
+                _apply_one(
+                    (row.user_id, row.counterparty_id, row.month),
+                    {field: getattr(row, field) for field in FIELDS if getattr(row, field)}
+                )
+
+
+def record_expenses(expenses, shares):
+    """Add new expenses and their shares"""
+    apply_deltas(merge(expense_deltas(expenses, 1), share_deltas(shares, 1)))
+
+
+def remove_expense(expense, shares):
+    """Take out a deleted expense and all of its shares"""
+    apply_deltas(merge(expense_deltas([expense], -1), share_deltas(shares, -1, expense)))
+
+
+def replace_expense(old_expense, new_expense):
+    apply_deltas(merge(expense_deltas([old_expense], -1), expense_deltas([new_expense], 1)))
+
+
+def record_shares(shares, expense=None):
+    apply_deltas(share_deltas(shares, 1, expense))
+
+
+def remove_shares(shares, expense=None):
+    apply_deltas(share_deltas(shares, -1, expense))
+
+
+def replace_share(old_share, new_share):
+    apply_deltas(merge(share_deltas([old_share], -1), share_deltas([new_share], 1)))
+
+
+def record_payments(payments):
+    apply_deltas(payment_deltas(payments, 1))
+
+
+def remove_payments(payments):
+    apply_deltas(payment_deltas(payments, -1))
+
+
+def replace_payment(old_payment, new_payment):
+    apply_deltas(merge(payment_deltas([old_payment], -1), payment_deltas([new_payment], 1)))
+
+
+def expected_rollups():
+    """Aggregate expenses, shares and payments into {(user_id, counterparty_id, month): totals}"""
+    deltas = defaultdict(_new_totals)
+    expenses = Expense.objects.annotate(
+        month=TruncMonth('created_at', output_field=DateField())
+    ).values('created_by', 'month').annotate(total=Sum('total_amount'))
+    for row in expenses:
+        deltas[(row['created_by'], None, row['month'])]['paid'] += row['total']
+
+    month = TruncMonth('expense__created_at', output_field=DateField())
+    shares = ExpenseShare.objects.exclude(
+        participant=F('expense__created_by')
+    ).annotate(month=month).values(
+        'participant', 'expense__created_by', 'month'
+    ).annotate(total=Sum('amount'))
+    for row in shares:
+        deltas[(row['expense__created_by'], row['participant'], row['month'])]['paid'] += row['total']
+        _add(deltas, row['participant'], row['expense__created_by'], row['month'], 'owed', row['total'])
+
+    payments = Payment.objects.annotate(
+        month=TruncMonth('created_at', output_field=DateField())
+    ).values('from_user', 'to_user', 'month').annotate(total=Sum('amount'))
+    for row in payments:
+        _add(deltas, row['from_user'], row['to_user'], row['month'], 'settled', row['total'])
+        _add(deltas, row['to_user'], row['from_user'], row['month'], 'received', row['total'])
+    return deltas
+
+
+def find_drift():
+    """Compare the rollup table with the expenses, shares and payments.
+
+    Returns a list of (user_id, counterparty_id, month, field, rollup_amount,
+    expected_amount) for every value that differs.
+    """
+    expected = expected_rollups()
+    actual = {
+        (row.user_id, row.counterparty_id, row.month): {field: getattr(row, field) for field in FIELDS}
+        for row in MonthlyRollup.objects.all()
+    }
+    drift = []
+    for key in set(expected) | set(actual):
+        have = actual.get(key, _new_totals())
+        want = expected.get(key, _new_totals())
+        for field in FIELDS:
+            if have[field] != want[field]:
+                drift.append((*key, field, have[field], want[field]))
+    return drift
+
+
+@transaction.atomic
+def rebuild():
+    """Replace the rollup table with totals aggregated from expenses, shares and payments"""
+    MonthlyRollup.objects.all().delete()
+    MonthlyRollup.objects.bulk_create([
+        MonthlyRollup(user_id=user_id, counterparty_id=counterparty_id, month=month, **totals)
+        for (user_id, counterparty_id, month), totals in expected_rollups().items()
+    ], batch_size=5000)
+
+
+def monthly(user, counterparty_id=None, start=None, end=None):
+    """The user's rollup rows between `start` and `end` months, oldest first"""
+    rows = MonthlyRollup.objects.filter(user=user)
+    if counterparty_id is None:
+        rows = rows.filter(counterparty__isnull=True)
+    else:
+        rows = rows.filter(counterparty_id=counterparty_id)
+    if start is not None:
+        rows = rows.filter(month__gte=start)
+    if end is not None:
+        rows = rows.filter(month__lte=end)
+    return rows.order_by('month').values('month', *FIELDS)
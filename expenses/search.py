@@ -0,0 +1,131 @@
+"""Full-text search over expense titles, descriptions and item names.
+
+PostgreSQL keeps a weighted tsvector in `Expense.search_vector` behind a
+GIN index. SQLite, used for local and test runs, keeps an FTS5 table keyed
+by expense id instead. Both are refreshed from the write paths that change
+an expense or its items, the same way the ledger is. Other databases have
+nothing to index and fall back to case-insensitive substring matches.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections
+from django.db.models import Case, Exists, F, FloatField, OuterRef, Q, Subquery, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from .models import Expense, ExpenseItem
+
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'expenses_expense_fts'
+# Relative weights of title, description and item names, on SQLite and in
+# the substring fallback
+SQLITE_WEIGHTS = (10.0, 5.0, 1.0)
+
+
+def _vendor(using='default'):
+    return connections[using].vendor
+
+
+def _postgres_document():
+    # Imported here: the postgres aggregates need psycopg installed
+    from django.contrib.postgres.aggregates import StringAgg
+    item_names = Subquery(
+        ExpenseItem.objects.filter(expense=OuterRef('pk')).order_by().values(
+            'expense'
+        ).annotate(names=StringAgg('name', ' ')).values('names')
+    )
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG) +
+        SearchVector('description', weight='B', config=SEARCH_CONFIG) +
+        SearchVector(Coalesce(item_names, Value('')), weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def index_expenses(expense_ids, using='default'):
+    """Refresh the search entries of the given expenses"""
+    expense_ids = list(expense_ids)
+    if not expense_ids:
+        return
+    vendor = _vendor(using)
+    if vendor == 'postgresql':
+        Expense.objects.using(using).filter(id__in=expense_ids).update(
+            search_vector=_postgres_document()
+        )
+    elif vendor == 'sqlite':
+        placeholders = ', '.join(['%s'] * len(expense_ids))
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", expense_ids
+            )
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, description, items) "
+                f"SELECT e.id, e.title, COALESCE(e.description, ''), "
+                f"COALESCE((SELECT group_concat(i.name, ' ') FROM expenses_expenseitem i "
+                f"WHERE i.expense_id = e.id), '') "
+                f"FROM expenses_expense e WHERE e.id IN ({placeholders})",
+                expense_ids
+            )
+
+
+def remove_expenses(expense_ids, using='default'):
+    """Drop search entries of deleted expenses.
+
+    Only needed on SQLite; the PostgreSQL vector is deleted with its row.
+    """
+    expense_ids = list(expense_ids)
+    if expense_ids and _vendor(using) == 'sqlite':
+        placeholders = ', '.join(['%s'] * len(expense_ids))
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", expense_ids
+            )
+
+
+def _fts5_query(text):
+    # Quote every term so user input cannot be read as FTS5 syntax;
+    # the terms are ANDed together
+    return ' '.join('"%s"' % term.replace('"', '""') for term in text.split())
+
+
+def _substring_search(queryset, text):
+    """Every term in the title, description or an item name, ignoring case.
+
+    Ranked by where each term was found. Scans the table, so it only suits
+    databases without full-text search.
+    """
+    title_weight, description_weight, items_weight = SQLITE_WEIGHTS
+    rank = Value(0.0)
+    for term in text.split():
+        in_items = Exists(ExpenseItem.objects.filter(expense=OuterRef('pk'), name__icontains=term))
+        queryset = queryset.filter(
+            Q(title__icontains=term) | Q(description__icontains=term) | in_items
+        )
+        rank = rank + Case(
+            When(title__icontains=term, then=Value(title_weight)),
+            When(description__icontains=term, then=Value(description_weight)),
+            default=Value(items_weight),
+            output_field=FloatField()
+        )
+    return queryset.annotate(search_rank=rank)
+
+
+def search(queryset, text):
+    """Filter expenses to those matching `text`, annotated with `search_rank`.
+
+    A higher rank is a better match on every backend.
+    """
+    vendor = _vendor(queryset.db)
+    if vendor == 'postgresql':
+        query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        )
+    if vendor == 'sqlite':
+        # bm25() is lower for better matches, so negate it
+        weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+        rank = RawSQL(
+            f"SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = {Expense._meta.db_table}.id",
+            [_fts5_query(text)],
+            output_field=FloatField()
+        )
+        return queryset.annotate(search_rank=rank).filter(search_rank__isnull=False)
+    return _substring_search(queryset, text)
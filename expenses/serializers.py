@@ -1,6 +1,10 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from django.contrib.auth.models import User
-from .models import Friend, Expense, ExpenseItem, ExpenseShare, Payment
+from django.db import transaction
+from .models import Expense, ExpenseItem, ExpenseShare, Payment, Job
+from . import graph, ledger, rollups, search, settlement, splits
+from .response_cache import invalidate_users
 from decimal import Decimal
 
 import logging
@@ -11,15 +15,13 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
 
-class FriendSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
-    total_balance = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
-    total_due_to_user = serializers.DecimalField(max_digits=10, decimal_places=2, source='get_total_due_to_user', read_only=True)
-    total_user_owes = serializers.DecimalField(max_digits=10, decimal_places=2, source='get_total_user_owes', read_only=True)
-    
-    class Meta:
-        model = Friend
-        fields = ['id', 'user', 'total_balance', 'total_due_to_user', 'total_user_owes', 'created_at', 'updated_at']
+class FriendBalanceSerializer(serializers.Serializer):
+    """A friend (User annotated by ledger.annotate_balances) with pairwise totals"""
+    id = serializers.IntegerField(read_only=True)
+    user = UserSerializer(source='*', read_only=True)
+    total_balance = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    total_due_to_user = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    total_user_owes = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
 
 class ExpenseItemSerializer(serializers.ModelSerializer):
     assigned_to = UserSerializer(read_only=True)
@@ -41,164 +43,262 @@ class ExpenseItemSerializer(serializers.ModelSerializer):
 class ExpenseShareSerializer(serializers.ModelSerializer):
     participant = UserSerializer(read_only=True)
     participant_id = serializers.IntegerField(write_only=True)
+    # Shares are stored for debtors only; the payer's side is implied
+    paid_by = serializers.SerializerMethodField()
     
     class Meta:
         model = ExpenseShare
-        fields = ['id', 'participant', 'participant_id', 'amount', 'paid_by', 'settled']
+        fields = ['id', 'participant', 'participant_id', 'amount', 'paid_by', 'settled', 'settled_amount']
+        read_only_fields = ['settled_amount']
+    
+    def get_paid_by(self, obj):
+        return False
+
+class ParticipantsField(serializers.ManyRelatedField):
+    """A list of user ids, looked up with one query instead of one per id"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        ids = []
+        for pk in data:
+            try:
+                if isinstance(pk, bool):
+                    raise TypeError
+                ids.append(int(pk))
+            except (TypeError, ValueError):
+                child.fail('incorrect_type', data_type=type(pk).__name__)
+        # A user listed twice is still one participant
+        ids = list(dict.fromkeys(ids))
+        users = child.get_queryset().in_bulk(ids)
+        for pk in ids:
+            if pk not in users:
+                child.fail('does_not_exist', pk_value=pk)
+        return [users[pk] for pk in ids]
+
+class ExpenseListSerializer(serializers.ListSerializer):
+    """Creates a batch of expenses with set-based inserts"""
+
+    def create(self, validated_data):
+        return write_expenses(validated_data, self.context['request'].user)
 
 class ExpenseSerializer(serializers.ModelSerializer):
     created_by = UserSerializer(read_only=True)
     items = ExpenseItemSerializer(many=True)
     shares = ExpenseShareSerializer(many=True, read_only=True)
-    participants = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all(),
-        many=True,
+    participants = ParticipantsField(
+        child_relation=serializers.PrimaryKeyRelatedField(queryset=User.objects.all()),
+        write_only=True
+    )
+    # How shared items are divided; split_values maps user id -> percentage,
+    # weight or exact amount depending on split_type
+    split_type = serializers.ChoiceField(choices=splits.SPLIT_TYPES, default=splits.EQUAL, write_only=True)
+    split_values = serializers.DictField(
+        child=serializers.DecimalField(max_digits=12, decimal_places=4),
+        required=False,
         write_only=True
     )
+    tax_split = serializers.ChoiceField(choices=splits.TAX_SPLITS, default=splits.TAX_EQUAL, write_only=True)
     
     class Meta:
         model = Expense
-        fields = ['id', 'title', 'description', 'total_amount', 'tax_amount', 'created_by', 'items', 'shares', 'participants', 'created_at', 'updated_at']
+        fields = ['id', 'title', 'description', 'total_amount', 'tax_amount', 'created_by', 'items', 'shares', 'participants', 'split_type', 'split_values', 'tax_split', 'created_at', 'updated_at']
+        list_serializer_class = ExpenseListSerializer
+    
+    def validate_split_values(self, value):
+        try:
+            return {int(user_id): amount for user_id, amount in value.items()}
+        except ValueError:
+            raise serializers.ValidationError("Keys must be user ids.")
+    
+    def validate(self, data):
+        if 'items' in data and 'participants' in data:
+            participant_ids = [p.id for p in data['participants']]
+            request = self.context.get('request')
+            if request is not None and request.user.id not in participant_ids:
+                participant_ids.append(request.user.id)
+            for item in data['items']:
+                if not item.get('is_shared', True) and item.get('assigned_to_id') not in participant_ids:
+                    raise serializers.ValidationError({
+                        "items": "Non-shared items must be assigned to a participant."
+                    })
+            # Dry run so bad split values fail validation instead of the write
+            try:
+                self._split(data['items'], participant_ids, data)
+            except splits.SplitError as e:
+                raise serializers.ValidationError({"split_values": str(e)})
+        return data
     
     def create(self, validated_data):
         logger.debug("Expense create validated_data: %s", validated_data)
-        items_data = validated_data.pop('items')
-        participants = validated_data.pop('participants')
-        
-        # Create the expense with the tax_amount included
-        request_user = self.context['request'].user
-        # Only add request_user if not already in participants
-        if request_user.id not in [p.id for p in participants]:
-            participants.append(request_user)
-        expense = Expense.objects.create(**validated_data)
+        return write_expenses([validated_data], self.context['request'].user)[0]
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Follow each debtor share with the payer's mirrored entry, which is
+        # no longer stored but is still part of the response shape
+        payer = UserSerializer(instance.created_by).data
+        shares = []
+        for share in data['shares']:
+            shares.append(share)
+            shares.append(dict(share, id=None, participant=payer, paid_by=True))
+        data['shares'] = shares
+        return data
+    
+    @staticmethod
+    def _split(items, participant_ids, options):
+        """Cents owed per participant id, from item dicts or ExpenseItems"""
+        return splits.split_expense(
+            (
+                (item['amount'], item.get('is_shared', True), item.get('assigned_to_id'))
+                if isinstance(item, dict) else
+                (item.amount, item.is_shared, item.assigned_to_id)
+                for item in items
+            ),
+            participant_ids,
+            tax_amount=options.get('tax_amount'),
+            split_type=options.get('split_type', splits.EQUAL),
+            split_values=options.get('split_values'),
+            tax_split=options.get('tax_split', splits.TAX_EQUAL),
+        )
+    
+    @staticmethod
+    def _calculate_shares(expense, items, participants, options):
+        """Build the (unsaved) ExpenseShare rows for an expense"""
+        payer = expense.created_by
         
-        # Create expense items
-        total_items_amount = Decimal('0.00')
-        for item_data in items_data:
-            try:
-                item = ExpenseItem.objects.create(expense=expense, **item_data)
-                total_items_amount += item.amount
-            except Exception as e:
-                logger.error("Error creating ExpenseItem with data %s: %s", item_data, e)
-                raise e
+        # Cents each participant owes; always adds up to items plus tax
+        owed = ExpenseSerializer._split(
+            items,
+            [participant.id for participant in participants],
+            dict(options, tax_amount=expense.tax_amount)
+        )
         
-        # Validate total amount matches items total
+        # One share per participant who owes the payer something
+        shares = []
+        for participant in participants:
+            share_amount = splits.from_cents(owed[participant.id])
+            if share_amount > 0 and participant != payer:
+                shares.append(ExpenseShare(
+                    expense=expense,
+                    participant=participant,
+                    amount=share_amount,
+                    settled=False
+                ))
+        return shares
+
+@transaction.atomic
+def write_expenses(entries, request_user):
+    """Create expenses with their items and shares.
+
+    `entries` is a list of validated ExpenseSerializer data. Expenses, items
+    and shares are each written with a single bulk insert, and the ledger,
+    graph and rollups are updated in bulk, so the number of queries does not
+    grow with items or participants.
+    """
+    expenses = []
+    items_data = []
+    participants = []
+    split_options = []
+    for data in entries:
+        data = dict(data)
+        items_data.append(data.pop('items'))
+        split_options.append({
+            'split_type': data.pop('split_type', splits.EQUAL),
+            'split_values': data.pop('split_values', None),
+            'tax_split': data.pop('tax_split', splits.TAX_EQUAL),
+        })
+        expense_participants = list(data.pop('participants'))
+        # Only add request_user if not already in participants
+        if request_user.id not in [p.id for p in expense_participants]:
+            expense_participants.append(request_user)
+        participants.append(expense_participants)
+        expenses.append(Expense(**data))
+    Expense.objects.bulk_create(expenses)
+    
+    # Create expense items
+    items = [
+        [ExpenseItem(expense=expense, **item_data) for item_data in expense_items]
+        for expense, expense_items in zip(expenses, items_data)
+    ]
+    ExpenseItem.objects.bulk_create([item for expense_items in items for item in expense_items])
+    
+    # Validate total amount matches items total
+    for expense, expense_items in zip(expenses, items):
+        total_items_amount = sum((item.amount for item in expense_items), Decimal('0.00'))
         if expense.total_amount != total_items_amount:
             logger.warning(
                 "Total amount (%s) doesn't match sum of items (%s)",
                 expense.total_amount,
                 total_items_amount
             )
-        
-        # Calculate shares
-        self._calculate_shares(expense, participants)
-        
-        return expense
     
-    def _calculate_shares(self, expense, participants):
-        # Get all items for this expense
-        items = expense.items.all()
-        payer = expense.created_by
-        
-        # Dictionary to accumulate each participant's share
-        participant_shares = {user.id: Decimal('0.00') for user in participants}
-        
-        # Process each expense item
-        for item in items:
-            if item.is_shared:
-                # Split equally among all participants
-                share_amount = item.amount / len(participants)
-                for participant in participants:
-                    participant_shares[participant.id] += share_amount
-            elif item.assigned_to:
-                # Non-shared: assign full amount to assigned person
-                participant_shares[item.assigned_to.id] += item.amount
-        
-        # Add tax equally among participants (if tax_amount is provided)
-        if expense.tax_amount and expense.tax_amount > 0:
-            tax_share = expense.tax_amount / len(participants)
-            for participant in participants:
-                participant_shares[participant.id] += tax_share
-        
-        # Create ExpenseShare records based on calculated shares
-        created_shares = []
-        for participant in participants:
-            share_amount = participant_shares[participant.id]
-            if share_amount > 0:
-                # Create share for participant if they're not the payer
-                if participant != payer:
-                    share = ExpenseShare.objects.create(
-                        expense=expense,
-                        participant=participant,
-                        amount=share_amount,
-                        paid_by=False,
-                        settled=False
-                    )
-                    created_shares.append(share)
-                
-                # Create share for payer to track what others owe
-                if participant != payer:
-                    share = ExpenseShare.objects.create(
-                        expense=expense,
-                        participant=payer,
-                        amount=share_amount,
-                        paid_by=True,
-                        settled=False
-                    )
-                    created_shares.append(share)
+    # Calculate shares
+    shares = []
+    for expense, expense_items, expense_participants, options in zip(expenses, items, participants, split_options):
+        shares.extend(ExpenseSerializer._calculate_shares(expense, expense_items, expense_participants, options))
+    ExpenseShare.objects.bulk_create(shares)
+    
+    # Keep the pairwise balances, the friendship graph, the monthly rollups
+    # and the search index in step
+    ledger.record_shares(shares)
+    graph.index_expenses(expenses, shares)
+    rollups.record_expenses(expenses, shares)
+    search.index_expenses(expense.id for expense in expenses)
+    
+    # Everyone involved sees new expenses and balances
+    invalidate_users(
+        [request_user.id] +
+        [p.id for expense_participants in participants for p in expense_participants]
+    )
+    
+    return expenses
 
 class PaymentSerializer(serializers.ModelSerializer):
     from_user = UserSerializer(read_only=True)
     to_user = UserSerializer(read_only=True)
     from_user_id = serializers.IntegerField(write_only=True)
     to_user_id = serializers.IntegerField(write_only=True)
+    settlement = serializers.SerializerMethodField()
     
     class Meta:
         model = Payment
-        fields = ['id', 'from_user', 'to_user', 'from_user_id', 'to_user_id', 'amount', 'notes', 'created_at']
+        fields = ['id', 'from_user', 'to_user', 'from_user_id', 'to_user_id', 'amount', 'notes', 'created_at', 'settlement']
+    
+    def get_settlement(self, obj):
+        # Only present on the response to the create call that settled it
+        return getattr(obj, 'settlement', None)
+    
+    def validate_amount(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Amount must be greater than zero.")
+        return value
     
+    @transaction.atomic
     def create(self, validated_data):
         payment = Payment.objects.create(**validated_data)
-        
-        # Get all unsettled expense shares
-        unsettled_shares = ExpenseShare.objects.filter(
-            participant=payment.from_user,
-            expense__created_by=payment.to_user,
-            paid_by=False,
-            settled=False
-        ).order_by('expense__created_at')  # Process oldest expenses first
-        
-        remaining_amount = payment.amount
-        
-        # Settle expenses partially or fully based on payment amount
-        for share in unsettled_shares:
-            if remaining_amount <= 0:
-                break
-                
-            if remaining_amount >= share.amount:
-                # Can settle this expense fully
-                share.settled = True
-                share.save()
-                remaining_amount -= share.amount
-            else:
-                # Can only settle partially - create a new share for remaining amount
-                settled_amount = remaining_amount
-                remaining_debt = share.amount - settled_amount
-                
-                # Update original share amount
-                share.amount = remaining_debt
-                share.save()
-                
-                # Create a new share for the settled portion
-                ExpenseShare.objects.create(
-                    expense=share.expense,
-                    participant=share.participant,
-                    amount=settled_amount,
-                    paid_by=False,
-                    settled=True
-                )
-                
-                remaining_amount = 0
-                break
-        
-        return payment
\ No newline at end of file
+        payment.settlement = settlement.settle_payment(payment)
+        rollups.record_payments([payment])
+        return payment
+
+class JobSerializer(serializers.ModelSerializer):
+    error = serializers.SerializerMethodField()
+    status_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'payload', 'status', 'attempts', 'max_attempts', 'run_after', 'result', 'error', 'created_at', 'updated_at', 'status_url']
+        read_only_fields = ['status', 'attempts', 'max_attempts', 'run_after', 'result']
+    
+    def get_error(self, obj):
+        # Only the exception line; the traceback stays in the admin and logs
+        lines = obj.error.strip().splitlines()
+        return lines[-1] if lines else None
+    
+    def get_status_url(self, obj):
+        url = reverse('job-detail', args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
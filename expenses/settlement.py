@@ -0,0 +1,147 @@
+from decimal import Decimal
+from django.db import transaction
+from .models import BalanceLedger, ExpenseShare
+from . import ledger
+from .response_cache import invalidate_users
+
+
+def _open_shares(debtor_id, creditor_id):
+    """Lock and return the debtor's open shares owed to the creditor, oldest expense first"""
+    return list(
+        ExpenseShare.objects.select_for_update(of=('self',)).filter(
+            participant_id=debtor_id,
+            expense__created_by_id=creditor_id,
+            settled=False
+        ).order_by('expense__created_at', 'id')
+    )
+
+
+def _pay_shares(shares, amount):
+    """Apply `amount` to locked `shares` in order.
+
+    The fully covered prefix is marked settled, and the first share that is
+    only partly covered has its `settled_amount` raised. All writes go out
+    in one batched update. Returns (settled_shares, partial_share, applied).
+    """
+    remaining_amount = amount
+    settled_shares = []
+    partial_share = None
+    for share in shares:
+        if remaining_amount <= 0:
+            break
+        outstanding = share.outstanding
+        if remaining_amount >= outstanding:
+            # Can settle this share fully
+            share.settled = True
+            share.settled_amount = share.amount
+            settled_shares.append(share)
+            remaining_amount -= outstanding
+        else:
+            # Can only settle partially - the rest of the debt stays open
+            share.settled_amount += remaining_amount
+            partial_share = share
+            remaining_amount = Decimal('0.00')
+            break
+
+    changed = settled_shares + ([partial_share] if partial_share else [])
+    if changed:
+        ExpenseShare.objects.bulk_update(changed, ['settled', 'settled_amount'])
+    return settled_shares, partial_share, amount - remaining_amount
+
+
+def debt_chain(from_user_id, to_user_id):
+    """The shortest chain of open debts from one user to another.
+
+    Returns the user ids along it, both ends included, or None when the
+    payer's debts do not lead to the payee. Searched breadth first with one
+    ledger query per step, following larger debts first.
+    """
+    parents = {from_user_id: None}
+    frontier = [from_user_id]
+    while frontier:
+        next_frontier = []
+        debts = BalanceLedger.objects.filter(
+            debtor_id__in=frontier,
+            amount__gt=0
+        ).order_by('-amount', 'id').values_list('debtor_id', 'creditor_id')
+        for debtor_id, creditor_id in debts:
+            if creditor_id in parents:
+                continue
+            parents[creditor_id] = debtor_id
+            if creditor_id == to_user_id:
+                chain = [creditor_id]
+                while parents[chain[-1]] is not None:
+                    chain.append(parents[chain[-1]])
+                return chain[::-1]
+            next_frontier.append(creditor_id)
+        frontier = next_frontier
+    return None
+
+
+@transaction.atomic
+def settle_payment(payment):
+    """Apply a payment to the payer's open shares owed to the payee.
+
+    The open shares for the pair are locked, so two concurrent payments
+    between the same users settle one after the other instead of both
+    settling the same shares. Shares are paid oldest expense first.
+
+    Whatever is left once the payer owes the payee nothing is passed along
+    chains of debts, as suggested by `simplify`: when A pays C but owes B,
+    who owes C, the payment settles A's shares owed to B and B's shares
+    owed to C by the same amount, which leaves B's balance unchanged. Every
+    share on a chain is locked before any of it is paid.
+
+    Returns a summary of the shares touched and any amount left over.
+    """
+    shares = _open_shares(payment.from_user_id, payment.to_user_id)
+    settled_shares, partial_share, applied = _pay_shares(shares, payment.amount)
+    changed = settled_shares + ([partial_share] if partial_share else [])
+    # Whatever was applied to shares comes off the pairwise balance
+    ledger.apply_deltas({
+        (payment.from_user_id, payment.to_user_id): -applied
+    })
+    remaining_amount = payment.amount - applied
+
+    routed = []
+    affected = {payment.from_user_id, payment.to_user_id}
+    while remaining_amount > 0:
+        chain = debt_chain(payment.from_user_id, payment.to_user_id)
+        if chain is None:
+            break
+        steps = list(zip(chain, chain[1:]))
+        step_shares = [_open_shares(debtor_id, creditor_id) for debtor_id, creditor_id in steps]
+        amount = min(
+            remaining_amount,
+            *(sum((share.outstanding for share in shares), Decimal('0.00')) for shares in step_shares)
+        )
+        if amount <= 0:
+            break
+        route = {'path': chain, 'amount': amount, 'settled_share_ids': [], 'partially_settled_share_ids': []}
+        for shares in step_shares:
+            step_settled, step_partial, _ = _pay_shares(shares, amount)
+            route['settled_share_ids'].extend(share.id for share in step_settled)
+            changed.extend(step_settled)
+            if step_partial:
+                route['partially_settled_share_ids'].append(step_partial.id)
+                changed.append(step_partial)
+        ledger.apply_deltas({step: -amount for step in steps})
+        affected.update(chain)
+        routed.append(route)
+        applied += amount
+        remaining_amount -= amount
+
+    # Settled flags show up in the expense lists of everyone on those expenses
+    if changed:
+        affected.update(ExpenseShare.objects.filter(
+            expense_id__in={share.expense_id for share in changed}
+        ).values_list('participant_id', flat=True))
+    invalidate_users(affected)
+
+    return {
+        'settled_share_ids': [share.id for share in settled_shares],
+        'partially_settled_share_id': partial_share.id if partial_share else None,
+        'routed': routed,
+        'amount_applied': applied,
+        'overpayment': remaining_amount,
+    }
@@ -0,0 +1,130 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db.models import Q
+from .models import BalanceLedger
+
+ZERO = Decimal('0.00')
+
+
+def open_debts(user_ids=None):
+    """Open debts as {(debtor_id, creditor_id): amount}.
+
+    Reads the pairwise ledger, which already holds the open shares summed
+    per (debtor, creditor), in a single query. When `user_ids` is given,
+    only debts between those users are counted.
+    """
+    debts = BalanceLedger.objects.filter(amount__gt=0)
+    if user_ids is not None:
+        debts = debts.filter(debtor__in=user_ids, creditor__in=user_ids)
+    return {
+        (debtor_id, creditor_id): amount
+        for debtor_id, creditor_id, amount in debts.values_list('debtor', 'creditor', 'amount')
+    }
+
+
+def net_positions(debts):
+    """Net balance per user: positive means owed money"""
+    positions = defaultdict(lambda: ZERO)
+    for (debtor_id, creditor_id), amount in debts.items():
+        positions[creditor_id] += amount
+        positions[debtor_id] -= amount
+    return {user_id: amount for user_id, amount in positions.items() if amount}
+
+
+def minimum_transfers(debts):
+    """Reduce a debt graph to transfers that follow chains of debts.
+
+    Starting with the user who owes the most on net, walk along the largest
+    open debt at each step until reaching a user who is owed money on net.
+    The walk becomes a transfer from its first user to its last, for the
+    smallest amount on the way (capped by both users' net positions), and
+    that amount comes off every debt it passed. Debts that run in a circle
+    leave net positions unchanged and are cancelled out when a walk meets
+    one.
+
+    Every transfer therefore has a chain of debts behind it, which is what
+    `settlement.settle_payment` pays along when the payer owes the payee
+    nothing directly. Each walk clears a debt or a user's net position, so
+    there are at most E + V walks. Returns a list of
+    (from_user_id, to_user_id, amount) tuples, one per pair.
+    """
+    debts = {
+        (debtor_id, creditor_id): amount
+        for (debtor_id, creditor_id), amount in debts.items()
+        if amount > 0 and debtor_id != creditor_id
+    }
+    owes = defaultdict(dict)
+    for (debtor_id, creditor_id), amount in debts.items():
+        owes[debtor_id][creditor_id] = amount
+    positions = defaultdict(lambda: ZERO, net_positions(debts))
+
+    def pay_down(path, amount):
+        for debtor_id, creditor_id in zip(path, path[1:]):
+            left = owes[debtor_id][creditor_id] - amount
+            if left:
+                owes[debtor_id][creditor_id] = left
+            else:
+                del owes[debtor_id][creditor_id]
+
+    transfers = defaultdict(lambda: ZERO)
+    debtors = sorted(
+        (user_id for user_id, amount in positions.items() if amount < 0),
+        key=lambda user_id: (positions[user_id], user_id)
+    )
+    for start in debtors:
+        while positions[start] < 0:
+            path = [start]
+            index = {start: 0}
+            # Anyone reached who is not owed money on net owes at least
+            # as much as was owed to them, so there is always a next debt
+            while len(path) == 1 or positions[path[-1]] <= 0:
+                user_debts = owes[path[-1]]
+                creditor_id = max(user_debts, key=lambda user_id: (user_debts[user_id], -user_id))
+                if creditor_id in index:
+                    cycle = path[index[creditor_id]:] + [creditor_id]
+                    pay_down(cycle, min(owes[a][b] for a, b in zip(cycle, cycle[1:])))
+                    for user_id in path[index[creditor_id] + 1:]:
+                        del index[user_id]
+                    del path[index[creditor_id] + 1:]
+                    continue
+                index[creditor_id] = len(path)
+                path.append(creditor_id)
+
+            end = path[-1]
+            amount = min(
+                -positions[start],
+                positions[end],
+                *(owes[a][b] for a, b in zip(path, path[1:]))
+            )
+            pay_down(path, amount)
+            positions[start] += amount
+            positions[end] -= amount
+            transfers[(start, end)] += amount
+    return [(debtor, creditor, amount) for (debtor, creditor), amount in transfers.items()]
+
+
+def suggested_payments(user, user_ids=None):
+    """Reduced transfers, shaped like PaymentSerializer input.
+
+    With `user_ids` the whole group (always including `user`) is simplified
+    and every transfer is returned. Without it the graph is `user` and
+    everyone they have an open balance with, and only the transfers `user`
+    takes part in are returned.
+    """
+    scoped = user_ids is not None
+    if scoped:
+        user_ids = set(user_ids) | {user.id}
+    else:
+        direct = BalanceLedger.objects.filter(
+            Q(debtor=user) | Q(creditor=user),
+            amount__gt=0
+        ).values_list('debtor', 'creditor')
+        user_ids = {user.id}
+        for debtor_id, creditor_id in direct:
+            user_ids.update((debtor_id, creditor_id))
+    transfers = minimum_transfers(open_debts(user_ids))
+    return [
+        {'from_user_id': debtor, 'to_user_id': creditor, 'amount': amount}
+        for debtor, creditor, amount in transfers
+        if scoped or user.id in (debtor, creditor)
+    ]
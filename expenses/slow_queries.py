@@ -0,0 +1,162 @@
+"""In-process log of slow SQL, grouped by fingerprint.
+
+A fingerprint is the statement with literals, placeholders and IN/VALUES
+lists normalized away, so every call of the same ORM query lands in one
+entry however its parameters differ. Each entry keeps the count, total and
+worst time, which views ran it, and the stack of the slowest call trimmed
+to this project's frames, for example the line in `expenses/views.py` or
+`expenses/serializers.py` that built the queryset.
+
+Queries are timed by MetricsMiddleware for requests and by `watch()`
+elsewhere (the job worker). The log is per process: entries live in memory
+in the process that ran the query, are not shared with other workers and
+are lost on restart. The admin page at /admin/slow-queries/ shows only the
+web process that served it, so with several workers each page load may
+show a different one; the warnings logged for every slow query are the
+complete record.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_NORMALIZE = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'%s|\$\d+|\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+# Frames from these files only say how the query reached the database
+_SKIP_FILES = (__file__, os.path.join('expenses', 'middleware.py'))
+
+
+def _options():
+    options = getattr(settings, 'SLOW_QUERIES', {})
+    return {
+        'THRESHOLD_MS': options.get('THRESHOLD_MS', 200),
+        'MAX_FINGERPRINTS': options.get('MAX_FINGERPRINTS', 500),
+        'STACK_DEPTH': options.get('STACK_DEPTH', 8),
+    }
+
+
+def threshold():
+    """Seconds a query must take to be logged"""
+    return _options()['THRESHOLD_MS'] / 1000
+
+
+def fingerprint(sql):
+    """`sql` with every value replaced by `?` and value lists collapsed"""
+    for pattern, replacement in _NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def project_stack(depth):
+    """The innermost `depth` frames that belong to this project, outermost first"""
+    base_dir = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()[:-1]
+        if frame.filename.startswith(base_dir)
+        and 'site-packages' not in frame.filename
+        and not frame.filename.endswith(_SKIP_FILES)
+    ]
+    return [
+        f"{os.path.relpath(frame.filename, base_dir)}:{frame.lineno} in {frame.name}"
+        for frame in frames[-depth:]
+    ]
+
+
+class SlowQueryLog:
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def record(self, sql, duration, source):
+        """Add one slow execution of `sql` run on behalf of `source`"""
+        options = _options()
+        key = fingerprint(sql)
+        stack = project_stack(options['STACK_DEPTH'])
+        logger.warning(
+            "Slow query (%.1f ms) in %s at %s: %s",
+            duration * 1000, source, stack[-1] if stack else '?', key
+        )
+        now = time.time()
+        # Only slow queries get here, so the lock is rarely contended
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= options['MAX_FINGERPRINTS']:
+                    self.dropped += 1
+                    return
+                entry = self._entries[key] = {
+                    'id': hashlib.md5(key.encode('utf-8')).hexdigest()[:12],
+                    'fingerprint': key,
+                    'count': 0,
+                    'total': 0.0,
+                    'max': 0.0,
+                    'sources': {},
+                    'first_seen': now,
+                }
+            entry['count'] += 1
+            entry['total'] += duration
+            entry['last_seen'] = now
+            entry['sources'][source] = entry['sources'].get(source, 0) + 1
+            if duration >= entry['max']:
+                entry['max'] = duration
+                entry['slowest_source'] = source
+                entry['slowest_stack'] = stack
+
+    def top(self, limit=50, order='total'):
+        """Entries with the most total time (or `count` or `max`) first"""
+        with self._lock:
+            entries = [dict(entry, sources=dict(entry['sources'])) for entry in self._entries.values()]
+        for entry in entries:
+            entry['mean'] = entry['total'] / entry['count']
+        entries.sort(key=lambda entry: entry[order], reverse=True)
+        return entries[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
+            self.dropped = 0
+
+
+log = SlowQueryLog()
+
+
+class SlowQueryWrapper:
+    """execute_wrapper that records queries over the threshold for `source`"""
+
+    def __init__(self, source):
+        self.source = source
+        self.threshold = threshold()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            if duration >= self.threshold:
+                log.record(sql, duration, self.source)
+
+
+@contextmanager
+def watch(source):
+    """Log slow queries run by this thread inside the block under `source`"""
+    wrapper = SlowQueryWrapper(source)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
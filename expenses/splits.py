@@ -0,0 +1,161 @@
+"""Split expense amounts between participants in whole cents.
+
+All arithmetic is on integers. Every split uses largest-remainder
+allocation, so the parts always add up exactly to the amount being split
+and no cent is created or lost to rounding.
+"""
+import math
+from decimal import Decimal, ROUND_HALF_UP
+from fractions import Fraction
+
+EQUAL = 'equal'
+PERCENTAGE = 'percentage'
+WEIGHTS = 'weights'
+EXACT = 'exact'
+SPLIT_TYPES = (EQUAL, PERCENTAGE, WEIGHTS, EXACT)
+
+TAX_EQUAL = 'equal'
+TAX_PROPORTIONAL = 'proportional'
+TAX_SPLITS = (TAX_EQUAL, TAX_PROPORTIONAL)
+
+
+class SplitError(ValueError):
+    """Raised when split values do not describe a valid split"""
+
+
+def to_cents(amount):
+    return int(Decimal(amount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) * 100)
+
+
+def from_cents(cents):
+    return (Decimal(cents) / 100).quantize(Decimal('0.01'))
+
+
+def _fraction(value):
+    try:
+        return Fraction(str(value))
+    except (ValueError, ZeroDivisionError):
+        raise SplitError(f"Invalid split value: {value!r}")
+
+
+def _as_integers(weights):
+    """Scale Fraction weights to ints with the same ratios"""
+    if all(isinstance(weight, int) for weight in weights):
+        return weights
+    weights = [Fraction(weight) for weight in weights]
+    scale = math.lcm(*(weight.denominator for weight in weights))
+    return [int(weight * scale) for weight in weights]
+
+
+def allocate(total, weights):
+    """Split `total` cents in proportion to `weights` (largest remainder).
+
+    `total` must not be negative. `weights` is a list of non-negative ints
+    or Fractions. Returns a list of ints in the same order that sums to
+    `total`. Leftover cents go to the largest remainders, with ties going to
+    the earliest entry.
+    """
+    if total < 0:
+        raise SplitError(f"Cannot split a negative amount: {from_cents(total)}")
+    if total == 0 or not weights:
+        return [0] * len(weights)
+    weights = _as_integers(weights)
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        raise SplitError("At least one participant needs a positive share")
+
+    parts = []
+    remainders = []
+    for weight in weights:
+        part, remainder = divmod(total * weight, weight_sum)
+        parts.append(part)
+        remainders.append(remainder)
+
+    leftover = total - sum(parts)
+    if leftover:
+        ranked = sorted(range(len(weights)), key=lambda index: (-remainders[index], index))
+        for index in ranked[:leftover]:
+            parts[index] += 1
+    return parts
+
+
+def _weights(participant_ids, split_type, values):
+    """Per-participant weights for the shared pool"""
+    values = values or {}
+    unknown = set(values) - set(participant_ids)
+    if split_type != EQUAL and unknown:
+        raise SplitError(f"Split values given for non-participants: {sorted(unknown)}")
+
+    if split_type == EQUAL:
+        return [1] * len(participant_ids)
+    if split_type == PERCENTAGE:
+        percentages = [_fraction(values.get(pid, 0)) for pid in participant_ids]
+        if any(p < 0 for p in percentages):
+            raise SplitError("Percentages cannot be negative")
+        if sum(percentages) != 100:
+            raise SplitError("Percentages must add up to 100")
+        return percentages
+    if split_type == WEIGHTS:
+        weights = [_fraction(values.get(pid, 0)) for pid in participant_ids]
+        if any(w < 0 for w in weights):
+            raise SplitError("Weights cannot be negative")
+        return weights
+    raise SplitError(f"Unknown split type: {split_type}")
+
+
+def split_expense(items, participant_ids, tax_amount=0, split_type=EQUAL,
+                  split_values=None, tax_split=TAX_EQUAL):
+    """Work out what each participant owes for an expense, in cents.
+
+    `items` is an iterable of (amount, is_shared, assigned_to_id). Shared
+    items are summed into one pool in a single pass and the pool is split
+    once by `split_type`. Non-shared items go in full to their assignee.
+    For EXACT, `split_values` maps participant id -> amount and must add up
+    to the shared pool. Tax is split equally, or in proportion to each
+    participant's pre-tax total with TAX_PROPORTIONAL.
+
+    Returns {participant_id: cents}.
+    """
+    participant_ids = list(dict.fromkeys(participant_ids))
+    if not participant_ids:
+        raise SplitError("An expense needs at least one participant")
+    owed = dict.fromkeys(participant_ids, 0)
+
+    shared_pool = 0
+    for amount, is_shared, assigned_to_id in items:
+        cents = to_cents(amount)
+        if is_shared:
+            shared_pool += cents
+        elif assigned_to_id in owed:
+            owed[assigned_to_id] += cents
+        else:
+            raise SplitError(f"Item assigned to non-participant {assigned_to_id}")
+
+    if split_type == EXACT:
+        split_values = split_values or {}
+        unknown = set(split_values) - set(participant_ids)
+        if unknown:
+            raise SplitError(f"Split values given for non-participants: {sorted(unknown)}")
+        exact = [to_cents(split_values.get(pid, 0)) for pid in participant_ids]
+        if any(cents < 0 for cents in exact):
+            raise SplitError("Exact amounts cannot be negative")
+        if sum(exact) != shared_pool:
+            raise SplitError(
+                f"Exact amounts add up to {from_cents(sum(exact))}, "
+                f"shared items to {from_cents(shared_pool)}"
+            )
+        pool_parts = exact
+    else:
+        pool_parts = allocate(shared_pool, _weights(participant_ids, split_type, split_values))
+    for pid, cents in zip(participant_ids, pool_parts):
+        owed[pid] += cents
+
+    tax = to_cents(tax_amount or 0)
+    if tax > 0:
+        if tax_split == TAX_PROPORTIONAL and any(owed.values()):
+            tax_weights = [owed[pid] for pid in participant_ids]
+        else:
+            tax_weights = [1] * len(participant_ids)
+        for pid, cents in zip(participant_ids, allocate(tax, tax_weights)):
+            owed[pid] += cents
+    return owed
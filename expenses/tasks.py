@@ -0,0 +1,91 @@
+"""Background job handlers. Imported from AppConfig.ready() to register them."""
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+from django.core.files import File
+from django.core.files.storage import default_storage
+from . import exports, graph, idempotency, ledger, rollups
+from .jobs import PermanentError, handler
+from .serializers import ExpenseSerializer
+
+EXPORTS = {
+    'expenses': (exports.expense_rows, exports.EXPENSE_FIELDS),
+    'expense-shares': (exports.share_rows, exports.SHARE_FIELDS),
+    'payments': (exports.payment_rows, exports.PAYMENT_FIELDS),
+}
+EXPORT_STREAMS = {
+    'csv': exports.stream_csv,
+    'ndjson': exports.stream_ndjson,
+}
+
+# Kinds any user may enqueue for themselves; the rest are staff only
+USER_KINDS = {'export', 'import_expenses'}
+
+
+@handler('export')
+def export(job):
+    """Write one of the user's datasets to storage as CSV or NDJSON"""
+    dataset = job.payload.get('dataset', 'expenses')
+    export_format = job.payload.get('format', 'csv')
+    if dataset not in EXPORTS or export_format not in EXPORT_STREAMS:
+        raise PermanentError(f"Cannot export {dataset!r} as {export_format!r}")
+    rows, fields = EXPORTS[dataset]
+    stream = EXPORT_STREAMS[export_format](rows(job.created_by), fields)
+
+    with tempfile.NamedTemporaryFile('w+', encoding='utf-8', suffix=f'.{export_format}', delete=False) as tmp:
+        lines = 0
+        for line in stream:
+            tmp.write(line)
+            lines += 1
+    try:
+        with open(tmp.name, 'rb') as source:
+            name = default_storage.save(
+                f'exports/{job.created_by_id}/{dataset}-{job.pk}.{export_format}', File(source)
+            )
+    finally:
+        os.unlink(tmp.name)
+    # The CSV header is a line too
+    return {
+        'dataset': dataset,
+        'format': export_format,
+        'file': name,
+        'rows': lines - 1 if export_format == 'csv' else lines,
+    }
+
+
+@handler('import_expenses')
+def import_expenses(job):
+    """Validate and create a list of expense payloads, all or nothing"""
+    serializer = ExpenseSerializer(
+        data=job.payload.get('expenses', []),
+        many=True,
+        context={'request': SimpleNamespace(user=job.created_by)}
+    )
+    if not serializer.is_valid():
+        raise PermanentError(f"Invalid expenses: {json.dumps(serializer.errors)}")
+    expenses = serializer.save(created_by=job.created_by)
+    return {'created': [expense.id for expense in expenses]}
+
+
+@handler('rebuild_ledger')
+def rebuild_ledger(job):
+    ledger.rebuild()
+    return {'drift': len(ledger.find_drift())}
+
+
+@handler('rebuild_rollups')
+def rebuild_rollups(job):
+    rollups.rebuild()
+    return {'drift': len(rollups.find_drift())}
+
+
+@handler('backfill_friendships')
+def backfill_friendships(job):
+    graph.backfill(job.payload.get('batch_size', 5000))
+    return {}
+
+
+@handler('purge_idempotency_keys')
+def purge_idempotency_keys(job):
+    return {'deleted': idempotency.purge_expired()}
@@ -1,3 +1,1740 @@
-from django.test import TestCase
+import base64
+import csv
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from fractions import Fraction
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.db.migrations.executor import MigrationExecutor
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from . import async_views, exports, jobs, ledger, metrics, rollups, search, settlement, simplify, slow_queries, splits
+from .authentication import CachedTokenAuthentication, TokenCache, token_cache
+from .hashers import HashingPool
+from .management.commands.check_query_plans import SEQ_SCAN_PATTERNS
+from .middleware import StaticFilesMiddleware
+from .models import (
+    BalanceLedger, Expense, ExpenseParticipant, ExpenseShare, Friendship, IdempotencyKey, Job,
+    MonthlyRollup, Payment
+)
+from .pagination import KeysetPagination
+from .response_cache import ResponseCache, response_cache
+from .serializers import ExpenseSerializer
 
-# Create your tests here.
+
+class APITestCase(TestCase):
+    """Three users, alice, bob and carol, and helpers to drive the API as them"""
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.alice, self.bob, self.carol = (
+            User.objects.create_user(username) for username in ('alice', 'bob', 'carol')
+        )
+
+    def make_users(self, count, prefix='user'):
+        return [User.objects.create_user(f'{prefix}{i}') for i in range(count)]
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def expense_payload(self, participants, amount='30.00', items=1, **extra):
+        item_amount = Decimal(amount) / items
+        return {
+            'title': 'Dinner',
+            'total_amount': amount,
+            'items': [{'name': f'Item {i}', 'amount': str(item_amount)} for i in range(items)],
+            'participants': [participant.id for participant in participants],
+            **extra,
+        }
+
+    def create_expense(self, user, participants, amount='30.00', **extra):
+        response = self.client_for(user).post(
+            '/api/expenses/', self.expense_payload(participants, amount, **extra), format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def pay(self, from_user, to_user, amount):
+        response = self.client_for(from_user).post('/api/payments/', {
+            'from_user_id': from_user.id,
+            'to_user_id': to_user.id,
+            'amount': amount,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def owed(self, debtor, creditor):
+        row = BalanceLedger.objects.filter(debtor=debtor, creditor=creditor).first()
+        return row.amount if row else Decimal('0.00')
+
+
+class LedgerTests(APITestCase):
+    def assertLedger(self, expected):
+        self.assertEqual(ledger.find_drift(), [])
+        for (debtor, creditor), amount in expected.items():
+            self.assertEqual(self.owed(debtor, creditor), Decimal(amount))
+
+    def test_create_expense(self):
+        self.create_expense(self.alice, [self.bob, self.carol], '30.00')
+        self.assertLedger({(self.bob, self.alice): '10.00', (self.carol, self.alice): '10.00'})
+
+    def test_update_share(self):
+        expense = self.create_expense(self.alice, [self.bob, self.carol], '30.00')
+        share = ExpenseShare.objects.get(expense_id=expense['id'], participant=self.bob)
+        response = self.client_for(self.alice).patch(
+            f'/api/expense-shares/{share.id}/', {'amount': '12.50'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertLedger({(self.bob, self.alice): '12.50', (self.carol, self.alice): '10.00'})
+
+    def test_update_expense_details(self):
+        expense = self.create_expense(self.alice, [self.bob], '30.00')
+        response = self.client_for(self.alice).patch(
+            f"/api/expenses/{expense['id']}/", {'title': 'Lunch'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertLedger({(self.bob, self.alice): '15.00'})
+
+    def test_delete_expense(self):
+        expense = self.create_expense(self.alice, [self.bob, self.carol], '30.00')
+        self.create_expense(self.bob, [self.alice], '8.00')
+        response = self.client_for(self.alice).delete(f"/api/expenses/{expense['id']}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertLedger({
+            (self.bob, self.alice): '0.00',
+            (self.carol, self.alice): '0.00',
+            (self.alice, self.bob): '4.00',
+        })
+
+    def test_delete_share(self):
+        expense = self.create_expense(self.alice, [self.bob, self.carol], '30.00')
+        share = ExpenseShare.objects.get(expense_id=expense['id'], participant=self.carol)
+        response = self.client_for(self.alice).delete(f'/api/expense-shares/{share.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertLedger({(self.bob, self.alice): '10.00', (self.carol, self.alice): '0.00'})
+
+    def test_payments(self):
+        self.create_expense(self.alice, [self.bob], '30.00')
+        self.create_expense(self.alice, [self.bob], '10.00')
+        self.pay(self.bob, self.alice, '4.00')
+        self.assertLedger({(self.bob, self.alice): '16.00'})
+        self.pay(self.bob, self.alice, '16.00')
+        self.assertLedger({(self.bob, self.alice): '0.00'})
+
+    def test_find_drift_and_rebuild(self):
+        self.create_expense(self.alice, [self.bob, self.carol], '30.00')
+        BalanceLedger.objects.filter(debtor=self.bob).update(amount=Decimal('3.00'))
+        self.assertEqual(
+            ledger.find_drift(),
+            [(self.bob.id, self.alice.id, Decimal('3.00'), Decimal('10.00'))]
+        )
+        with self.assertRaises(CommandError):
+            call_command('rebuild_ledger', '--verify', stdout=StringIO())
+
+        call_command('rebuild_ledger', stdout=StringIO())
+        call_command('rebuild_ledger', '--verify', stdout=StringIO())
+        self.assertLedger({(self.bob, self.alice): '10.00', (self.carol, self.alice): '10.00'})
+
+
+class ExpenseWriteTests(APITestCase):
+    def write_queries(self, participants):
+        """Queries run to validate and save one expense by alice"""
+        serializer = ExpenseSerializer(
+            data=self.expense_payload(participants, items=3),
+            context={'request': SimpleNamespace(user=self.alice)}
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            serializer.save(created_by=self.alice)
+        return len(queries)
+
+    def test_write_queries_do_not_grow_with_participants(self):
+        # Gives alice her overall rollup row, so both sizes below update it
+        self.create_expense(self.alice, [self.bob])
+        few = self.make_users(2, 'few')
+        many = self.make_users(20, 'many')
+
+        new_pairs = self.write_queries(few)
+        self.assertEqual(self.write_queries(many), new_pairs)
+        existing_pairs = self.write_queries(few)
+        self.assertEqual(self.write_queries(many), existing_pairs)
+        self.assertEqual(ledger.find_drift(), [])
+
+    def test_repeated_participants_count_once(self):
+        expense = self.create_expense(self.alice, [self.bob, self.carol, self.bob], '30.00')
+        self.assertEqual(
+            sorted(share['participant']['id'] for share in expense['shares'] if not share['paid_by']),
+            [self.bob.id, self.carol.id]
+        )
+        self.assertEqual(self.owed(self.bob, self.alice), Decimal('10.00'))
+        self.assertEqual(ledger.find_drift(), [])
+
+    def test_bulk_create(self):
+        response = self.client_for(self.alice).post('/api/expenses/bulk/', [
+            self.expense_payload([self.bob], '10.00'),
+            self.expense_payload([self.bob, self.carol], '30.00', items=3),
+        ], format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([len(expense['items']) for expense in response.json()], [1, 3])
+        self.assertEqual(self.owed(self.bob, self.alice), Decimal('15.00'))
+        self.assertEqual(self.owed(self.carol, self.alice), Decimal('10.00'))
+
+    def test_bulk_errors_are_listed_per_expense(self):
+        invalid = self.expense_payload([self.bob])
+        invalid['items'][0].update(is_shared=False, assigned_to_id=self.carol.id)
+        response = self.client_for(self.alice).post('/api/expenses/bulk/', [
+            self.expense_payload([self.bob]),
+            invalid,
+            dict(self.expense_payload([self.bob]), participants=[999]),
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(errors[0], {})
+        self.assertEqual(list(errors[1]), ['items'])
+        self.assertEqual(errors[2], {'participants': ['Invalid pk "999" - object does not exist.']})
+        self.assertFalse(Expense.objects.exists())
+
+    def test_bulk_rejects_non_lists(self):
+        response = self.client_for(self.alice).post(
+            '/api/expenses/bulk/', self.expense_payload([self.bob]), format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Expected a list of expenses'})
+
+
+class QueryBudgetTests(APITestCase):
+    """Endpoints run a fixed number of queries however many rows they handle"""
+
+    def setUp(self):
+        super().setUp()
+        self.friends = self.make_users(5, 'friend')
+
+    def add_expense(self, participants=None, items=3):
+        participants = participants or [self.bob, *self.friends]
+        payload = self.expense_payload(participants, '60.00', items=items)
+        # One item for a single participant, so assigned_to is rendered too
+        payload['items'][0].update(is_shared=False, assigned_to_id=participants[0].id)
+        response = self.client_for(self.alice).post('/api/expenses/', payload, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def queries(self, path, user=None):
+        cache.clear()
+        client = self.client_for(user or self.alice)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(path)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries)
+
+    def assertConstantQueries(self, path, add_row, user=None):
+        add_row()
+        one = self.queries(path, user)
+        for _ in range(5):
+            add_row()
+        self.assertEqual(self.queries(path, user), one)
+
+    def test_expense_list(self):
+        self.assertConstantQueries('/api/expenses/', self.add_expense)
+
+    def test_expense_list_as_participant(self):
+        self.assertConstantQueries('/api/expenses/', self.add_expense, user=self.bob)
+
+    def test_my_expenses(self):
+        self.assertConstantQueries('/api/expenses/my_expenses/', self.add_expense)
+
+    def test_friend_expenses(self):
+        self.assertConstantQueries(
+            f'/api/expenses/friend_expenses/?friend_id={self.bob.id}', self.add_expense
+        )
+
+    def test_expense_detail(self):
+        small = self.add_expense([self.bob], items=1)
+        large = self.add_expense(items=10)
+        self.assertEqual(
+            self.queries(f"/api/expenses/{large['id']}/"),
+            self.queries(f"/api/expenses/{small['id']}/")
+        )
+
+    def test_expense_shares(self):
+        self.assertConstantQueries('/api/expense-shares/', self.add_expense)
+
+    def test_payments(self):
+        self.add_expense()
+        self.assertConstantQueries(
+            '/api/payments/', lambda: self.pay(self.bob, self.alice, '1.00')
+        )
+
+    def test_expense_create(self):
+        def create_queries(participants):
+            with CaptureQueriesContext(connection) as queries:
+                expense = self.add_expense(participants)
+            self.assertEqual(len(expense['shares']), 2 * len(participants))
+            return len(queries)
+
+        # Gives alice her overall rollup row, so both sizes below update it
+        self.add_expense([self.bob])
+        few = create_queries(self.make_users(2, 'few'))
+        self.assertEqual(create_queries(self.make_users(20, 'many')), few)
+
+
+class QueryPlanTests(APITestCase):
+    def test_hot_queries_use_indexes(self):
+        self.create_expense(self.alice, [self.bob, self.carol])
+        self.pay(self.bob, self.alice, '5.00')
+        out = StringIO()
+        try:
+            call_command('check_query_plans', '--verbose-plans', stdout=out)
+        except CommandError as e:
+            self.fail(f"{e}\n{out.getvalue()}")
+
+    def test_sequential_scans_are_recognised(self):
+        sqlite = SEQ_SCAN_PATTERNS['sqlite']
+        self.assertEqual(sqlite.findall('SCAN expenses_payment'), ['expenses_payment'])
+        self.assertEqual(
+            sqlite.findall('SCAN expenses_payment USING INDEX payment_pair_created_idx'), []
+        )
+        self.assertEqual(
+            sqlite.findall('SEARCH expenses_expenseshare USING INDEX share_open_participant_idx (participant_id=?)'), []
+        )
+        postgres = SEQ_SCAN_PATTERNS['postgresql']
+        self.assertEqual(
+            postgres.findall('Seq Scan on expenses_expenseshare  (cost=0.00..35.50 rows=10 width=40)'),
+            ['expenses_expenseshare']
+        )
+        self.assertEqual(
+            postgres.findall('Index Scan using share_open_participant_idx on expenses_expenseshare'), []
+        )
+
+
+class SettlementTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        # bob owes alice 5.00, then 10.00
+        self.older = self.create_expense(self.alice, [self.bob], '10.00')
+        self.newer = self.create_expense(self.alice, [self.bob], '20.00')
+        self.older_share, self.newer_share = (
+            ExpenseShare.objects.get(expense_id=expense['id'], participant=self.bob)
+            for expense in (self.older, self.newer)
+        )
+
+    def test_partial_payment(self):
+        summary = self.pay(self.bob, self.alice, '8.00')['settlement']
+        self.assertEqual(summary['settled_share_ids'], [self.older_share.id])
+        self.assertEqual(summary['partially_settled_share_id'], self.newer_share.id)
+        self.assertEqual(Decimal(str(summary['amount_applied'])), Decimal('8.00'))
+        self.assertEqual(Decimal(str(summary['overpayment'])), Decimal('0.00'))
+
+        self.newer_share.refresh_from_db()
+        self.assertFalse(self.newer_share.settled)
+        self.assertEqual(self.newer_share.settled_amount, Decimal('3.00'))
+        self.assertEqual(self.owed(self.bob, self.alice), Decimal('7.00'))
+        self.assertEqual(ledger.find_drift(), [])
+
+    def test_overpayment(self):
+        self.pay(self.bob, self.alice, '8.00')
+        summary = self.pay(self.bob, self.alice, '10.00')['settlement']
+        self.assertEqual(summary['settled_share_ids'], [self.newer_share.id])
+        self.assertIsNone(summary['partially_settled_share_id'])
+        self.assertEqual(Decimal(str(summary['amount_applied'])), Decimal('7.00'))
+        self.assertEqual(Decimal(str(summary['overpayment'])), Decimal('3.00'))
+        self.assertFalse(ExpenseShare.objects.filter(settled=False).exists())
+        self.assertEqual(self.owed(self.bob, self.alice), Decimal('0.00'))
+        self.assertEqual(ledger.find_drift(), [])
+
+    def test_amount_must_be_positive(self):
+        client = self.client_for(self.bob)
+        for amount in ('0.00', '-5.00'):
+            response = client.post('/api/payments/', {
+                'from_user_id': self.bob.id, 'to_user_id': self.alice.id, 'amount': amount,
+            }, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'amount': ['Amount must be greater than zero.']})
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(self.owed(self.bob, self.alice), Decimal('15.00'))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentSettlementTests(TransactionTestCase):
+    def test_concurrent_payments_settle_each_share_once(self):
+        alice, bob = User.objects.create_user('alice'), User.objects.create_user('bob')
+        client = APIClient()
+        client.force_authenticate(alice)
+        response = client.post('/api/expenses/', {
+            'title': 'Dinner', 'total_amount': '20.00',
+            'items': [{'name': 'Food', 'amount': '20.00'}],
+            'participants': [bob.id],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+        barrier = threading.Barrier(2)
+        summaries = []
+        errors = []
+
+        def pay():
+            try:
+                barrier.wait()
+                with transaction.atomic():
+                    payment = Payment.objects.create(from_user=bob, to_user=alice, amount=Decimal('10.00'))
+                    summaries.append(settlement.settle_payment(payment))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=pay) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        # One payment settled the share, the other found nothing left to settle
+        self.assertEqual(
+            sorted(summary['amount_applied'] for summary in summaries),
+            [Decimal('0.00'), Decimal('10.00')]
+        )
+        self.assertEqual(
+            sorted(summary['overpayment'] for summary in summaries),
+            [Decimal('0.00'), Decimal('10.00')]
+        )
+        share = ExpenseShare.objects.get(participant=bob)
+        self.assertTrue(share.settled)
+        self.assertEqual(share.settled_amount, Decimal('10.00'))
+        self.assertEqual(ledger.find_drift(), [])
+
+
+class SimplifyTests(APITestCase):
+    def assertFollowsDebts(self, debts, transfers):
+        """Every transfer clears net positions along some chain of debts"""
+        owes = defaultdict(set)
+        for debtor_id, creditor_id in debts:
+            owes[debtor_id].add(creditor_id)
+        positions = defaultdict(Decimal, simplify.net_positions(debts))
+        for debtor_id, creditor_id, amount in transfers:
+            reached, frontier = {debtor_id}, [debtor_id]
+            while frontier:
+                frontier = [user_id for user in frontier for user_id in owes[user] if user_id not in reached]
+                reached.update(frontier)
+            self.assertIn(creditor_id, reached, f"{debtor_id} has no debts leading to {creditor_id}")
+            positions[debtor_id] += amount
+            positions[creditor_id] -= amount
+        self.assertFalse([amount for amount in positions.values() if amount])
+
+    def test_transfers_stay_within_chains_of_debt(self):
+        # A greedy match on net positions alone would send 1's money to 4
+        debts = {(1, 2): Decimal('7.00'), (1, 3): Decimal('3.00'), (4, 5): Decimal('8.00')}
+        transfers = simplify.minimum_transfers(debts)
+        self.assertEqual(sorted(transfers), [
+            (1, 2, Decimal('7.00')), (1, 3, Decimal('3.00')), (4, 5, Decimal('8.00'))
+        ])
+
+    def test_chains_collapse_and_cycles_cancel(self):
+        chain = {(1, 2): Decimal('10.00'), (2, 3): Decimal('10.00')}
+        self.assertEqual(simplify.minimum_transfers(chain), [(1, 3, Decimal('10.00'))])
+        cycle = {(1, 2): Decimal('5.00'), (2, 3): Decimal('5.00'), (3, 1): Decimal('5.00')}
+        self.assertEqual(simplify.minimum_transfers(cycle), [])
+
+    def test_random_graphs(self):
+        rng = random.Random(7)
+        for users in (5, 20, 200):
+            debts = {}
+            for debtor_id in range(users):
+                for creditor_id in rng.sample(range(users), 3):
+                    if creditor_id != debtor_id:
+                        debts[(debtor_id, creditor_id)] = Decimal(rng.randint(1, 10000)) / 100
+            self.assertFollowsDebts(debts, simplify.minimum_transfers(debts))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('bench_simplify', users=500, repeat=1, stdout=out)
+        self.assertIn('500 users', out.getvalue())
+
+    def test_suggested_payment_settles_the_chain(self):
+        # alice owes bob, bob owes carol, and alice and carol are friends
+        self.create_expense(self.bob, [self.alice], '20.00')
+        self.create_expense(self.carol, [self.bob], '20.00')
+        self.create_expense(self.alice, [self.carol], '20.00')
+        self.pay(self.carol, self.alice, '10.00')
+
+        client = self.client_for(self.alice)
+        response = client.get(f'/api/friends/simplify/?user_ids={self.bob.id},{self.carol.id}')
+        self.assertEqual(response.status_code, 200)
+        payments = response.json()['payments']
+        self.assertEqual(
+            [(p['from_user_id'], p['to_user_id'], Decimal(str(p['amount']))) for p in payments],
+            [(self.alice.id, self.carol.id, Decimal('10.00'))]
+        )
+
+        summary = self.pay(self.alice, self.carol, payments[0]['amount'])['settlement']
+        self.assertEqual(Decimal(str(summary['overpayment'])), Decimal('0.00'))
+        self.assertEqual(
+            [route['path'] for route in summary['routed']],
+            [[self.alice.id, self.bob.id, self.carol.id]]
+        )
+        self.assertFalse(BalanceLedger.objects.filter(amount__gt=0).exists())
+        self.assertFalse(ExpenseShare.objects.filter(settled=False).exists())
+        self.assertEqual(ledger.find_drift(), [])
+        response = client.get(f'/api/friends/simplify/?user_ids={self.bob.id},{self.carol.id}')
+        self.assertEqual(response.json()['payments'], [])
+
+    def test_group_is_limited_to_friends(self):
+        self.create_expense(self.bob, [self.alice], '20.00')
+        self.create_expense(self.carol, [self.bob], '20.00')
+        response = self.client_for(self.alice).get(
+            f'/api/friends/simplify/?user_ids={self.bob.id},{self.carol.id},999'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['unknown'], [self.carol.id, 999])
+        # Debts between bob and carol stay out of alice's view
+        self.assertEqual(
+            [(p['from_user_id'], p['to_user_id']) for p in response.json()['payments']],
+            [(self.alice.id, self.bob.id)]
+        )
+
+    def test_rejects_malformed_ids(self):
+        response = self.client_for(self.alice).get('/api/friends/simplify/?user_ids=1,x')
+        self.assertEqual(response.status_code, 400)
+
+
+class TokenCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.alice)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.shared_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.shared_dir.cleanup)
+
+    def shared_caches(self):
+        """Settings with a 'shared' alias that several TokenCaches can see"""
+        return override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': self.shared_dir.name,
+            },
+        })
+
+    def seconds_later(self, seconds):
+        return mock.patch(
+            'expenses.authentication.time.monotonic', return_value=time.monotonic() + seconds
+        )
+
+    def test_requests_cannot_change_the_cached_user(self):
+        authentication = CachedTokenAuthentication()
+        for _ in range(2):
+            # First a cache miss, then a hit
+            user, _ = authentication.authenticate_credentials(self.token.key)
+            user.first_name = 'changed'
+            self.assertEqual(token_cache.get(self.token.key).first_name, '')
+
+    def test_deleted_token_is_rejected(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.alice.is_active = False
+        self.alice.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_local_memory_alias_is_not_shared(self):
+        self.assertIsNone(TokenCache(cache_alias='default').shared)
+        with self.shared_caches():
+            self.assertIsNotNone(TokenCache(cache_alias='shared').shared)
+
+    def test_revocation_reaches_other_processes(self):
+        with self.shared_caches():
+            revoking, other = TokenCache(cache_alias='shared'), TokenCache(cache_alias='shared')
+            revoking.set(self.token.key, self.alice)
+            self.assertEqual(other.get(self.token.key), self.alice)
+
+            revoking.invalidate(self.token.key)
+            self.assertIsNone(revoking.get(self.token.key))
+            # The other process's local copy lasts only `local_ttl` seconds
+            with self.seconds_later(other.local_ttl + 1):
+                self.assertIsNone(other.get(self.token.key))
+
+    def test_local_tier_expires_quickly_without_a_shared_cache(self):
+        other = TokenCache()
+        other.set(self.token.key, self.alice)
+        with self.seconds_later(other.local_ttl + 1):
+            self.assertIsNone(other.get(self.token.key))
+
+
+@override_settings(
+    PASSWORD_HASHERS=['expenses.hashers.BCryptSHA256PasswordHasher'],
+    BCRYPT_ROUNDS=4,
+)
+class AsyncAuthTests(APITestCase):
+    def register(self, username='dave', password='correct horse'):
+        return self.client.post(
+            '/api/auth/register/', {'username': username, 'password': password},
+            content_type='application/json'
+        )
+
+    def login(self, username='dave', password='correct horse'):
+        return self.client.post(
+            '/api/auth/login/', {'username': username, 'password': password},
+            content_type='application/json'
+        )
+
+    def test_register_then_login(self):
+        response = self.register()
+        self.assertEqual(response.status_code, 201, response.content)
+        token = response.json()['token']
+        self.assertTrue(User.objects.get(username='dave').password.startswith('bcrypt_sha256$'))
+
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['token'], token)
+        self.assertEqual(self.login(password='wrong').status_code, 401)
+        self.assertEqual(self.login(username='nobody').status_code, 401)
+
+    def test_usernames_are_validated(self):
+        for username, message in (
+            ('', 'This field cannot be blank.'),
+            ('no spaces', 'Enter a valid username.'),
+            ('x' * 151, 'at most 150 characters'),
+            (['dave'], 'Enter a valid username.'),
+        ):
+            with self.subTest(username=username):
+                response = self.register(username=username)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(message, response.json()['error'])
+        self.assertFalse(User.objects.filter(username='').exists())
+
+    def test_usernames_are_normalized(self):
+        # NFKC folds the fullwidth letters to plain ASCII
+        response = self.register(username='\uff44ave')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['user']['username'], 'dave')
+        self.assertEqual(self.register(username='dave').status_code, 400)
+
+    def test_duplicate_username(self):
+        self.register()
+        response = self.register()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Username already exists'})
+
+    def test_outdated_hash_is_upgraded_on_login(self):
+        self.register()
+        old_hash = User.objects.get(username='dave').password
+        with self.settings(BCRYPT_ROUNDS=5):
+            self.assertEqual(self.login().status_code, 200)
+        new_hash = User.objects.get(username='dave').password
+        self.assertNotEqual(new_hash, old_hash)
+        self.assertIn('$05$', new_hash)
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_full_hashing_queue_sheds_requests(self):
+        with mock.patch('expenses.hashers.hashing_pool', HashingPool(queue_limit=0)):
+            response = self.register()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(User.objects.filter(username='dave').exists())
+
+
+class ResponseCacheTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        # The test cache is local memory, so the response cache needs the
+        # single-process opt-in to run at all
+        allow_local = mock.patch.object(response_cache, 'allow_local', True)
+        allow_local.start()
+        self.addCleanup(allow_local.stop)
+
+
+class ResponseCacheTests(ResponseCacheTestCase):
+
+    def balance(self, user):
+        response = self.client_for(user).get('/api/friends/overall_balance/')
+        self.assertEqual(response.status_code, 200)
+        return Decimal(str(response.json()['total_balance']))
+
+    def expense_ids(self, user):
+        response = self.client_for(user).get('/api/expenses/')
+        self.assertEqual(response.status_code, 200)
+        return [expense['id'] for expense in response.json()['results']]
+
+    def test_only_shared_backends_are_used(self):
+        self.assertFalse(ResponseCache(alias='default').enabled)
+        self.assertTrue(ResponseCache(alias='default', allow_local=True).enabled)
+        with tempfile.TemporaryDirectory() as location, override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        }):
+            self.assertTrue(ResponseCache(alias='shared').enabled)
+
+    def test_disabled_cache_serves_fresh_responses(self):
+        with mock.patch.object(response_cache, 'allow_local', False):
+            self.assertEqual(self.balance(self.bob), Decimal('0.00'))
+            hits = response_cache.stats()['hits']
+            self.create_expense(self.alice, [self.bob], '30.00')
+            self.assertEqual(self.balance(self.bob), Decimal('-15.00'))
+            self.assertEqual(response_cache.stats()['hits'], hits)
+
+    def test_repeated_reads_are_cached(self):
+        self.create_expense(self.alice, [self.bob], '30.00')
+        self.balance(self.bob)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.balance(self.bob), Decimal('-15.00'))
+
+    def test_writes_invalidate_balances(self):
+        self.assertEqual(self.balance(self.bob), Decimal('0.00'))
+        expense = self.create_expense(self.alice, [self.bob], '30.00')
+        self.assertEqual(self.balance(self.bob), Decimal('-15.00'))
+        self.pay(self.bob, self.alice, '5.00')
+        self.assertEqual(self.balance(self.bob), Decimal('-10.00'))
+        self.assertEqual(self.balance(self.alice), Decimal('10.00'))
+        response = self.client_for(self.alice).delete(f"/api/expenses/{expense['id']}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.balance(self.bob), Decimal('0.00'))
+
+    def test_writes_invalidate_expense_lists(self):
+        self.assertEqual(self.expense_ids(self.bob), [])
+        expense = self.create_expense(self.alice, [self.bob], '30.00')
+        self.assertEqual(self.expense_ids(self.bob), [expense['id']])
+        self.assertEqual(self.expense_ids(self.carol), [])
+        response = self.client_for(self.alice).delete(f"/api/expenses/{expense['id']}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.expense_ids(self.bob), [])
+
+
+class ConditionalListTests(ResponseCacheTestCase):
+    def assertRevalidates(self, user, url, write):
+        client = self.client_for(user)
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        with self.assertNumQueries(0):
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        write()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_expense_list(self):
+        self.assertRevalidates(
+            self.bob, '/api/expenses/', lambda: self.create_expense(self.alice, [self.bob])
+        )
+
+    def test_share_list(self):
+        self.assertRevalidates(
+            self.bob, '/api/expense-shares/', lambda: self.create_expense(self.alice, [self.bob])
+        )
+
+    def test_payment_list(self):
+        self.create_expense(self.alice, [self.bob])
+        self.assertRevalidates(
+            self.bob, '/api/payments/', lambda: self.pay(self.bob, self.alice, '5.00')
+        )
+
+    def test_etags_are_per_user(self):
+        self.create_expense(self.alice, [self.bob])
+        etag = self.client_for(self.bob).get('/api/expenses/')['ETag']
+        response = self.client_for(self.alice).get('/api/expenses/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_other_users_writes_keep_the_etag(self):
+        etag = self.client_for(self.bob).get('/api/expenses/')['ETag']
+        self.create_expense(self.alice, [self.carol])
+        response = self.client_for(self.bob).get('/api/expenses/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class GraphTests(APITestCase):
+    def friend_ids(self, user):
+        return set(Friendship.objects.filter(user=user).values_list('friend_id', flat=True))
+
+    def can_see(self, user, expense):
+        return self.client_for(user).get(f"/api/expenses/{expense['id']}/").status_code == 200
+
+    def share_of(self, expense, user):
+        return ExpenseShare.objects.get(expense_id=expense['id'], participant=user)
+
+    def test_deleting_a_share_revokes_access(self):
+        expense = self.create_expense(self.alice, [self.bob, self.carol])
+        self.assertTrue(self.can_see(self.bob, expense))
+        share = self.share_of(expense, self.bob)
+        response = self.client_for(self.alice).delete(f'/api/expense-shares/{share.id}/')
+        self.assertEqual(response.status_code, 204)
+
+        self.assertFalse(self.can_see(self.bob, expense))
+        self.assertTrue(self.can_see(self.carol, expense))
+        self.assertTrue(self.can_see(self.alice, expense))
+        self.assertEqual(self.friend_ids(self.alice), {self.carol.id})
+        self.assertEqual(self.friend_ids(self.bob), set())
+
+    def test_friendship_outlives_one_of_several_expenses(self):
+        first = self.create_expense(self.alice, [self.bob])
+        # bob created this one, so the pair is still shared the other way round
+        self.create_expense(self.bob, [self.alice])
+        share = self.share_of(first, self.bob)
+        self.client_for(self.alice).delete(f'/api/expense-shares/{share.id}/')
+        self.assertEqual(self.friend_ids(self.alice), {self.bob.id})
+        self.assertEqual(self.friend_ids(self.bob), {self.alice.id})
+
+    def test_moving_a_share_moves_access(self):
+        expense = self.create_expense(self.alice, [self.bob])
+        share = self.share_of(expense, self.bob)
+        response = self.client_for(self.alice).patch(
+            f'/api/expense-shares/{share.id}/', {'participant_id': self.carol.id}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+
+        self.assertFalse(self.can_see(self.bob, expense))
+        self.assertTrue(self.can_see(self.carol, expense))
+        self.assertEqual(self.friend_ids(self.alice), {self.carol.id})
+        self.assertEqual(self.friend_ids(self.carol), {self.alice.id})
+        self.assertEqual(self.friend_ids(self.bob), set())
+
+    def test_deleting_an_expense_drops_friendships(self):
+        kept = self.create_expense(self.alice, [self.carol])
+        expense = self.create_expense(self.alice, [self.bob, self.carol])
+        response = self.client_for(self.alice).delete(f"/api/expenses/{expense['id']}/")
+        self.assertEqual(response.status_code, 204)
+
+        self.assertFalse(ExpenseParticipant.objects.filter(expense_id=expense['id']).exists())
+        self.assertEqual(self.friend_ids(self.alice), {self.carol.id})
+        self.assertEqual(self.friend_ids(self.bob), set())
+        self.assertTrue(self.can_see(self.carol, kept))
+
+
+class SplitTests(SimpleTestCase):
+    def test_allocate_keeps_every_cent(self):
+        self.assertEqual(splits.allocate(100, [1, 1, 1]), [34, 33, 33])
+        self.assertEqual(splits.allocate(1000, [1, 2, 3]), [167, 333, 500])
+        self.assertEqual(splits.allocate(1, [1, 1]), [1, 0])
+        self.assertEqual(splits.allocate(0, [1, 1]), [0, 0])
+        rng = random.Random(3)
+        for _ in range(200):
+            weights = [rng.randint(0, 50) for _ in range(rng.randint(1, 8))]
+            weights[0] += 1
+            total = rng.randint(0, 10 ** 6)
+            self.assertEqual(sum(splits.allocate(total, weights)), total)
+
+    def test_allocate_gives_leftover_cents_to_largest_remainders(self):
+        # 10 * 0.25 = 2.5, 10 * 0.35 = 3.5, 10 * 0.4 = 4: one cent left over,
+        # and the tie between the two halves goes to the first
+        self.assertEqual(splits.allocate(10, [Fraction(1, 4), Fraction(7, 20), Fraction(2, 5)]), [3, 3, 4])
+        self.assertEqual(splits.allocate(5, [3, 1]), [4, 1])
+
+    def test_allocate_needs_a_positive_weight(self):
+        with self.assertRaises(splits.SplitError):
+            splits.allocate(100, [0, 0])
+
+    def test_allocate_rejects_negative_totals(self):
+        with self.assertRaisesMessage(splits.SplitError, 'negative amount: -0.05'):
+            splits.allocate(-5, [1, 1, 1])
+        with self.assertRaises(splits.SplitError):
+            splits.split_expense([('5.00', True, None), ('-8.00', True, None)], [1, 2])
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('bench_splits', participants=50, items=50, repeat=1, stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+
+    def test_equal_split(self):
+        owed = splits.split_expense([('10.00', True, None)], [1, 2, 3])
+        self.assertEqual(owed, {1: 334, 2: 333, 3: 333})
+
+    def test_assigned_items(self):
+        owed = splits.split_expense([('9.00', True, None), ('4.50', False, 2)], [1, 2])
+        self.assertEqual(owed, {1: 450, 2: 900})
+        with self.assertRaises(splits.SplitError):
+            splits.split_expense([('4.50', False, 3)], [1, 2])
+
+    def test_percentage_split(self):
+        owed = splits.split_expense(
+            [('100.00', True, None)], [1, 2, 3], split_type=splits.PERCENTAGE,
+            split_values={1: '33.33', 2: '33.33', 3: '33.34'}
+        )
+        self.assertEqual(owed, {1: 3333, 2: 3333, 3: 3334})
+        for values, message in (
+            ({1: 50, 2: 40}, 'add up to 100'),
+            ({1: 120, 2: -20}, 'negative'),
+            ({1: 50, 2: 25, 4: 25}, 'non-participants'),
+            ({1: 'half', 2: 50}, 'Invalid split value'),
+        ):
+            with self.subTest(values=values), self.assertRaisesMessage(splits.SplitError, message):
+                splits.split_expense(
+                    [('100.00', True, None)], [1, 2], split_type=splits.PERCENTAGE, split_values=values
+                )
+
+    def test_weight_split(self):
+        owed = splits.split_expense(
+            [('10.00', True, None)], [1, 2], split_type=splits.WEIGHTS, split_values={1: 2, 2: 1}
+        )
+        self.assertEqual(owed, {1: 667, 2: 333})
+        with self.assertRaisesMessage(splits.SplitError, 'negative'):
+            splits.split_expense(
+                [('10.00', True, None)], [1, 2], split_type=splits.WEIGHTS, split_values={1: 2, 2: -1}
+            )
+        with self.assertRaisesMessage(splits.SplitError, 'positive share'):
+            splits.split_expense([('10.00', True, None)], [1, 2], split_type=splits.WEIGHTS)
+
+    def test_exact_split(self):
+        owed = splits.split_expense(
+            [('10.00', True, None)], [1, 2], split_type=splits.EXACT, split_values={1: '7.25', 2: '2.75'}
+        )
+        self.assertEqual(owed, {1: 725, 2: 275})
+        with self.assertRaisesMessage(splits.SplitError, 'add up to 9.00'):
+            splits.split_expense(
+                [('10.00', True, None)], [1, 2], split_type=splits.EXACT, split_values={1: '7.00', 2: '2.00'}
+            )
+
+    def test_tax_splits(self):
+        items = [('30.00', False, 1), ('10.00', False, 2)]
+        self.assertEqual(
+            splits.split_expense(items, [1, 2], tax_amount='4.01'),
+            {1: 3201, 2: 1200}
+        )
+        self.assertEqual(
+            splits.split_expense(items, [1, 2], tax_amount='4.01', tax_split=splits.TAX_PROPORTIONAL),
+            {1: 3301, 2: 1100}
+        )
+
+    def test_needs_a_participant(self):
+        with self.assertRaises(splits.SplitError):
+            splits.split_expense([('10.00', True, None)], [])
+
+
+class RollupTests(APITestCase):
+    def monthly(self, user, **params):
+        response = self.client_for(user).get('/api/analytics/monthly/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_match_raw_totals_after_writes(self):
+        expense = self.create_expense(self.alice, [self.bob, self.carol], '30.00')
+        self.create_expense(self.bob, [self.alice], '12.00')
+        self.assertEqual(rollups.find_drift(), [])
+
+        payment = self.pay(self.bob, self.alice, '4.00')
+        self.pay(self.carol, self.alice, '10.00')
+        self.assertEqual(rollups.find_drift(), [])
+
+        share = ExpenseShare.objects.get(expense_id=expense['id'], participant=self.carol)
+        response = self.client_for(self.alice).patch(
+            f'/api/expense-shares/{share.id}/', {'participant_id': self.carol.id, 'amount': '12.00'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(rollups.find_drift(), [])
+
+        response = self.client_for(self.bob).delete(f"/api/payments/{payment['id']}/")
+        self.assertEqual(response.status_code, 204)
+        response = self.client_for(self.alice).delete(f"/api/expenses/{expense['id']}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(rollups.find_drift(), [])
+
+    def test_monthly_totals(self):
+        self.create_expense(self.alice, [self.bob, self.carol], '30.00')
+        self.pay(self.bob, self.alice, '4.00')
+        [month] = self.monthly(self.alice)['months']
+        # Overall paid is the whole expense, alice's own third included
+        self.assertEqual(Decimal(str(month['paid'])), Decimal('30.00'))
+        self.assertEqual(Decimal(str(month['received'])), Decimal('4.00'))
+        [month] = self.monthly(self.alice, counterparty=self.bob.id)['months']
+        self.assertEqual(Decimal(str(month['paid'])), Decimal('10.00'))
+        [month] = self.monthly(self.bob, counterparty=self.alice.id)['months']
+        self.assertEqual(Decimal(str(month['owed'])), Decimal('10.00'))
+        self.assertEqual(Decimal(str(month['settled'])), Decimal('4.00'))
+
+    def test_uneven_split_totals(self):
+        expense = self.create_expense(
+            self.alice, [self.bob, self.carol], '40.00', split_type=splits.WEIGHTS,
+            split_values={str(self.alice.id): 1, str(self.bob.id): 2, str(self.carol.id): 5}
+        )
+        [month] = self.monthly(self.alice)['months']
+        self.assertEqual(Decimal(str(month['paid'])), Decimal('40.00'))
+        [month] = self.monthly(self.alice, counterparty=self.carol.id)['months']
+        self.assertEqual(Decimal(str(month['paid'])), Decimal('25.00'))
+        [month] = self.monthly(self.bob)['months']
+        self.assertEqual(Decimal(str(month['owed'])), Decimal('10.00'))
+        self.assertEqual(rollups.find_drift(), [])
+
+        response = self.client_for(self.alice).patch(
+            f"/api/expenses/{expense['id']}/", {'total_amount': '48.00'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        [month] = self.monthly(self.alice)['months']
+        self.assertEqual(Decimal(str(month['paid'])), Decimal('48.00'))
+        self.assertEqual(rollups.find_drift(), [])
+
+        response = self.client_for(self.alice).delete(f"/api/expenses/{expense['id']}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(rollups.find_drift(), [])
+
+    def test_rebuild_repairs_drift(self):
+        self.create_expense(self.alice, [self.bob], '30.00')
+        MonthlyRollup.objects.filter(user=self.alice).update(paid=Decimal('1.00'))
+        self.assertNotEqual(rollups.find_drift(), [])
+        rollups.rebuild()
+        self.assertEqual(rollups.find_drift(), [])
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.pizza = self.create_expense(self.alice, [self.bob], title='Pizza night', description='Friday')
+        self.groceries = self.create_expense(
+            self.alice, [self.bob], title='Groceries', description='Pizza dough and cheese'
+        )
+        self.taxi = self.create_expense(self.alice, [self.bob], title='Taxi')
+
+    def found(self, text):
+        response = self.client_for(self.bob).get('/api/expenses/', {'q': text})
+        self.assertEqual(response.status_code, 200)
+        return [expense['id'] for expense in response.json()['results']]
+
+    def assertSearches(self):
+        # A title match outranks a description match
+        self.assertEqual(self.found('pizza'), [self.pizza['id'], self.groceries['id']])
+        self.assertEqual(self.found('pizza cheese'), [self.groceries['id']])
+        # Item names are searched too
+        self.assertEqual(
+            sorted(self.found('item')), sorted(e['id'] for e in (self.pizza, self.groceries, self.taxi))
+        )
+        self.assertEqual(self.found('sushi'), [])
+
+    def test_full_text_search(self):
+        self.assertSearches()
+
+    def test_substring_fallback_on_other_databases(self):
+        with mock.patch('expenses.search._vendor', return_value='mysql'):
+            self.create_expense(self.alice, [self.carol], title='Pizza for carol')
+            self.assertSearches()
+
+
+@override_settings(JOB_QUEUE={'MAX_ATTEMPTS': 3, 'BACKOFF_SECONDS': 10, 'MAX_BACKOFF_SECONDS': 30})
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        handlers = mock.patch.dict(jobs.HANDLERS, {
+            'succeed': lambda job: self.calls.append(job.pk) or {'ok': job.payload.get('n')},
+            'fail': self.fail_job,
+            'give_up': self.give_up,
+        })
+        handlers.start()
+        self.addCleanup(handlers.stop)
+
+    def fail_job(self, job):
+        raise RuntimeError("flaky")
+
+    def give_up(self, job):
+        raise jobs.PermanentError("bad payload")
+
+    def run_due(self, worker_id='w1'):
+        return [jobs.run(job) for job in jobs.claim(worker_id, limit=10)]
+
+    def run_failing(self):
+        with self.assertLogs('expenses.jobs'):
+            return self.run_due()
+
+    def test_unknown_kinds_are_rejected(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('nope')
+
+    def test_claims_due_jobs_once_in_order(self):
+        later = jobs.enqueue('succeed', delay=timedelta(minutes=5))
+        first = jobs.enqueue('succeed')
+        second = jobs.enqueue('succeed')
+
+        claimed = jobs.claim('w1', limit=1)
+        self.assertEqual([job.pk for job in claimed], [first.pk])
+        self.assertEqual((claimed[0].status, claimed[0].locked_by), (Job.RUNNING, 'w1'))
+        self.assertEqual([job.pk for job in jobs.claim('w2', limit=10)], [second.pk])
+        self.assertEqual(jobs.claim('w3', limit=10), [])
+        Job.objects.filter(pk=later.pk).update(run_after=timezone.now())
+        self.assertEqual([job.pk for job in jobs.claim('w3', limit=10)], [later.pk])
+
+    def test_success_stores_the_result(self):
+        job = jobs.enqueue('succeed', {'n': 7})
+        [job] = self.run_due()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result), (Job.SUCCEEDED, 1, {'ok': 7}))
+        self.assertEqual(job.locked_by, '')
+
+    def test_failures_retry_with_backoff_then_fail(self):
+        self.assertEqual(
+            [jobs.backoff(attempts).total_seconds() for attempts in (1, 2, 3, 4)],
+            [10, 20, 30, 30]
+        )
+        job = jobs.enqueue('fail')
+        for attempts, delay in ((1, 10), (2, 20)):
+            started = timezone.now()
+            [job] = self.run_failing()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (Job.QUEUED, attempts))
+            self.assertIn('RuntimeError: flaky', job.error)
+            self.assertGreaterEqual(job.run_after, started + timedelta(seconds=delay))
+            # Not due until the backoff has passed
+            self.assertEqual(jobs.claim('w1'), [])
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+
+        [job] = self.run_failing()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
+
+    def test_permanent_errors_fail_at_once(self):
+        job = jobs.enqueue('give_up')
+        self.run_failing()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), (Job.FAILED, 1, 'bad payload'))
+
+    def test_stale_jobs_are_requeued(self):
+        job = jobs.enqueue('succeed', max_attempts=2)
+        jobs.claim('lost')
+        self.assertEqual(jobs.requeue_stale(timedelta(minutes=15)), 0)
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(timedelta(minutes=15)), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (Job.QUEUED, 1, ''))
+
+        jobs.claim('lost')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        jobs.requeue_stale(timedelta(minutes=15))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+
+class RollupDeltaTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(f'user{i}') for i in range(12)]
+        self.month = timezone.now().date().replace(day=1)
+
+    def deltas(self, pairs, amount='1.00'):
+        deltas = rollups.merge()
+        for user, counterparty in pairs:
+            deltas[(user.id, counterparty.id if counterparty else None, self.month)]['paid'] += Decimal(amount)
+        return deltas
+
+    def pairs(self, count):
+        """Every (user, counterparty) row among the first `count` users, overall rows included"""
+        users = self.users[:count]
+        return [
+            (user, counterparty)
+            for user in users
+            for counterparty in users + [None]
+            if user != counterparty
+        ]
+
+    def totals(self):
+        return {
+            (row.user_id, row.counterparty_id): row.paid for row in MonthlyRollup.objects.all()
+        }
+
+    def test_bulk_path_queries_do_not_grow_with_rows(self):
+        # Half the rows exist already, half are new
+        for count in (3, 12):
+            MonthlyRollup.objects.all().delete()
+            pairs = self.pairs(count)
+            rollups.apply_deltas(self.deltas(pairs[::2]))
+            with self.assertNumQueries(5):
+                rollups.apply_deltas(self.deltas(pairs))
+            self.assertEqual(
+                sorted(self.totals().values()),
+                sorted([Decimal('2.00')] * len(pairs[::2]) + [Decimal('1.00')] * len(pairs[1::2]))
+            )
+
+    def test_falls_back_to_row_increments_on_conflict(self):
+        pairs = self.pairs(3)
+        rollups.apply_deltas(self.deltas(pairs[:2]))
+        conflict = mock.patch.object(
+            MonthlyRollup.objects, 'bulk_create', side_effect=IntegrityError('duplicate key')
+        )
+        with conflict:
+            rollups.apply_deltas(self.deltas(pairs, '2.50'))
+        totals = self.totals()
+        self.assertEqual(len(totals), len(pairs))
+        self.assertEqual(
+            [totals[(user.id, counterparty.id if counterparty else None)] for user, counterparty in pairs],
+            [Decimal('3.50')] * 2 + [Decimal('2.50')] * (len(pairs) - 2)
+        )
+
+
+class SlowQueryLogTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        slow_queries.log.reset()
+        self.addCleanup(slow_queries.log.reset)
+        patcher = mock.patch.object(slow_queries, 'logger')
+        self.logger = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fingerprint_normalizes_values(self):
+        self.assertEqual(
+            slow_queries.fingerprint(
+                """SELECT "t2"."id" FROM "t2" WHERE "t2"."name" = 'O''Brien'\n  AND "t2"."n" IN (1, 2, 3)"""
+                " AND x >= 12.5 AND y = %s AND z = $1"
+            ),
+            'SELECT "t2"."id" FROM "t2" WHERE "t2"."name" = ? AND "t2"."n" IN (...) AND x >= ? AND y = ? AND z = ?'
+        )
+        self.assertEqual(
+            slow_queries.fingerprint('SELECT * FROM t WHERE id IN (%s, %s)'),
+            slow_queries.fingerprint('SELECT * FROM t WHERE id IN (%s)')
+        )
+        self.assertEqual(
+            slow_queries.fingerprint('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)'),
+            'INSERT INTO t (a, b) VALUES (...)'
+        )
+
+    def test_record_groups_by_fingerprint(self):
+        slow_queries.log.record('SELECT * FROM t WHERE id = 1', 0.3, 'GET /api/expenses/')
+        slow_queries.log.record('SELECT * FROM t WHERE id = 2', 0.5, 'GET /api/expenses/')
+        slow_queries.log.record('SELECT * FROM t WHERE id = 3', 0.2, 'job rebuild_rollups')
+        [entry] = slow_queries.log.top()
+        self.assertEqual(entry['fingerprint'], 'SELECT * FROM t WHERE id = ?')
+        self.assertEqual(entry['count'], 3)
+        self.assertAlmostEqual(entry['total'], 1.0)
+        self.assertAlmostEqual(entry['mean'], 1.0 / 3)
+        self.assertEqual(entry['max'], 0.5)
+        self.assertEqual(entry['sources'], {'GET /api/expenses/': 2, 'job rebuild_rollups': 1})
+        self.assertEqual(entry['slowest_source'], 'GET /api/expenses/')
+        self.assertTrue(any('tests.py' in frame for frame in entry['slowest_stack']))
+        self.assertEqual(self.logger.warning.call_count, 3)
+
+    def test_top_ordering(self):
+        slow_queries.log.record('SELECT 1 FROM a', 0.9, 'a')
+        for _ in range(3):
+            slow_queries.log.record('SELECT 1 FROM b', 0.4, 'b')
+        fingerprints = lambda order: [entry['fingerprint'] for entry in slow_queries.log.top(order=order)]
+        self.assertEqual(fingerprints('total'), ['SELECT ? FROM b', 'SELECT ? FROM a'])
+        self.assertEqual(fingerprints('count'), ['SELECT ? FROM b', 'SELECT ? FROM a'])
+        self.assertEqual(fingerprints('max'), ['SELECT ? FROM a', 'SELECT ? FROM b'])
+        self.assertEqual(fingerprints('mean'), ['SELECT ? FROM a', 'SELECT ? FROM b'])
+        self.assertEqual(len(slow_queries.log.top(limit=1)), 1)
+
+    @override_settings(SLOW_QUERIES={'MAX_FINGERPRINTS': 2})
+    def test_full_log_drops_new_fingerprints(self):
+        slow_queries.log.record('SELECT 1 FROM a', 0.3, 'a')
+        slow_queries.log.record('SELECT 1 FROM b', 0.3, 'b')
+        slow_queries.log.record('SELECT 1 FROM c', 0.3, 'c')
+        # Known fingerprints still count once the log is full
+        slow_queries.log.record('SELECT 2 FROM a', 0.3, 'a')
+        self.assertEqual(slow_queries.log.dropped, 1)
+        self.assertEqual(
+            {entry['fingerprint']: entry['count'] for entry in slow_queries.log.top()},
+            {'SELECT ? FROM a': 2, 'SELECT ? FROM b': 1}
+        )
+
+    # The admin templates need collected static files with the manifest storage
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_admin_page_is_staff_only(self):
+        slow_queries.log.record("SELECT * FROM expenses_expense WHERE title = 'x'", 0.3, 'GET /api/expenses/')
+        response = self.client.get('/admin/slow-queries/')
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get('/admin/slow-queries/').status_code, 302)
+
+        self.client.force_login(User.objects.create(username='ops', is_staff=True))
+        response = self.client.get('/admin/slow-queries/', {'o': 'bogus'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['order'], 'total')
+        self.assertContains(response, 'SELECT * FROM expenses_expense WHERE title = ?')
+        self.assertContains(response, 'GET /api/expenses/ (1)')
+
+        response = self.client.post('/admin/slow-queries/')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(slow_queries.log.top(), [])
+        self.assertContains(self.client.get('/admin/slow-queries/'), 'No slow queries recorded.')
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+
+    def test_unknown_methods_share_one_series(self):
+        client = self.client_for(self.alice)
+        client.get('/api/expenses/')
+        for method in ('BREW', 'PROPFIND', 'X-' + 'A' * 100):
+            client.generic(method, '/api/expenses/')
+        requests, _ = metrics.registry.snapshot()
+        self.assertEqual(
+            sorted((method, count) for (route, method, status), count in requests.items()),
+            [('GET', 1), ('other', 3)]
+        )
+        self.client.force_login(User.objects.create(username='ops', is_staff=True))
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('method="other",status="405"} 3', response.content.decode())
+        self.assertNotIn('BREW', response.content.decode())
+
+    def test_only_staff_without_a_token(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+        self.client.force_login(User.objects.create(username='ops', is_staff=True))
+        self.assertEqual(self.client.get('/api/metrics').status_code, 200)
+
+    @override_settings(METRICS={'TOKEN': 'scrape-secret'})
+    def test_token_required_when_configured(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+        response = self.client.get('/api/metrics', HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get('/api/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class IdempotencyTests(APITestCase):
+    def post(self, user, url, data, key='retry-1'):
+        return self.client_for(user).post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retries_replay_the_first_response(self):
+        payload = self.expense_payload([self.bob])
+        first = self.post(self.alice, '/api/expenses/', payload)
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        retry = self.post(self.alice, '/api/expenses/', payload)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Expense.objects.count(), 1)
+        self.assertEqual(self.owed(self.bob, self.alice), Decimal('15.00'))
+
+    def test_payment_retries_settle_once(self):
+        self.create_expense(self.alice, [self.bob], '30.00')
+        payment = {'from_user_id': self.bob.id, 'to_user_id': self.alice.id, 'amount': '5.00'}
+        for _ in range(2):
+            self.assertEqual(self.post(self.bob, '/api/payments/', payment).status_code, 201)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(self.owed(self.bob, self.alice), Decimal('10.00'))
+
+    def test_reused_key_with_another_body_is_rejected(self):
+        self.post(self.alice, '/api/expenses/', self.expense_payload([self.bob]))
+        response = self.post(self.alice, '/api/expenses/', self.expense_payload([self.carol]))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Expense.objects.count(), 1)
+
+    def test_errors_are_not_stored(self):
+        invalid = dict(self.expense_payload([self.bob]), participants=[999])
+        self.assertEqual(self.post(self.alice, '/api/expenses/', invalid).status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        # The corrected retry runs instead of replaying the error
+        response = self.post(self.alice, '/api/expenses/', self.expense_payload([self.bob]))
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_keys_are_per_user_and_expire(self):
+        self.post(self.alice, '/api/expenses/', self.expense_payload([self.bob]))
+        self.assertNotIn(
+            'Idempotent-Replayed', self.post(self.bob, '/api/expenses/', self.expense_payload([self.alice]))
+        )
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        response = self.post(self.alice, '/api/expenses/', self.expense_payload([self.bob]))
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Expense.objects.count(), 3)
+
+    def test_key_length_is_checked(self):
+        response = self.post(self.alice, '/api/expenses/', self.expense_payload([self.bob]), key='k' * 256)
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchBalanceTests(APITestCase):
+    FIELDS = ('total_balance', 'total_due_to_user', 'total_user_owes')
+
+    def amounts(self, data):
+        # The single-friend endpoint renders plain numbers, the batch one strings
+        return {field: Decimal(str(data[field])) for field in self.FIELDS}
+
+    def test_batch_matches_single_friend_endpoint(self):
+        dave, erin = self.make_users(2)
+        self.create_expense(self.alice, [self.bob, self.carol], '30.00')
+        self.create_expense(self.bob, [self.alice], '18.00')
+        self.create_expense(dave, [self.alice], '8.00')
+        self.pay(self.bob, self.alice, '2.50')
+        client = self.client_for(self.alice)
+
+        ids = [dave.id, self.bob.id, erin.id, self.carol.id]
+        response = client.get('/api/friends/balances/', {'ids': ','.join(map(str, ids))})
+        self.assertEqual(response.status_code, 200)
+        batch = response.json()
+        self.assertEqual(client.post('/api/friends/balances/', {'ids': ids}, format='json').json(), batch)
+        self.assertEqual([row['id'] for row in batch['balances']], [dave.id, self.bob.id, self.carol.id])
+        self.assertEqual(batch['unknown'], [erin.id])
+
+        for row in batch['balances']:
+            single = client.get(f"/api/friends/{row['id']}/balance/").json()
+            self.assertEqual(self.amounts(row), self.amounts(single))
+        self.assertEqual(
+            {row['id']: row['total_balance'] for row in batch['balances']},
+            {dave.id: '-4.00', self.bob.id: '-1.50', self.carol.id: '10.00'}
+        )
+
+    def test_rejects_bad_ids(self):
+        client = self.client_for(self.alice)
+        self.assertEqual(client.get('/api/friends/balances/', {'ids': '1,x'}).status_code, 400)
+        self.assertEqual(client.post('/api/friends/balances/', {'ids': '1'}, format='json').status_code, 400)
+
+
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.alice)
+        self.create_expense(self.alice, [self.bob, self.carol], '30.00', title='Pizza')
+        self.expense = self.create_expense(self.bob, [self.alice], '12.00', title='Taxi')
+        self.pay(self.bob, self.alice, '4.00')
+        self.factory = AsyncRequestFactory()
+
+    def sync_json(self, path, params=None):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        response = client.get(path, params)
+        return response.status_code, json.loads(response.content)
+
+    async def async_json(self, view, path, params=None, **kwargs):
+        request = self.factory.get(path, params, headers={'Authorization': f'Token {self.token.key}'})
+        response = await view(request, **kwargs)
+        return response.status_code, json.loads(response.content)
+
+    async def assertSameJSON(self, view, path, params=None, **kwargs):
+        expected = await sync_to_async(self.sync_json)(path, params)
+        self.assertEqual(expected[0], 200)
+        self.assertEqual(await self.async_json(view, path, params, **kwargs), expected)
+
+    async def test_reads_match_the_viewsets(self):
+        bob_id, expense_id = self.bob.id, self.expense['id']
+        await self.assertSameJSON(async_views.me, '/api/users/me/')
+        await self.assertSameJSON(async_views.overall_balance, '/api/friends/overall_balance/')
+        await self.assertSameJSON(async_views.balance, f'/api/friends/{bob_id}/balance/', pk=bob_id)
+        await self.assertSameJSON(async_views.expense_list, '/api/expenses/')
+        await self.assertSameJSON(async_views.expense_list, '/api/expenses/', {'q': 'pizza'})
+        await self.assertSameJSON(
+            async_views.expense_detail, f'/api/expenses/{expense_id}/', pk=expense_id
+        )
+        await self.assertSameJSON(
+            async_views.friend_expenses, '/api/expenses/friend_expenses/', {'friend_id': bob_id}
+        )
+
+    async def test_errors_match_the_viewsets(self):
+        status, data = await self.async_json(async_views.expense_detail, '/api/expenses/999/', pk=999)
+        self.assertEqual((status, data), await sync_to_async(self.sync_json)('/api/expenses/999/'))
+        status, _ = await self.async_json(async_views.balance, '/api/friends/999/balance/', pk=999)
+        self.assertEqual(status, 404)
+
+        request = self.factory.get('/api/users/me/', headers={'Authorization': 'Token nope'})
+        response = await async_views.me(request)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.content), {'detail': 'Invalid token.'})
+
+
+class StaticFilesMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        with open(os.path.join(static_root, 'app.css'), 'w') as f:
+            f.write('body {}')
+        settings_override = override_settings(STATIC_ROOT=static_root, WHITENOISE_AUTOREFRESH=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.factory = AsyncRequestFactory()
+
+    async def test_async_stack_serves_static_files(self):
+        async def get_response(request):
+            return HttpResponse('from the view')
+
+        middleware = StaticFilesMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(self.factory.get('/static/app.css'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'body {}')
+        response = await middleware(self.factory.get('/api/expenses/'))
+        self.assertEqual(response.content, b'from the view')
+
+    def test_sync_stack_is_plain_whitenoise(self):
+        middleware = StaticFilesMiddleware(lambda request: HttpResponse('from the view'))
+        self.assertFalse(iscoroutinefunction(middleware))
+        response = middleware(RequestFactory().get('/static/app.css'))
+        self.assertEqual(b''.join(response.streaming_content), b'body {}')
+        self.assertEqual(middleware(RequestFactory().get('/')).content, b'from the view')
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.expenses = [
+            self.create_expense(self.alice, [self.bob], title=f'Dinner {i}') for i in range(7)
+        ]
+        # Three rows share each timestamp, so only the id tells them apart
+        moments = [timezone.now() - timedelta(days=i // 3) for i in range(7)]
+        for expense, moment in zip(self.expenses, moments):
+            Expense.objects.filter(pk=expense['id']).update(created_at=moment)
+        self.client = self.client_for(self.bob)
+
+    def walk(self, url, params, direction='next'):
+        pages = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200, response.content)
+            data = response.json()
+            pages.append([row['id'] for row in data['results']])
+            if not data[direction]:
+                return pages, data
+            response = self.client.get(data[direction])
+
+    def expected_ids(self):
+        return list(Expense.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_walks_every_row_once_across_tied_timestamps(self):
+        pages, last = self.walk('/api/expenses/', {'page_size': 2})
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        self.assertEqual([row for page in pages for row in page], self.expected_ids())
+
+        # And back again from the last page
+        pages, first = self.walk(last['previous'], {}, direction='previous')
+        self.assertEqual([row for page in reversed(pages) for row in page], self.expected_ids()[:6])
+        self.assertIsNone(first['previous'])
+
+    def test_page_size_is_clamped(self):
+        self.assertEqual(len(self.client.get('/api/expenses/', {'page_size': 3}).json()['results']), 3)
+        for size in ('0', '-4', 'many'):
+            with self.subTest(size=size):
+                response = self.client.get('/api/expenses/', {'page_size': size})
+                self.assertEqual(len(response.json()['results']), 7)
+        with mock.patch.object(KeysetPagination, 'max_page_size', 4):
+            response = self.client.get('/api/expenses/', {'page_size': 1000})
+            self.assertEqual(len(response.json()['results']), 4)
+
+    @staticmethod
+    def encode(payload):
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    def test_invalid_cursors_are_not_found(self):
+        encode = self.encode
+        for cursor in (
+            'not base64!', 'é', encode([1, 2]), encode({'r': 1}), encode({'p': 'x'}),
+            encode({'p': [1]}), encode({'p': ['yesterday', 1]}), encode({'p': [None, 'x']}),
+            encode({'p': [{'a': 1}, 1]}),
+        ):
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/api/expenses/', {'cursor': cursor})
+                self.assertEqual(response.status_code, 404, response.content)
+                self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+    def test_search_rank_cursor(self):
+        Expense.objects.filter(pk=self.expenses[2]['id']).update(title='Dinner dinner special')
+        search.index_expenses([self.expenses[2]['id']])
+        pages, _ = self.walk('/api/expenses/', {'q': 'dinner', 'page_size': 3})
+        ids = [row for page in pages for row in page]
+        self.assertEqual(sorted(ids), sorted(expense['id'] for expense in self.expenses))
+        self.assertEqual(ids[0], self.expenses[2]['id'])
+        response = self.client.get('/api/expenses/', {'q': 'dinner', 'cursor': self.encode({'p': ['high', 1]})})
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(APITestCase):
+    def export(self, user, path, export_format):
+        response = self.client_for(user).get(path, {'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv(self):
+        expense = self.create_expense(self.alice, [self.bob], '30.00', title='Dinner, with "quotes"')
+        self.create_expense(self.carol, [self.alice], '10.00')
+        response, body = self.export(self.bob, '/api/expenses/export/', 'csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="expenses.csv"')
+        rows = list(csv.reader(StringIO(body)))
+        self.assertEqual(rows[0], [field.replace('__', '_') for field in exports.EXPENSE_FIELDS])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][:4], [str(expense['id']), 'Dinner, with "quotes"', '', '30.00'])
+
+    def test_ndjson(self):
+        self.create_expense(self.alice, [self.bob], '30.00')
+        payment = self.pay(self.bob, self.alice, '5.00')
+        response, body = self.export(self.alice, '/api/payments/export/', 'ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="payments.ndjson"')
+        [row] = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(
+            {key: row[key] for key in ('id', 'from_user_id', 'from_user_username', 'to_user_id', 'amount')},
+            {'id': payment['id'], 'from_user_id': self.bob.id, 'from_user_username': 'bob',
+             'to_user_id': self.alice.id, 'amount': '5.00'}
+        )
+
+    def test_users_only_export_their_own_rows(self):
+        self.create_expense(self.alice, [self.bob], '30.00')
+        self.create_expense(self.bob, [self.carol], '30.00')
+        self.pay(self.bob, self.alice, '5.00')
+        for path, alice_rows, carol_rows in (
+            ('/api/expenses/export/', 1, 1),
+            ('/api/expense-shares/export/', 1, 1),
+            ('/api/payments/export/', 1, 0),
+        ):
+            with self.subTest(path=path):
+                self.assertEqual(len(self.export(self.alice, path, 'ndjson')[1].splitlines()), alice_rows)
+                self.assertEqual(len(self.export(self.carol, path, 'ndjson')[1].splitlines()), carol_rows)
+
+    async def test_asgi_exports_stream_asynchronously(self):
+        await sync_to_async(self.create_expense)(self.alice, [self.bob], '30.00')
+        token = await Token.objects.acreate(user=self.bob)
+        with mock.patch.object(exports, 'EXPORT_CHUNK_SIZE', 1):
+            response = await AsyncClient().get(
+                '/api/expenses/export/', {'format': 'csv'}, headers={'Authorization': f'Token {token.key}'}
+            )
+            self.assertEqual(response.status_code, 200)
+            # Sync iterators would be read into memory by the ASGI handler
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 2)
+        _, expected = await sync_to_async(self.export)(self.bob, '/api/expenses/export/', 'csv')
+        self.assertEqual(b''.join(chunks).decode('utf-8'), expected)
+
+    def test_queries_do_not_grow_with_rows(self):
+        def queries(path):
+            with CaptureQueriesContext(connection) as context:
+                self.export(self.alice, path, 'csv')
+            return len(context)
+
+        self.create_expense(self.alice, [self.bob], '30.00')
+        self.pay(self.bob, self.alice, '1.00')
+        paths = ('/api/expenses/export/', '/api/expense-shares/export/', '/api/payments/export/')
+        before = [queries(path) for path in paths]
+        for _ in range(10):
+            self.create_expense(self.alice, [self.bob, self.carol], '30.00')
+            self.pay(self.bob, self.alice, '1.00')
+        self.assertEqual([queries(path) for path in paths], before)
+
+
+class FriendListTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.dave, self.erin = self.make_users(2)
+        # Balances against alice: bob -10, carol +5, dave +5, erin 0
+        self.create_expense(self.bob, [self.alice], '20.00')
+        self.create_expense(self.alice, [self.carol], '10.00')
+        self.create_expense(self.alice, [self.dave], '10.00')
+        self.create_expense(self.alice, [self.erin], '10.00')
+        self.pay(self.erin, self.alice, '5.00')
+        self.client = self.client_for(self.alice)
+
+    def walk(self, params):
+        rows = []
+        response = self.client.get('/api/friends/', params)
+        while True:
+            self.assertEqual(response.status_code, 200, response.content)
+            rows += [(row['id'], row['total_balance']) for row in response.json()['results']]
+            if not response.json()['next']:
+                return rows
+            response = self.client.get(response.json()['next'])
+
+    def test_ordering_by_balance_pages_through_ties(self):
+        self.assertEqual(self.walk({'ordering': 'total_balance', 'page_size': 1}), [
+            (self.bob.id, '-10.00'), (self.erin.id, '0.00'),
+            (self.carol.id, '5.00'), (self.dave.id, '5.00'),
+        ])
+        self.assertEqual(self.walk({'ordering': '-total_balance', 'page_size': 2}), [
+            (self.dave.id, '5.00'), (self.carol.id, '5.00'),
+            (self.erin.id, '0.00'), (self.bob.id, '-10.00'),
+        ])
+        # Anything else falls back to id order
+        self.assertEqual(
+            [user_id for user_id, _ in self.walk({'ordering': 'username'})],
+            sorted([self.bob.id, self.carol.id, self.dave.id, self.erin.id])
+        )
+
+    def test_balance_filters(self):
+        for balance, friends in (
+            ('owed', {self.carol, self.dave}),
+            ('owing', {self.bob}),
+            ('settled', {self.erin}),
+            ('open', {self.bob, self.carol, self.dave}),
+        ):
+            with self.subTest(balance=balance):
+                ids = {user_id for user_id, _ in self.walk({'balance': balance})}
+                self.assertEqual(ids, {friend.id for friend in friends})
+
+    def test_friends_are_read_only(self):
+        self.assertEqual(self.client.get(f'/api/friends/{self.bob.id}/').json()['total_balance'], '-10.00')
+        self.assertEqual(self.client.get(f'/api/friends/{self.alice.id}/').status_code, 404)
+        self.assertEqual(self.client.post('/api/friends/', {}, format='json').status_code, 405)
+        for method in ('put', 'patch', 'delete'):
+            with self.subTest(method=method):
+                response = getattr(self.client, method)(f'/api/friends/{self.bob.id}/', {}, format='json')
+                self.assertEqual(response.status_code, 405)
+
+
+class CompactSharesMigrationTests(TransactionTestCase):
+    before = [('expenses', '0005_friendship_graph')]
+    after = [('expenses', '0006_compact_shares')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_duplicate_rows_are_merged_without_losing_money(self):
+        apps = self.migrate(self.before)
+        User = apps.get_model('auth', 'User')
+        Expense = apps.get_model('expenses', 'Expense')
+        ExpenseShare = apps.get_model('expenses', 'ExpenseShare')
+        BalanceLedger = apps.get_model('expenses', 'BalanceLedger')
+        alice = User.objects.create(username='alice')
+        bob = User.objects.create(username='bob')
+        carol = User.objects.create(username='carol')
+        expense = Expense.objects.create(title='Dinner', total_amount='45.00', created_by=alice)
+        # bob: two open rows; carol: a settled part and an open remainder,
+        # plus alice's mirrored payer row
+        for participant, amount, settled in (
+            (bob, '10.00', False), (bob, '10.00', False),
+            (carol, '6.00', True), (carol, '9.00', False),
+        ):
+            ExpenseShare.objects.create(
+                expense=expense, participant=participant, amount=amount, settled=settled
+            )
+        ExpenseShare.objects.create(expense=expense, participant=alice, amount='10.00', paid_by=True)
+        BalanceLedger.objects.create(debtor=bob, creditor=alice, amount='20.00')
+        BalanceLedger.objects.create(debtor=carol, creditor=alice, amount='9.00')
+
+        apps = self.migrate(self.after)
+        ExpenseShare = apps.get_model('expenses', 'ExpenseShare')
+        BalanceLedger = apps.get_model('expenses', 'BalanceLedger')
+        shares = {
+            share.participant_id: share for share in ExpenseShare.objects.filter(expense_id=expense.id)
+        }
+        self.assertEqual(set(shares), {bob.id, carol.id})
+        for user, amount, settled_amount in ((bob, '20.00', '0.00'), (carol, '15.00', '6.00')):
+            share = shares[user.id]
+            self.assertEqual((share.amount, share.settled_amount, share.settled),
+                             (Decimal(amount), Decimal(settled_amount), False))
+            ledger_amount = BalanceLedger.objects.get(debtor_id=user.id, creditor_id=alice.id).amount
+            self.assertEqual(share.amount - share.settled_amount, ledger_amount)
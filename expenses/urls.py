@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from . import views
@@ -10,10 +11,31 @@ router.register(r'expenses', views.ExpenseViewSet)
 router.register(r'expense-items', views.ExpenseItemViewSet)
 router.register(r'expense-shares', views.ExpenseShareViewSet)
 router.register(r'payments', views.PaymentViewSet)
+router.register(r'analytics', views.AnalyticsViewSet, basename='analytics')
+router.register(r'jobs', views.JobViewSet, basename='job')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('auth/register/', auth.register_user, name='register'),
     path('auth/login/', auth.login_user, name='login'),
     path('auth/logout/', auth.logout_user, name='logout'),
-]
\ No newline at end of file
+    path('metrics', views.metrics_view, name='metrics'),
+]
+
+if settings.ASYNC_READS:
+    from . import async_views
+
+    def read_path(route, name, async_view):
+        """GETs for the router URL `name` go to `async_view`, other methods to the viewset"""
+        sync_view = next(pattern.callback for pattern in router.urls if pattern.name == name)
+        return path(route, async_views.reads(async_view, sync_view), name=name)
+
+    # Ahead of the router, so these paths resolve to the async views
+    urlpatterns = [
+        read_path('users/me/', 'user-me', async_views.me),
+        read_path('friends/overall_balance/', 'friend-overall-balance', async_views.overall_balance),
+        read_path('friends/<int:pk>/balance/', 'friend-balance', async_views.balance),
+        read_path('expenses/', 'expense-list', async_views.expense_list),
+        read_path('expenses/friend_expenses/', 'expense-friend-expenses', async_views.friend_expenses),
+        read_path('expenses/<int:pk>/', 'expense-detail', async_views.expense_detail),
+    ] + urlpatterns
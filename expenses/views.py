@@ -1,37 +1,92 @@
+import os
+from datetime import datetime
 from decimal import Decimal
-from rest_framework import viewsets, status, permissions
+from rest_framework import viewsets, status, permissions, mixins
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Sum, Q, F
-from .models import Friend, Expense, ExpenseItem, ExpenseShare, Payment
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import FileResponse, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.db.models import Q, Prefetch
+from .models import (
+    Friend, Expense, ExpenseItem, ExpenseShare, Payment, BalanceLedger,
+    ExpenseParticipant, Friendship, Job
+)
+from . import ledger, exports, graph, jobs, metrics, rollups, search, simplify, tasks
+from .idempotency import idempotent
+from .response_cache import (
+    cached_per_user, conditional_per_user, invalidate_users, expense_user_ids
+)
 from .serializers import (
-    UserSerializer, FriendSerializer, ExpenseSerializer,
-    ExpenseItemSerializer, ExpenseShareSerializer, PaymentSerializer
+    UserSerializer, FriendBalanceSerializer, ExpenseSerializer,
+    ExpenseItemSerializer, ExpenseShareSerializer, PaymentSerializer, JobSerializer
 )
 import logging
 logger = logging.getLogger(__name__)
 
+def metrics_view(request):
+    """Request metrics of this process in Prometheus text format.
+
+    Scrapes must send the configured bearer token; with no token configured
+    only logged in staff can read them.
+    """
+    token = getattr(settings, 'METRICS', {}).get('TOKEN')
+    if token:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('id',)
     
     @action(detail=False, methods=['get'])
     def me(self, request):
         serializer = self.get_serializer(request.user)
         return Response(serializer.data)
 
-class FriendViewSet(viewsets.ModelViewSet):
-    serializer_class = FriendSerializer
+class FriendViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = FriendBalanceSerializer
     permission_classes = [permissions.IsAuthenticated]
+    balance_fields = ('total_balance', 'total_due_to_user', 'total_user_owes')
+    balances_limit = 1000
+    balance_filters = {
+        'owed': Q(total_balance__gt=0),
+        'owing': Q(total_balance__lt=0),
+        'settled': Q(total_balance=0),
+        'open': ~Q(total_balance=0),
+    }
+    
+    @property
+    def keyset_ordering(self):
+        # ?ordering=total_balance / -total_due_to_user / ..., ties broken by id
+        ordering = self.request.query_params.get('ordering', '')
+        if ordering.lstrip('-') in self.balance_fields:
+            direction = '-' if ordering.startswith('-') else ''
+            return (ordering, direction + 'id')
+        return ('id',)
     
     def get_queryset(self):
-        # Only return users who have shared expenses with the current user
-        return User.objects.filter(
-            Q(expenses__shares__participant=self.request.user) |
-            Q(expense_shares__expense__created_by=self.request.user)
-        ).distinct().exclude(id=self.request.user.id)
+        # Only return users who have shared expenses with the current user,
+        # with their balances against the current user
+        friends = ledger.annotate_balances(
+            User.objects.filter(
+                id__in=Friendship.objects.filter(user=self.request.user).values('friend')
+            ),
+            self.request.user
+        )
+        balance = self.request.query_params.get('balance')
+        if balance in self.balance_filters:
+            friends = friends.filter(self.balance_filters[balance])
+        return friends
     
     @action(detail=True, methods=['get'])
     def balance(self, request, pk=None):
@@ -39,21 +94,20 @@ class FriendViewSet(viewsets.ModelViewSet):
             friend = User.objects.get(pk=pk)
             current_user = request.user
             
-            # Calculate what friend owes to current user
-            due_to_user = ExpenseShare.objects.filter(
-                expense__created_by=current_user,
-                participant=friend,
-                paid_by=False,
-                settled=False
-            ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+            # Both directions of the pair live in at most two ledger rows
+            amounts = {
+                (row.debtor_id, row.creditor_id): row.amount
+                for row in BalanceLedger.objects.filter(
+                    Q(debtor=friend, creditor=current_user) |
+                    Q(debtor=current_user, creditor=friend)
+                )
+            }
+            
+            # What friend owes to current user
+            due_to_user = amounts.get((friend.id, current_user.id), Decimal('0.00'))
             
-            # Calculate what current user owes to friend
-            user_owes = ExpenseShare.objects.filter(
-                expense__created_by=friend,
-                participant=current_user,
-                paid_by=False,
-                settled=False
-            ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+            # What current user owes to friend
+            user_owes = amounts.get((current_user.id, friend.id), Decimal('0.00'))
             
             data = {
                 'total_balance': due_to_user - user_owes,
@@ -73,80 +127,287 @@ class FriendViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['get', 'post'])
+    def balances(self, request):
+        """Pairwise balances with many friends in one query.
+
+        Pass `?ids=1,2,3`, or POST `{"ids": [1, 2, 3]}` for long lists.
+        Balances come back in the order asked for; ids that are not among
+        the user's friends are listed under `unknown` instead.
+        """
+        if request.method == 'POST':
+            ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        else:
+            ids = [user_id for user_id in request.query_params.get('ids', '').split(',') if user_id.strip()]
+        try:
+            if not isinstance(ids, list):
+                raise TypeError
+            ids = list(dict.fromkeys(int(user_id) for user_id in ids))
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "ids must be a list of user ids"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(ids) > self.balances_limit:
+            return Response(
+                {"error": f"At most {self.balances_limit} ids per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        friends = {
+            friend.id: friend
+            for friend in ledger.annotate_balances(
+                User.objects.filter(
+                    id__in=Friendship.objects.filter(user=request.user, friend_id__in=ids).values('friend')
+                ),
+                request.user
+            )
+        } if ids else {}
+        return Response({
+            'balances': self.get_serializer([friends[user_id] for user_id in ids if user_id in friends], many=True).data,
+            'unknown': [user_id for user_id in ids if user_id not in friends],
+        })
+
     @action(detail=False, methods=['get'])
+    @cached_per_user('overall-balance')
     def overall_balance(self, request):
-        user = request.user
-        # Total amount others owe the user
-        due_to_user = ExpenseShare.objects.filter(
-            expense__created_by=user,
-            paid_by=False,
-            settled=False
-        ).exclude(
-            participant=user
-        ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-        
-        # Total amount the user owes others
-        user_owes = ExpenseShare.objects.filter(
-            participant=user,
-            paid_by=False,
-            settled=False
-        ).exclude(
-            expense__created_by=user
-        ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-        
-        # Friends who owe the user
-        friends_owing_user = ExpenseShare.objects.filter(
-            expense__created_by=user,
-            paid_by=False,
-            settled=False
-        ).exclude(
-            participant=user
-        ).values('participant').annotate(
-            total=Sum('amount'),
-            username=F('participant__username')
-        )
-        
-        # Friends the user owes
-        user_owing_friends = ExpenseShare.objects.filter(
-            participant=user,
-            paid_by=False,
-            settled=False
-        ).exclude(
-            expense__created_by=user
-        ).values('expense__created_by').annotate(
-            total=Sum('amount'),
-            username=F('expense__created_by__username')
-        )
+        rows = self.overall_balance_rows(request.user)
+        return Response(self.overall_balance_data(request.user, rows))
+    
+    @staticmethod
+    def overall_balance_rows(user):
+        """The user's open ledger rows, with both users loaded"""
+        return BalanceLedger.objects.filter(
+            Q(debtor=user) | Q(creditor=user),
+            amount__gt=0
+        ).select_related('debtor', 'creditor')
+    
+    @staticmethod
+    def overall_balance_data(user, rows):
+        due_to_user = Decimal('0.00')
+        user_owes = Decimal('0.00')
+        friends_owing_user = []
+        user_owing_friends = []
+        for row in rows:
+            if row.creditor_id == user.id:
+                # Friend owes the user
+                due_to_user += row.amount
+                friends_owing_user.append({
+                    'participant': row.debtor_id,
+                    'total': row.amount,
+                    'username': row.debtor.username,
+                })
+            else:
+                # User owes the friend
+                user_owes += row.amount
+                user_owing_friends.append({
+                    'expense__created_by': row.creditor_id,
+                    'total': row.amount,
+                    'username': row.creditor.username,
+                })
         
-        data = {
+        return {
             'total_balance': due_to_user - user_owes,
             'total_due_to_user': due_to_user,
             'total_user_owes': user_owes,
-            'friends_owing_user': list(friends_owing_user),
-            'user_owing_friends': list(user_owing_friends),
+            'friends_owing_user': friends_owing_user,
+            'user_owing_friends': user_owing_friends,
         }
-        return Response(data)
+    
+    @action(detail=False, methods=['get'])
+    def simplify(self, request):
+        """Suggest the fewest payments that clear the user's open balances.
+
+        Pass `user_ids=1,2,3` to simplify a group of the user's friends
+        instead; ids that are not among them are listed under `unknown`.
+        Each entry can be posted to the payments endpoint as-is, and is
+        settled along the chain of debts it stands for.
+        """
+        user_ids = request.query_params.get('user_ids')
+        if not user_ids:
+            return Response({'payments': simplify.suggested_payments(request.user)})
+        try:
+            user_ids = list(dict.fromkeys(
+                int(user_id) for user_id in user_ids.split(',') if user_id.strip()
+            ))
+        except ValueError:
+            return Response(
+                {"error": "user_ids must be a comma-separated list of ids"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        friend_ids = set(Friendship.objects.filter(
+            user=request.user, friend_id__in=user_ids
+        ).values_list('friend_id', flat=True))
+        return Response({
+            'payments': simplify.suggested_payments(request.user, friend_ids),
+            'unknown': [
+                user_id for user_id in user_ids
+                if user_id not in friend_ids and user_id != request.user.id
+            ],
+        })
 
 class ExpenseViewSet(viewsets.ModelViewSet):
     queryset = Expense.objects.all()
     serializer_class = ExpenseSerializer
     permission_classes = [permissions.IsAuthenticated]
+    bulk_limit = 500
+    background_bulk_limit = 10000
+    
+    @property
+    def search_text(self):
+        if self.action != 'list':
+            return ''
+        return self.request.query_params.get('q', '').strip()
+    
+    @property
+    def keyset_ordering(self):
+        return self.list_ordering(self.search_text)
+    
+    @staticmethod
+    def list_ordering(search_text):
+        # ?q= results come best match first, ties broken by id
+        if search_text:
+            return ('-search_rank', '-id')
+        return ('-created_at', '-id')
+    
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
     
     def perform_create(self, serializer):
         logger.debug("Incoming expense creation request data: %s", self.request.data)
-        serializer.save(created_by=self.request.user)
+        expense = serializer.save(created_by=self.request.user)
+        serializer.instance = self.reload([expense])[0]
+    
+    @conditional_per_user('expense-list')
+    @cached_per_user('expense-list')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous = Expense.objects.get(pk=serializer.instance.pk)
+        expense = serializer.save()
+        rollups.replace_expense(previous, expense)
+        search.index_expenses([expense.id])
+        invalidate_users(expense_user_ids(expense))
+    
+    @action(detail=False, methods=['post'])
+    @idempotent
+    def bulk(self, request):
+        """Create many expenses in one request.
+
+        Accepts a list of expense payloads. If any of them is invalid nothing
+        is written and the response lists the errors per expense, in order.
+        With `?background=1` the import is queued as a job instead and the
+        response is 202 with the job and its status URL.
+        """
+        if not isinstance(request.data, list):
+            return Response(
+                {"error": "Expected a list of expenses"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if request.query_params.get('background'):
+            if len(request.data) > self.background_bulk_limit:
+                return Response(
+                    {"error": f"At most {self.background_bulk_limit} expenses per background import"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            job = jobs.enqueue('import_expenses', {'expenses': request.data}, user=request.user)
+            return Response(
+                JobSerializer(job, context={'request': request}).data,
+                status=status.HTTP_202_ACCEPTED
+            )
+        if len(request.data) > self.bulk_limit:
+            return Response(
+                {"error": f"At most {self.bulk_limit} expenses per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = self.get_serializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(
+                {"errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        expenses = serializer.save(created_by=request.user)
+        serializer.instance = self.reload(expenses)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get'], renderer_classes=exports.EXPORT_RENDERERS)
+    def export(self, request):
+        return exports.export_response(
+            exports.expense_rows(request.user),
+            exports.EXPENSE_FIELDS,
+            request.accepted_renderer.format,
+            'expenses',
+            request
+        )
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # Shares go with the expense, so take them out of the balances first
+        shares = list(instance.shares.all())
+        ledger.remove_shares(shares, instance.created_by_id)
+        rollups.remove_expense(instance, shares)
+        search.remove_expenses([instance.id])
+        invalidate_users(expense_user_ids(instance))
+        expense_id = instance.id
+        instance.delete()
+        graph.remove_participants(
+            expense_id,
+            instance.created_by_id,
+            {share.participant_id for share in shares} | {instance.created_by_id}
+        )
     
     def get_queryset(self):
-        user = self.request.user
+        return self.with_related(self.visible_to(self.request.user))
+    
+    @staticmethod
+    def visible_to(user):
+        """Expenses the user created or takes part in"""
+        return Expense.objects.filter(
+            id__in=ExpenseParticipant.objects.filter(user=user).values('expense')
+        )
+    
+    @staticmethod
+    def between(user, friend_id):
+        """Expenses where one of the two created it and the other takes part"""
         return Expense.objects.filter(
-            Q(created_by=user) | Q(shares__participant=user)
-        ).distinct()
+            id__in=ExpenseParticipant.objects.filter(
+                Q(user=user, creator_id=friend_id) |
+                Q(user_id=friend_id, creator=user)
+            ).values('expense')
+        )
+    
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.search_text:
+            queryset = search.search(queryset, self.search_text)
+        return queryset
+    
+    @staticmethod
+    def with_related(queryset):
+        """Load everything ExpenseSerializer renders in a fixed number of queries"""
+        return queryset.select_related('created_by').prefetch_related(
+            Prefetch('items', queryset=ExpenseItem.objects.select_related('assigned_to')),
+            Prefetch('shares', queryset=ExpenseShare.objects.select_related('participant')),
+        )
+    
+    def reload(self, expenses):
+        """Just-created expenses, fetched again with everything the response
+        renders so serializing them does not query per share or item"""
+        return list(self.with_related(
+            Expense.objects.filter(pk__in=[expense.pk for expense in expenses])
+        ).order_by('id'))
     
     @action(detail=False, methods=['get'])
     def my_expenses(self, request):
-        expenses = Expense.objects.filter(created_by=request.user)
-        serializer = self.get_serializer(expenses, many=True)
-        return Response(serializer.data)
+        expenses = self.with_related(Expense.objects.filter(created_by=request.user))
+        page = self.paginate_queryset(expenses)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def friend_expenses(self, request):
@@ -159,17 +420,11 @@ class ExpenseViewSet(viewsets.ModelViewSet):
         
         try:
             friend = User.objects.get(pk=friend_id)
-            # Get expenses where both users are participants
-            expenses = Expense.objects.filter(
-                (Q(created_by=friend) & Q(shares__participant=request.user)) |
-                (Q(created_by=request.user) & Q(shares__participant=friend))
-            ).distinct()
+            expenses = self.with_related(self.between(request.user, friend.id))
             
-            if not expenses.exists():
-                return Response([])
-                
-            serializer = self.get_serializer(expenses, many=True)
-            return Response(serializer.data)
+            page = self.paginate_queryset(expenses)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         except User.DoesNotExist:
             return Response(
                 {"error": "Friend not found"}, 
@@ -177,25 +432,83 @@ class ExpenseViewSet(viewsets.ModelViewSet):
             )
 
 class ExpenseItemViewSet(viewsets.ModelViewSet):
-    queryset = ExpenseItem.objects.all()
+    queryset = ExpenseItem.objects.select_related('assigned_to')
     serializer_class = ExpenseItemSerializer
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('-id',)
+    
+    @transaction.atomic
+    def perform_update(self, serializer):
+        item = serializer.save()
+        search.index_expenses([item.expense_id])
+        invalidate_users(expense_user_ids(item.expense))
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        invalidate_users(expense_user_ids(instance.expense))
+        instance.delete()
+        search.index_expenses([instance.expense_id])
 
 class ExpenseShareViewSet(viewsets.ModelViewSet):
     queryset = ExpenseShare.objects.all()
     serializer_class = ExpenseShareSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Shares carry no timestamp; ids grow with creation order
+    keyset_ordering = ('-id',)
     
     def get_queryset(self):
         user = self.request.user
         return ExpenseShare.objects.filter(
             Q(participant=user) | Q(expense__created_by=user)
+        ).select_related('participant')
+    
+    @conditional_per_user('expense-share-list')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @action(detail=False, methods=['get'], renderer_classes=exports.EXPORT_RENDERERS)
+    def export(self, request):
+        return exports.export_response(
+            exports.share_rows(request.user),
+            exports.SHARE_FIELDS,
+            request.accepted_renderer.format,
+            'expense-shares',
+            request
+        )
+    
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous = ExpenseShare.objects.select_related('expense').get(pk=serializer.instance.pk)
+        share = serializer.save()
+        ledger.replace_share(previous, share)
+        rollups.replace_share(previous, share)
+        if share.participant_id != previous.participant_id:
+            share.expense = previous.expense
+            graph.index_expenses([], [share])
+            graph.remove_participants(
+                previous.expense_id, previous.expense.created_by_id, [previous.participant_id]
+            )
+        invalidate_users(expense_user_ids(previous.expense) | {previous.participant_id})
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        ledger.remove_shares([instance])
+        rollups.remove_shares([instance])
+        invalidate_users(expense_user_ids(instance.expense))
+        instance.delete()
+        graph.remove_participants(
+            instance.expense_id, instance.expense.created_by_id, [instance.participant_id]
         )
 
 class PaymentViewSet(viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('-created_at', '-id')
+    
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
     
     def perform_create(self, serializer):
         serializer.save(from_user=self.request.user)
@@ -204,4 +517,117 @@ class PaymentViewSet(viewsets.ModelViewSet):
         user = self.request.user
         return Payment.objects.filter(
             Q(from_user=user) | Q(to_user=user)
-        )
\ No newline at end of file
+        ).select_related('from_user', 'to_user')
+    
+    @conditional_per_user('payment-list')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous = Payment.objects.get(pk=serializer.instance.pk)
+        payment = serializer.save()
+        rollups.replace_payment(previous, payment)
+        invalidate_users([
+            previous.from_user_id, previous.to_user_id,
+            payment.from_user_id, payment.to_user_id
+        ])
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        rollups.remove_payments([instance])
+        invalidate_users([instance.from_user_id, instance.to_user_id])
+        instance.delete()
+    
+    @action(detail=False, methods=['get'], renderer_classes=exports.EXPORT_RENDERERS)
+    def export(self, request):
+        return exports.export_response(
+            exports.payment_rows(request.user),
+            exports.PAYMENT_FIELDS,
+            request.accepted_renderer.format,
+            'payments',
+            request
+        )
+
+class AnalyticsViewSet(viewsets.ViewSet):
+    permission_classes = [permissions.IsAuthenticated]
+    
+    @staticmethod
+    def _month(value):
+        # YYYY-MM -> first day of that month
+        return datetime.strptime(value, '%Y-%m').date()
+    
+    @action(detail=False, methods=['get'])
+    @cached_per_user('monthly-analytics')
+    def monthly(self, request):
+        """Paid, owed, settled and received totals per month.
+
+        Served from the monthly rollup table, so the cost depends on the
+        number of months, not on expense history. Filter with
+        `counterparty=<user id>`, `from=YYYY-MM` and `to=YYYY-MM`.
+        """
+        params = request.query_params
+        try:
+            start = self._month(params['from']) if params.get('from') else None
+            end = self._month(params['to']) if params.get('to') else None
+        except ValueError:
+            return Response(
+                {"error": "from and to must be months as YYYY-MM"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        counterparty_id = params.get('counterparty')
+        if counterparty_id is not None:
+            try:
+                counterparty_id = int(counterparty_id)
+            except ValueError:
+                return Response(
+                    {"error": "counterparty must be a user id"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        months = [
+            dict(row, month=row['month'].strftime('%Y-%m'))
+            for row in rollups.monthly(request.user, counterparty_id, start, end)
+        ]
+        return Response({'counterparty': counterparty_id, 'months': months})
+
+class JobViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """Background jobs started by the current user.
+
+    POST `{"kind": "export", "payload": {"dataset": "payments", "format": "csv"}}`
+    to queue one; the response is 202 with a status URL to poll. Finished
+    exports are fetched from the `download` action.
+    """
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('-created_at', '-id')
+    
+    def get_queryset(self):
+        return Job.objects.filter(created_by=self.request.user)
+    
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        kind = serializer.validated_data['kind']
+        allowed = jobs.HANDLERS if request.user.is_staff else tasks.USER_KINDS
+        if kind not in allowed:
+            return Response(
+                {"kind": f"Unknown or not permitted job kind: {kind}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        job = jobs.enqueue(kind, serializer.validated_data.get('payload'), user=request.user)
+        return Response(
+            self.get_serializer(job).data,
+            status=status.HTTP_202_ACCEPTED
+        )
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        name = (job.result or {}).get('file') if job.status == Job.SUCCEEDED else None
+        if not name or not default_storage.exists(name):
+            return Response(
+                {"error": "No file for this job"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return FileResponse(default_storage.open(name, 'rb'), as_attachment=True, filename=os.path.basename(name))